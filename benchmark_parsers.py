@@ -0,0 +1,43 @@
+import argparse
+import sys
+
+from fpds_parsers import available_backends, compare_backends, time_backend
+
+# Sample FPDS ATOM page covering awards, IDVs, referenced IDVs and sparse entries
+SAMPLE_FILE = "samples/fpds_sample_page.xml"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check that the XML parser backends agree and compare their speed.")
+    parser.add_argument('files', nargs='*', default=[SAMPLE_FILE], help="saved ATOM feed pages to parse")
+    parser.add_argument('--repeat', type=int, default=200, help="times each page is parsed for timing")
+    args = parser.parse_args()
+
+    backends = available_backends()
+    print(f"Backends: {', '.join(backends)}")
+
+    failed = False
+    for filename in args.files:
+        with open(filename, 'rb') as file:
+            xml_data = file.read()
+
+        # Conformance: every backend must produce identical records
+        mismatches = compare_backends(xml_data, backends)
+        if mismatches:
+            failed = True
+            print(f"{filename}: {len(mismatches)} mismatches")
+            for index, field, values in mismatches[:20]:
+                print(f"  entry {index} {field}: {values}")
+        else:
+            print(f"{filename}: all backends produced identical records")
+
+        timings = {name: time_backend(name, xml_data, args.repeat) for name in backends}
+        baseline = timings['etree']
+        for name, seconds in timings.items():
+            print(f"  {name}: {seconds * 1e6:.1f} us/entry ({baseline / seconds:.2f}x etree)")
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,279 @@
+import hashlib
+import json
+import threading
+import uuid
+from datetime import datetime
+from decimal import Decimal
+
+from psycopg2.extras import Json, execute_values
+
+from fpds_fields import FIELD_NAMES, FIELD_TYPES
+
+# Fields identifying one transaction across runs
+NATURAL_KEY = ['contractingOfficeAgencyID', 'PIID', 'modNumber', 'referencedIDVPIID']
+
+# Latest content hash and values of every transaction seen, keyed by natural key
+STATE_TABLE = "record_state"
+
+# Change sets of every run, one row per inserted or updated transaction
+CHANGES_TABLE = "record_changes"
+
+# Natural keys looked up in the state table per query
+LOOKUP_CHUNK = 5000
+
+# fpds_raw rows read per round trip when seeding the state table
+SEED_CHUNK = 10000
+
+
+def natural_key(record):
+    """
+    Returns the natural key of a record as one string, e.g. '9700|W91QUZ23C0001|P00001|'.
+    """
+    return "|".join(record.get(field) or '' for field in NATURAL_KEY)
+
+
+def natural_key_match(raw, keys, columns=NATURAL_KEY):
+    """
+    Returns a join condition matching fpds_raw rows to a set of natural keys.
+
+    PIID is compared directly, so the PIID and natural key indexes can be used; the key parts that may be missing are
+    compared with IS NOT DISTINCT FROM, treating '' as missing.
+
+    Args:
+        raw: The alias of fpds_raw.
+        keys: The alias of the table or VALUES list holding the keys.
+        columns: The keys' columns, in NATURAL_KEY order. Defaults to the fpds_raw column names.
+    """
+    conditions = []
+    for field, column in zip(NATURAL_KEY, columns):
+        if field == 'PIID':
+            conditions.append(f"{raw}.{field} = {keys}.{column}")
+        else:
+            conditions.append(f"{raw}.{field} IS NOT DISTINCT FROM NULLIF({keys}.{column}, '')")
+    return " AND ".join(conditions)
+
+
+def content_hash(record, fields=FIELD_NAMES):
+    """
+    Returns a hash of a record's field values, so unchanged transactions can be recognised without comparing fields.
+    """
+    values = json.dumps([record.get(field) or '' for field in fields], separators=(',', ':'))
+    return hashlib.blake2b(values.encode('utf-8'), digest_size=16).hexdigest()
+
+
+def changed_fields(old, new, fields=FIELD_NAMES):
+    """
+    Returns {field: [old value, new value]} for the fields that differ between two versions of a record.
+    """
+    return {field: [old.get(field), new.get(field)] for field in fields
+            if (old.get(field) or '') != (new.get(field) or '')}
+
+
+def create_change_tables(conn):
+    """
+    Creates the state and changes tables if they do not already exist.
+
+    Args:
+        conn: An open psycopg2 connection. The caller is responsible for committing.
+    """
+    cur = conn.cursor()
+    cur.execute(f"""
+        CREATE TABLE IF NOT EXISTS {STATE_TABLE} (
+            natural_key TEXT PRIMARY KEY,
+            content_hash TEXT NOT NULL,
+            record JSONB NOT NULL,
+            updated_at TIMESTAMP NOT NULL DEFAULT now()
+        )
+    """)
+    cur.execute(f"""
+        CREATE TABLE IF NOT EXISTS {CHANGES_TABLE} (
+            id BIGSERIAL PRIMARY KEY,
+            run_id TEXT NOT NULL,
+            op TEXT NOT NULL,
+            natural_key TEXT NOT NULL,
+            changed JSONB,
+            record JSONB NOT NULL,
+            changed_at TIMESTAMP NOT NULL DEFAULT now()
+        )
+    """)
+    cur.execute(f"CREATE INDEX IF NOT EXISTS {CHANGES_TABLE}_run_idx ON {CHANGES_TABLE} (run_id)")
+    cur.close()
+
+
+def stored_record(row, fields=FIELD_NAMES):
+    """
+    Returns an fpds_raw row as the string values the feed parser produces, so it hashes like the parsed record.
+    """
+    record = {}
+    for field, value in zip(fields, row):
+        if value is None:
+            value = ''
+        elif isinstance(value, datetime):
+            value = value.strftime('%Y-%m-%d %H:%M:%S')
+        elif FIELD_TYPES.get(field) == 'amount' and isinstance(value, int):
+            # Amounts stored as integer cents
+            value = str(Decimal(value).scaleb(-2))
+        else:
+            value = str(value)
+        record[field] = value
+    return record
+
+
+def seed_state(conn, raw_table="fpds_raw"):
+    """
+    Fills an empty state table from the rows already in fpds_raw, so turning the change feed on for a loaded table
+    does not report (and reload) every stored transaction as new.
+
+    Values are hashed in the form the feed publishes them; a stored row whose values were formatted differently
+    shows up once as an update.
+
+    Args:
+        conn: An open psycopg2 connection. The caller is responsible for committing.
+        raw_table: The raw table.
+
+    Returns:
+        The number of transactions seeded.
+    """
+    cur = conn.cursor()
+    cur.execute(f"SELECT EXISTS (SELECT 1 FROM {STATE_TABLE}), to_regclass(%s)", (raw_table,))
+    has_state, raw_exists = cur.fetchone()
+    if has_state or raw_exists is None:
+        cur.close()
+        return 0
+
+    rows = conn.cursor(name="record_state_seed")
+    rows.itersize = SEED_CHUNK
+    rows.execute(f"SELECT {', '.join(FIELD_NAMES)} FROM {raw_table}")
+    seeded = 0
+    while True:
+        chunk = rows.fetchmany(SEED_CHUNK)
+        if not chunk:
+            break
+        state = {}
+        for row in chunk:
+            record = stored_record(row)
+            state[natural_key(record)] = (content_hash(record), Json(record))
+        execute_values(cur, f"""
+            INSERT INTO {STATE_TABLE} (natural_key, content_hash, record) VALUES %s
+            ON CONFLICT (natural_key) DO NOTHING
+        """, [(key,) + value for key, value in state.items()], page_size=1000)
+        seeded += len(state)
+    rows.close()
+    cur.close()
+    if seeded:
+        print(f"Seeded {STATE_TABLE} with {seeded} transactions from {raw_table}.")
+    return seeded
+
+
+class ChangeTracker:
+    """
+    Classifies incoming records as inserts, updates or no-ops against the state stored by earlier runs.
+
+    Each run gets a run_id. Its change set is written to the record_changes table and, optionally, to a JSONL delta
+    file with one line per insert or update:
+
+        {"run_id": ..., "op": "update", "natural_key": ..., "changed": {"field": [old, new], ...}, "record": {...}}
+
+    No-ops are only counted, so downstream jobs read just the delta.
+    """
+
+    def __init__(self, delta_path=None, write_table=True, run_id=None, raw_table="fpds_raw"):
+        """
+        Args:
+            delta_path: Optional JSONL file the change set is appended to.
+            write_table: Also record the change set in the record_changes table.
+            run_id: Identifies this run's changes. Defaults to a timestamp plus a random suffix.
+            raw_table: The raw table an empty state table is seeded from, see seed_state().
+        """
+        self.delta_path = delta_path
+        self.raw_table = raw_table
+        self.write_table = write_table
+        self.run_id = run_id or f"{datetime.now():%Y%m%dT%H%M%S}-{uuid.uuid4().hex[:8]}"
+        self.counts = {'insert': 0, 'update': 0, 'noop': 0}
+        self._lock = threading.Lock()
+        self._ready = False
+
+    def classify(self, conn, records):
+        """
+        Classifies a batch of raw parsed records against the stored state, without writing anything.
+
+        Args:
+            conn: An open psycopg2 connection.
+            records: The raw parsed records.
+
+        Returns:
+            The list of changes, each a dictionary with op ('insert' or 'update'), natural_key, changed (the changed
+            fields of an update) and record. Unchanged records are only counted.
+        """
+        cur = conn.cursor()
+        if not self._ready:
+            create_change_tables(conn)
+            seed_state(conn, self.raw_table)
+            conn.commit()
+            self._ready = True
+
+        # Later duplicates of a key within the batch win, as they would have across runs
+        incoming = {}
+        for record in records:
+            incoming[natural_key(record)] = record
+
+        stored = {}
+        keys = list(incoming)
+        for start in range(0, len(keys), LOOKUP_CHUNK):
+            cur.execute(f"SELECT natural_key, content_hash, record FROM {STATE_TABLE} WHERE natural_key = ANY(%s)",
+                        (keys[start:start + LOOKUP_CHUNK],))
+            stored.update((key, (hashed, record)) for key, hashed, record in cur.fetchall())
+        cur.close()
+
+        changes = []
+        unchanged = 0
+        for key, record in incoming.items():
+            hashed = content_hash(record)
+            previous = stored.get(key)
+            if previous is None:
+                changes.append({'op': 'insert', 'natural_key': key, 'hash': hashed, 'changed': None, 'record': record})
+            elif previous[0] != hashed:
+                changes.append({'op': 'update', 'natural_key': key, 'hash': hashed,
+                                'changed': changed_fields(previous[1], record), 'record': record})
+            else:
+                unchanged += 1
+        with self._lock:
+            self.counts['noop'] += unchanged
+        return changes
+
+    def record(self, conn, changes):
+        """
+        Stores the new state of changed records and writes the change set.
+
+        Call this once the changed records have loaded, so a failed load is detected as a change again next run.
+
+        Args:
+            conn: An open psycopg2 connection. The caller is responsible for committing.
+            changes: The changes returned by classify().
+        """
+        if not changes:
+            return
+        cur = conn.cursor()
+        execute_values(cur, f"""
+            INSERT INTO {STATE_TABLE} (natural_key, content_hash, record) VALUES %s
+            ON CONFLICT (natural_key) DO UPDATE SET
+                content_hash = EXCLUDED.content_hash, record = EXCLUDED.record, updated_at = now()
+        """, [(change['natural_key'], change['hash'], Json(change['record'])) for change in changes], page_size=1000)
+        if self.write_table:
+            execute_values(cur, f"INSERT INTO {CHANGES_TABLE} (run_id, op, natural_key, changed, record) VALUES %s",
+                           [(self.run_id, change['op'], change['natural_key'], Json(change['changed']),
+                             Json(change['record'])) for change in changes], page_size=1000)
+        cur.close()
+
+        with self._lock:
+            for change in changes:
+                self.counts[change['op']] += 1
+            if self.delta_path:
+                with open(self.delta_path, mode='a', encoding='utf-8') as file:
+                    for change in changes:
+                        delta = {key: value for key, value in change.items() if key != 'hash'}
+                        file.write(json.dumps({'run_id': self.run_id, **delta}, default=str) + '\n')
+
+    def report(self):
+        print(f"Change set {self.run_id}: {self.counts['insert']} inserts, {self.counts['update']} updates, "
+              f"{self.counts['noop']} unchanged.")
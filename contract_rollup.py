@@ -0,0 +1,346 @@
+import argparse
+from datetime import datetime
+
+import psycopg2
+from psycopg2.extras import execute_values
+
+from pg_schema import live_condition
+
+# Database configuration - currently using pgsql Docker container
+DATABASE = "fpds"
+USER = "postgres"  # replace with your username/env variable
+PASSWORD = "default"  # replace with your password/env variable
+HOST = "0.0.0.0"
+PORT = "5432"
+
+# One row per contract (agency, PIID, referenced IDV) holding the state as of its latest modification
+CURRENT_TABLE = "contract_current"
+
+# One row per IDV with the number of orders placed against it and their aggregated totals
+IDV_TABLE = "idv_rollup"
+
+# contract_current columns and the record fields they take from the latest modification
+CURRENT_COLUMNS = [
+    ('mod_number', 'modNumber', 'TEXT'),
+    ('idv_mod_number', 'IDVModNumber', 'TEXT'),
+    ('signed_date', 'signedDate', 'TIMESTAMP'),
+    ('modified', 'modified', 'TIMESTAMP'),
+    ('effective_date', 'effectiveDate', 'TIMESTAMP'),
+    ('current_completion_date', 'currentCompletionDate', 'TIMESTAMP'),
+    ('ultimate_completion_date', 'ultimateCompletionDate', 'TIMESTAMP'),
+    ('total_obligated_amount', 'totalObligatedAmount', 'NUMERIC'),
+    ('total_base_and_exercised_options_value', 'totalBaseAndExercisedOptionsValue', 'NUMERIC'),
+    ('total_base_and_all_options_value', 'totalBaseAndAllOptionsValue', 'NUMERIC'),
+    ('uei', 'UEI', 'TEXT'),
+    ('vendor_name', 'vendorName', 'TEXT'),
+    ('ultimate_parent_uei', 'ultimateParentUEI', 'TEXT'),
+    ('funding_agency_id', 'fundingRequestingAgencyID', 'TEXT'),
+    ('principal_naics_code', 'principalNAICSCode', 'TEXT'),
+    ('product_or_service_code', 'productOrServiceCode', 'TEXT'),
+    ('description', 'descriptionOfContractRequirement', 'TEXT'),
+]
+
+# Class id of the transaction-level advisory locks serializing the re-aggregation of each IDV across loaders
+IDV_LOCK_CLASS = 39
+
+KEY_COLUMNS = [
+    ('agency_id', 'contractingOfficeAgencyID'),
+    ('piid', 'PIID'),
+    ('referenced_idv_piid', 'referencedIDVPIID'),
+]
+
+
+def create_rollup_tables(conn):
+    """
+    Creates the contract_current and idv_rollup tables if they do not already exist.
+
+    Args:
+        conn: An open psycopg2 connection. The caller is responsible for committing.
+    """
+    cur = conn.cursor()
+    column_ddl = ", ".join(f"{column} {sql_type}" for column, _, sql_type in CURRENT_COLUMNS)
+    cur.execute(f"""
+        CREATE TABLE IF NOT EXISTS {CURRENT_TABLE} (
+            agency_id TEXT NOT NULL DEFAULT '',
+            piid TEXT NOT NULL,
+            referenced_idv_piid TEXT NOT NULL DEFAULT '',
+            {column_ddl},
+            updated_at TIMESTAMP NOT NULL DEFAULT now(),
+            PRIMARY KEY (agency_id, piid, referenced_idv_piid)
+        )
+    """)
+    cur.execute(f"CREATE INDEX IF NOT EXISTS {CURRENT_TABLE}_idv_idx ON {CURRENT_TABLE} (referenced_idv_piid)")
+    cur.execute(f"CREATE INDEX IF NOT EXISTS {CURRENT_TABLE}_piid_idx ON {CURRENT_TABLE} (piid)")
+    cur.execute(f"""
+        CREATE TABLE IF NOT EXISTS {IDV_TABLE} (
+            idv_piid TEXT PRIMARY KEY,
+            order_count INTEGER NOT NULL,
+            total_obligated_amount NUMERIC,
+            total_base_and_exercised_options_value NUMERIC,
+            total_base_and_all_options_value NUMERIC,
+            first_signed_date TIMESTAMP,
+            last_signed_date TIMESTAMP,
+            updated_at TIMESTAMP NOT NULL DEFAULT now()
+        )
+    """)
+    cur.close()
+
+
+def contract_key(row):
+    return tuple(row.get(field) or '' for _, field in KEY_COLUMNS)
+
+
+def modification_order(row):
+    """
+    Sort key placing later modifications last: by signedDate, then by the feed's modified time.
+    """
+    return (row.get('signedDate') or datetime.min, row.get('modified') or datetime.min)
+
+
+# The stored row is replaced only by the same or a later modification, so batches can arrive in any order
+_LATER_THAN_STORED = f"""
+    (coalesce(EXCLUDED.signed_date, '-infinity'), coalesce(EXCLUDED.modified, '-infinity'))
+    >= (coalesce({CURRENT_TABLE}.signed_date, '-infinity'), coalesce({CURRENT_TABLE}.modified, '-infinity'))
+"""
+
+
+class ContractRollup:
+    """
+    Keeps contract_current and idv_rollup up to date as batches load.
+
+    Each batch is reduced to the latest modification per contract and upserted into contract_current, replacing a
+    stored row only with the same or a later modification. The IDVs referenced by the changed contracts are then
+    re-aggregated from their orders' current rows, so the work per batch depends on the contracts it touches, not on
+    the size of fpds_raw.
+    """
+
+    def __init__(self):
+        self.ready = False
+
+    def update(self, conn, rows):
+        """
+        Rolls up a batch of converted rows (see type_conversion.convert_batch()).
+
+        Args:
+            conn: An open psycopg2 connection. Runs in the caller's transaction.
+            rows: The converted rows of the batch.
+        """
+        if not self.ready:
+            create_rollup_tables(conn)
+            self.ready = True
+
+        latest = {}
+        for row in rows:
+            key = contract_key(row)
+            if not key[1]:
+                continue
+            if key not in latest or modification_order(row) >= modification_order(latest[key]):
+                latest[key] = row
+        if not latest:
+            return
+
+        # Sorted so concurrent loaders lock contract rows in the same order
+        values = [key + tuple(row.get(field) for _, field, _ in CURRENT_COLUMNS)
+                  for key, row in sorted(latest.items())]
+        columns = [column for column, _ in KEY_COLUMNS] + [column for column, _, _ in CURRENT_COLUMNS]
+        updates = ", ".join(f"{column} = EXCLUDED.{column}" for column, _, _ in CURRENT_COLUMNS)
+        cur = conn.cursor()
+        execute_values(cur, f"""
+            INSERT INTO {CURRENT_TABLE} ({', '.join(columns)}) VALUES %s
+            ON CONFLICT (agency_id, piid, referenced_idv_piid) DO UPDATE SET {updates}, updated_at = now()
+            WHERE {_LATER_THAN_STORED}
+        """, values, page_size=1000)
+
+        idvs = sorted({key[2] for key in latest if key[2]})
+        if idvs:
+            self.aggregate_idvs(cur, idvs)
+        cur.close()
+
+    def aggregate_idvs(self, cur, idvs, lock=True):
+        """
+        Recomputes the idv_rollup rows of the given IDV PIIDs from contract_current.
+
+        Parallel loaders would each aggregate without the others' uncommitted orders, and the later upsert would
+        write stale totals, so each IDV is locked until the transaction commits first. The aggregate then runs in a
+        statement started after the lock, which sees every order committed by the loader that held it.
+
+        Args:
+            cur: A cursor in the loading transaction.
+            idvs: The IDV PIIDs.
+            lock: Take the per-IDV locks; rebuild() already holds the tables exclusively.
+        """
+        if lock:
+            # In one consistent order, so loaders locking overlapping IDVs cannot deadlock
+            cur.execute("""
+                SELECT pg_advisory_xact_lock(%s, key)
+                FROM (SELECT DISTINCT hashtext(idv) AS key FROM unnest(%s::text[]) AS idv ORDER BY key) keys
+            """, (IDV_LOCK_CLASS, list(idvs)))
+        cur.execute(f"""
+            INSERT INTO {IDV_TABLE} (idv_piid, order_count, total_obligated_amount,
+                total_base_and_exercised_options_value, total_base_and_all_options_value, first_signed_date,
+                last_signed_date)
+            SELECT referenced_idv_piid, count(*), sum(total_obligated_amount),
+                sum(total_base_and_exercised_options_value), sum(total_base_and_all_options_value), min(signed_date),
+                max(signed_date)
+            FROM {CURRENT_TABLE}
+            WHERE referenced_idv_piid = ANY(%s)
+            GROUP BY referenced_idv_piid
+            ON CONFLICT (idv_piid) DO UPDATE SET
+                order_count = EXCLUDED.order_count,
+                total_obligated_amount = EXCLUDED.total_obligated_amount,
+                total_base_and_exercised_options_value = EXCLUDED.total_base_and_exercised_options_value,
+                total_base_and_all_options_value = EXCLUDED.total_base_and_all_options_value,
+                first_signed_date = EXCLUDED.first_signed_date,
+                last_signed_date = EXCLUDED.last_signed_date,
+                updated_at = now()
+        """, (idvs,))
+        # IDVs whose last order was removed, see refresh()
+        cur.execute(f"""
+            DELETE FROM {IDV_TABLE} WHERE idv_piid = ANY(%s)
+                AND NOT EXISTS (SELECT 1 FROM {CURRENT_TABLE} WHERE referenced_idv_piid = idv_piid)
+        """, (idvs,))
+
+    def rebuild(self, conn, table="fpds_raw"):
+        """
+        Rebuilds both tables from scratch out of fpds_raw, e.g. after a bulk load through a staging table.
+
+        Args:
+            conn: An open psycopg2 connection. The caller is responsible for committing.
+            table: The raw table to roll up.
+        """
+        create_rollup_tables(conn)
+        self.ready = True
+        cur = conn.cursor()
+        key_fields = ", ".join(f"coalesce({field}, '')" for _, field in KEY_COLUMNS)
+        source = ", ".join([f"coalesce({field}, '')" for _, field in KEY_COLUMNS] +
+                           [field for _, field, _ in CURRENT_COLUMNS])
+        columns = [column for column, _ in KEY_COLUMNS] + [column for column, _, _ in CURRENT_COLUMNS]
+        cur.execute(f"TRUNCATE {CURRENT_TABLE}, {IDV_TABLE}")
+        cur.execute(f"""
+            INSERT INTO {CURRENT_TABLE} ({', '.join(columns)})
+            SELECT DISTINCT ON ({key_fields}) {source}
+            FROM {table}
+            WHERE PIID IS NOT NULL AND PIID <> '' AND {live_condition(cur, table)}
+            ORDER BY {key_fields}, signedDate DESC NULLS LAST, modified DESC NULLS LAST
+        """)
+        contracts = cur.rowcount
+        cur.execute(f"SELECT DISTINCT referenced_idv_piid FROM {CURRENT_TABLE} WHERE referenced_idv_piid <> ''")
+        idvs = [row[0] for row in cur.fetchall()]
+        self.aggregate_idvs(cur, idvs, lock=False)
+        cur.close()
+        print(f"Rolled up {contracts} contracts and {len(idvs)} IDVs.")
+
+    def refresh(self, conn, keys, table="fpds_raw"):
+        """
+        Recomputes the contract_current rows of some contracts from fpds_raw, e.g. after some of their transactions
+        were deleted, and re-aggregates the IDVs they are ordered against. Contracts with no rows left are removed.
+
+        Args:
+            conn: An open psycopg2 connection. The caller is responsible for committing.
+            keys: The contracts' keys, see contract_key().
+            table: The raw table.
+        """
+        keys = sorted({key for key in keys if key[1]})
+        if not keys:
+            return
+        create_rollup_tables(conn)
+        self.ready = True
+        cur = conn.cursor()
+        key_columns = ", ".join(column for column, _ in KEY_COLUMNS)
+        execute_values(cur, f"""
+            DELETE FROM {CURRENT_TABLE} stored USING (VALUES %s) AS refreshed ({key_columns})
+            WHERE {' AND '.join(f"stored.{column} = refreshed.{column}" for column, _ in KEY_COLUMNS)}
+        """, keys, page_size=1000)
+
+        key_fields = ", ".join(f"coalesce(raw.{field}, '')" for _, field in KEY_COLUMNS)
+        source = ", ".join([f"coalesce(raw.{field}, '')" for _, field in KEY_COLUMNS] +
+                           [f"raw.{field}" for _, field, _ in CURRENT_COLUMNS])
+        columns = [column for column, _ in KEY_COLUMNS] + [column for column, _, _ in CURRENT_COLUMNS]
+        updates = ", ".join(f"{column} = EXCLUDED.{column}" for column, _, _ in CURRENT_COLUMNS)
+        # PIID is compared directly, so the PIID index finds each contract's rows
+        match = " AND ".join(f"raw.{field} = refreshed.{column}" if field == 'PIID'
+                             else f"coalesce(raw.{field}, '') = refreshed.{column}" for column, field in KEY_COLUMNS)
+        execute_values(cur, f"""
+            INSERT INTO {CURRENT_TABLE} ({', '.join(columns)})
+            SELECT DISTINCT ON ({key_fields}) {source}
+            FROM {table} raw JOIN (VALUES %s) AS refreshed ({key_columns}) ON {match}
+            WHERE {live_condition(cur, table, 'raw')}
+            ORDER BY {key_fields}, raw.signedDate DESC NULLS LAST, raw.modified DESC NULLS LAST
+            ON CONFLICT (agency_id, piid, referenced_idv_piid) DO UPDATE SET {updates}, updated_at = now()
+            WHERE {_LATER_THAN_STORED}
+        """, keys, page_size=1000)
+
+        idvs = sorted({key[2] for key in keys if key[2]})
+        if idvs:
+            self.aggregate_idvs(cur, idvs)
+        cur.close()
+        print(f"Refreshed the roll-up of {len(keys)} contracts and {len(idvs)} IDVs.")
+
+    def insert_with_rollup(self, insert_rows):
+        """
+        Wraps an insert_rows function for pg_loader.load_records() so each batch is rolled up in the same
+        transaction it is loaded in.
+        """
+        def insert_and_roll_up(conn, rows):
+            insert_rows(conn, rows)
+            self.update(conn, rows)
+        return insert_and_roll_up
+
+
+CONTRACT_ROLLUP = ContractRollup()
+
+
+def contract_tree(conn, piid):
+    """
+    Returns an IDV and every order placed against it, following IDVs referenced by other IDVs (e.g. BPAs under a
+    schedule), depth first.
+
+    Args:
+        conn: An open psycopg2 connection.
+        piid: The PIID of the IDV at the top of the tree.
+
+    Returns:
+        A list of (depth, piid, referenced IDV PIID, vendor name, total obligated amount) tuples.
+    """
+    cur = conn.cursor()
+    cur.execute(f"""
+        WITH RECURSIVE tree AS (
+            SELECT 0 AS depth, piid, referenced_idv_piid, vendor_name, total_obligated_amount,
+                ARRAY[piid] AS path
+            FROM {CURRENT_TABLE} WHERE piid = %s
+            UNION ALL
+            SELECT tree.depth + 1, child.piid, child.referenced_idv_piid, child.vendor_name,
+                child.total_obligated_amount, tree.path || child.piid
+            FROM {CURRENT_TABLE} child
+            JOIN tree ON child.referenced_idv_piid = tree.piid
+            WHERE NOT child.piid = ANY(tree.path)
+        )
+        SELECT depth, piid, referenced_idv_piid, vendor_name, total_obligated_amount FROM tree ORDER BY path
+    """, (piid,))
+    rows = cur.fetchall()
+    cur.close()
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Contract current-state and IDV rollups.")
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('rebuild', help="rebuild the rollups from fpds_raw")
+    tree = commands.add_parser('tree', help="print an IDV and the orders placed against it")
+    tree.add_argument('piid')
+    args = parser.parse_args()
+
+    conn = psycopg2.connect(dbname=DATABASE, user=USER, password=PASSWORD, host=HOST, port=PORT)
+    try:
+        if args.command == 'rebuild':
+            CONTRACT_ROLLUP.rebuild(conn)
+            conn.commit()
+        elif args.command == 'tree':
+            for depth, piid, referenced, vendor, obligated in contract_tree(conn, args.piid):
+                print(f"{'  ' * depth}{piid} {vendor or ''} {obligated if obligated is not None else ''}".rstrip())
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
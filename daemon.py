@@ -0,0 +1,262 @@
+import argparse
+import json
+import signal
+import threading
+import time
+from datetime import date, datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import psycopg2
+
+from change_feed import NATURAL_KEY, content_hash, natural_key
+from dead_letters import DeadLetterFile
+from fpds_feed import RATE_LIMITER, set_projection
+from fpds_filters import FilterSet
+from job_spec import expand_shards, load_job_spec, parse_date, shard_url
+from sinks import create_sink
+from work_scheduler import MAX_WORKERS, WORKERS, JobScheduler
+
+# Minutes between the starts of two polling cycles
+POLL_MINUTES = 15
+
+# Where the health and metrics endpoint listens; local only
+METRICS_HOST = "127.0.0.1"
+METRICS_PORT = 8088
+
+# /health reports failing once the last successful cycle is this many intervals old
+STALE_CYCLES = 3
+
+
+class PollingDaemon:
+    """
+    Runs a job spec's queries every few minutes in one long-lived process.
+
+    Each cycle queries LAST_MOD_DATE from the day of the last complete cycle through today, so it only pays for the
+    pages modified since. The HTTP session, the sink (and with it any Postgres connections and loader pools), the
+    scheduler's tuned worker count and the lookup caches filled while parsing all stay warm between cycles. Records
+    already written in an earlier cycle with the same content are skipped, since the current day is queried again
+    every cycle; a Postgres output replaces the stored rows of transactions fetched again, e.g. after a restart. A cycle
+    failing on a database error reconnects the sink before the next one.
+    """
+
+    def __init__(self, spec, interval_minutes=POLL_MINUTES, since=None):
+        """
+        Args:
+            spec: The job spec, see job_spec.load_job_spec(). Its queries' dates are replaced by the polling window.
+            interval_minutes: Minutes between the starts of two cycles.
+            since: First day of the first cycle. Defaults to today.
+
+        Raises:
+            ValueError: If the output is a bulk Postgres load, which only reaches fpds_raw on close.
+        """
+        output = dict(spec.get('output') or {})
+        if output.get('bulk'):
+            raise ValueError("bulk outputs only load on close, use a regular postgres output for the daemon")
+        if output.get('type') == 'postgres':
+            # The seen map is lost on restart and a transaction can change during the polled day, so a record fetched
+            # again replaces its stored row instead of adding a second one
+            output.setdefault('replace', True)
+        if spec.get('requests_per_second'):
+            RATE_LIMITER.set_rate(spec['requests_per_second'])
+
+        self.spec = spec
+        self.interval = interval_minutes * 60
+        self.window_start = since or date.today()
+        self.record_filter = FilterSet(spec.get('filters', []))
+        print(self.record_filter.describe())
+        self.dead_letters = DeadLetterFile(spec.get('dead_letters', "dead_letters.jsonl"))
+        self.output = output
+        self.fields = spec.get('fields')
+        self.sink = create_sink(output, self.dead_letters, self.fields)
+        # The natural key is parsed too, to recognise records written in an earlier cycle
+        set_projection(list(dict.fromkeys(list(self.fields or []) + list(self.sink.fields) +
+                                          self.record_filter.fields + NATURAL_KEY)))
+        # Today is queried again next cycle, which picks up what changed while this one paged through it
+        self.scheduler = JobScheduler(spec.get('workers', WORKERS), self.dead_letters, self._write_shard,
+                                      spec.get('max_workers', MAX_WORKERS), include_today=True)
+        # Natural key -> (content hash, last day of the window it was fetched in) of the records written lately
+        self.seen = {}
+        self.window_end = None
+        self.stop_event = threading.Event()
+        self.started_at = time.time()
+        self.metrics = {'cycles': 0, 'cycle_failures': 0, 'records_written': 0, 'records_skipped': 0,
+                        'last_cycle_seconds': 0.0, 'last_cycle_records': 0, 'last_success': None}
+        self._lock = threading.Lock()
+
+    def _write_shard(self, shard, records):
+        records = self.record_filter.apply(records)
+        new = {}
+        for record in records:
+            key, hashed = natural_key(record), content_hash(record)
+            if self.seen.get(key, (None,))[0] != hashed:
+                new[key] = (hashed, record)
+        self.sink.write([record for _, record in new.values()])
+        # Only records the sink took are remembered; a failed write is retried by the next cycle's window
+        for key, (hashed, _) in new.items():
+            self.seen[key] = (hashed, self.window_end)
+        with self._lock:
+            self.metrics['last_cycle_records'] += len(new)
+            self.metrics['records_written'] += len(new)
+            self.metrics['records_skipped'] += len(records) - len(new)
+
+    def reconnect(self):
+        """
+        Replaces the sink after a database error, whose connections may be broken or left in a failed transaction.
+        """
+        try:
+            self.sink.close()
+        except Exception as exc:
+            print(f"Closing the sink failed: {exc}")
+        self.sink = create_sink(self.output, self.dead_letters, self.fields)
+
+    def cycle(self):
+        """
+        Runs one polling cycle over the window from the last complete cycle's day through today.
+        """
+        today = date.today()
+        self.window_end = today
+        queries = [{**query, 'start_date': self.window_start, 'end_date': today} for query in self.spec['queries']]
+        shards = [shard._replace(criteria=self.record_filter.query_criteria(shard.criteria))
+                  for shard in expand_shards({**self.spec, 'queries': queries})]
+        with self._lock:
+            self.metrics['last_cycle_records'] = 0
+
+        self.scheduler.run({shard: shard_url(shard) for shard in shards})
+        self.sink.flush()
+
+        # A cycle with failed pages leaves the window where it was, so the next one fetches those days again
+        if not self.scheduler.failed_shards:
+            self.window_start = today
+            # Only records fetched in a window reaching into the next one can come back
+            self.seen = {key: value for key, value in self.seen.items() if value[1] >= today}
+        return not self.scheduler.failed_shards
+
+    def run(self, host=METRICS_HOST, port=METRICS_PORT):
+        """
+        Runs cycles until stop() is called, serving /health and /metrics in the background.
+        """
+        server = ThreadingHTTPServer((host, port), self._handler())
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        print(f"Polling every {self.interval / 60:g} minutes; health and metrics on http://{host}:{port}/")
+        try:
+            while not self.stop_event.is_set():
+                cycle_start = time.time()
+                try:
+                    complete = self.cycle()
+                except Exception as exc:
+                    print(f"Polling cycle failed: {exc}")
+                    complete = False
+                    if isinstance(exc, psycopg2.Error):
+                        try:
+                            self.reconnect()
+                        except psycopg2.Error as reconnect_exc:
+                            # The next cycle writes to the old sink, fails again and retries the reconnect
+                            print(f"Reconnecting failed: {reconnect_exc}")
+                duration = time.time() - cycle_start
+                with self._lock:
+                    self.metrics['cycles'] += 1
+                    self.metrics['last_cycle_seconds'] = duration
+                    if complete:
+                        self.metrics['last_success'] = time.time()
+                    else:
+                        self.metrics['cycle_failures'] += 1
+                print(f"Cycle complete in {duration:.1f}s: {self.metrics['last_cycle_records']} records written.")
+                self.stop_event.wait(max(self.interval - duration, 0))
+        finally:
+            server.shutdown()
+            self.sink.close()
+
+    def stop(self):
+        self.stop_event.set()
+
+    def health(self):
+        """
+        Returns the health document: status is 'ok' unless the last successful cycle is STALE_CYCLES intervals old.
+        """
+        with self._lock:
+            last_success = self.metrics['last_success']
+            cycles = self.metrics['cycles']
+        reference = last_success or self.started_at
+        healthy = time.time() - reference < STALE_CYCLES * self.interval
+        return {
+            'status': 'ok' if healthy else 'failing',
+            'cycles': cycles,
+            'window_start': f"{self.window_start:%Y-%m-%d}",
+            'last_success': datetime.fromtimestamp(last_success).isoformat(timespec='seconds')
+            if last_success else None,
+        }
+
+    def metrics_text(self):
+        """
+        Returns the metrics in the Prometheus text format.
+        """
+        with self._lock:
+            metrics = dict(self.metrics)
+        lines = [
+            "# TYPE fpds_daemon_cycles_total counter",
+            f"fpds_daemon_cycles_total {metrics['cycles']}",
+            "# TYPE fpds_daemon_cycle_failures_total counter",
+            f"fpds_daemon_cycle_failures_total {metrics['cycle_failures']}",
+            "# TYPE fpds_daemon_records_written_total counter",
+            f"fpds_daemon_records_written_total {metrics['records_written']}",
+            "# TYPE fpds_daemon_records_skipped_total counter",
+            f"fpds_daemon_records_skipped_total {metrics['records_skipped']}",
+            "# TYPE fpds_daemon_dead_letters_total counter",
+            f"fpds_daemon_dead_letters_total {self.dead_letters.count}",
+            "# TYPE fpds_daemon_last_cycle_seconds gauge",
+            f"fpds_daemon_last_cycle_seconds {metrics['last_cycle_seconds']:.3f}",
+            "# TYPE fpds_daemon_last_cycle_records gauge",
+            f"fpds_daemon_last_cycle_records {metrics['last_cycle_records']}",
+            "# TYPE fpds_daemon_last_success_timestamp_seconds gauge",
+            f"fpds_daemon_last_success_timestamp_seconds {metrics['last_success'] or 0:.0f}",
+            "# TYPE fpds_daemon_workers gauge",
+            f"fpds_daemon_workers {self.scheduler.concurrency.limit}",
+        ]
+        return "\n".join(lines) + "\n"
+
+    def _handler(self):
+        daemon = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path == '/health':
+                    health = daemon.health()
+                    body = json.dumps(health).encode('utf-8')
+                    self._send(200 if health['status'] == 'ok' else 503, 'application/json', body)
+                elif self.path == '/metrics':
+                    self._send(200, 'text/plain; version=0.0.4', daemon.metrics_text().encode('utf-8'))
+                else:
+                    self._send(404, 'text/plain', b"not found\n")
+
+            def _send(self, status, content_type, body):
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Poll a job spec's queries on a schedule in one resident process.")
+    parser.add_argument('job_file', help="job spec file (.json, .toml or .yaml); query dates are ignored")
+    parser.add_argument('--interval', type=float, default=POLL_MINUTES, help="minutes between cycles")
+    parser.add_argument('--since', help="first LAST_MOD_DATE day of the first cycle, YYYY-MM-DD; defaults to today")
+    parser.add_argument('--port', type=int, default=METRICS_PORT, help="health and metrics port")
+    args = parser.parse_args()
+
+    spec = load_job_spec(args.job_file, require_dates=False)
+    daemon = PollingDaemon(spec, args.interval, parse_date(args.since) if args.since else None)
+    signal.signal(signal.SIGTERM, lambda signum, frame: daemon.stop())
+    try:
+        daemon.run(port=args.port)
+    except KeyboardInterrupt:
+        print("Stopping.")
+
+
+if __name__ == "__main__":
+    main()
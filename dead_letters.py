@@ -0,0 +1,65 @@
+import json
+import threading
+from datetime import datetime
+
+DEAD_LETTER_FILE = "dead_letters.jsonl"
+
+
+class DeadLetterFile:
+    """
+    Append-only JSONL file of the pages and rows that failed during a run.
+
+    Each line holds the kind ('page' or 'row'), the page URL, the error and, for rows, the raw parsed record, so
+    the failures can be inspected and reprocessed later with reprocess_dead_letters.py.
+    """
+
+    def __init__(self, path=DEAD_LETTER_FILE):
+        self.path = path
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def _write(self, entry):
+        entry['failed_at'] = datetime.now().isoformat(timespec='seconds')
+        line = json.dumps(entry, default=str)
+        with self._lock:
+            with open(self.path, mode='a', encoding='utf-8') as file:
+                file.write(line + '\n')
+            self.count += 1
+
+    def record_page(self, url, error):
+        """
+        Records a feed page that could not be fetched or parsed.
+
+        Args:
+            url: The page URL.
+            error: The exception or error message.
+        """
+        self._write({'kind': 'page', 'url': url, 'error': str(error)})
+
+    def record_row(self, record, error, url=None):
+        """
+        Records a parsed record that could not be loaded.
+
+        Args:
+            record: The raw parsed record dictionary.
+            error: The exception or error message.
+            url: The page the record came from, if known.
+        """
+        self._write({'kind': 'row', 'url': url, 'error': str(error), 'record': record})
+
+
+def read_dead_letters(path=DEAD_LETTER_FILE):
+    """
+    Reads the entries of a dead-letter file.
+
+    Args:
+        path: The dead-letter file.
+
+    Returns:
+        A list of entry dictionaries, empty if the file does not exist.
+    """
+    try:
+        with open(path, encoding='utf-8') as file:
+            return [json.loads(line) for line in file if line.strip()]
+    except FileNotFoundError:
+        return []
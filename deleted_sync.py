@@ -0,0 +1,216 @@
+import argparse
+import time
+from datetime import date, datetime
+
+import psycopg2
+from psycopg2.extras import execute_values
+
+from change_feed import NATURAL_KEY, STATE_TABLE, natural_key, natural_key_match
+from contract_rollup import CONTRACT_ROLLUP, CURRENT_TABLE, contract_key
+from dead_letters import DeadLetterFile
+from fpds_feed import build_query_url, set_projection
+from pg_schema import DELETED_COLUMN, RAW_TABLE, create_raw_table
+from type_conversion import convert_timestamp
+from work_scheduler import WORKERS, JobScheduler
+
+# Database configuration - currently using pgsql Docker container
+DATABASE = "fpds"
+USER = "postgres"  # replace with your username/env variable
+PASSWORD = "default"  # replace with your password/env variable
+HOST = "0.0.0.0"
+PORT = "5432"
+
+# FEEDNAME of the FPDS feed listing deleted transactions
+DELETED_FEED = "DELETED"
+
+# Last LAST_MOD_DATE day synced from each feed, so every run only pulls what is new
+WATERMARK_TABLE = "sync_watermarks"
+
+# Every deleted transaction seen, kept as a tombstone for downstream jobs
+DELETED_TABLE = "deleted_transactions"
+
+# Mark deleted rows in fpds_raw with deleted_at instead of deleting them
+TOMBSTONES = False
+
+
+def create_sync_tables(conn):
+    """
+    Creates the watermark and deleted-transactions tables if they do not already exist.
+
+    Args:
+        conn: An open psycopg2 connection. The caller is responsible for committing.
+    """
+    cur = conn.cursor()
+    cur.execute(f"""
+        CREATE TABLE IF NOT EXISTS {WATERMARK_TABLE} (
+            feed TEXT PRIMARY KEY,
+            last_day DATE NOT NULL,
+            updated_at TIMESTAMP NOT NULL DEFAULT now()
+        )
+    """)
+    cur.execute(f"""
+        CREATE TABLE IF NOT EXISTS {DELETED_TABLE} (
+            natural_key TEXT PRIMARY KEY,
+            agency_id TEXT NOT NULL,
+            piid TEXT NOT NULL,
+            mod_number TEXT NOT NULL,
+            referenced_idv_piid TEXT NOT NULL,
+            deleted_modified TIMESTAMP,
+            synced_at TIMESTAMP NOT NULL DEFAULT now()
+        )
+    """)
+    cur.close()
+
+
+def get_watermark(conn, feed=DELETED_FEED):
+    cur = conn.cursor()
+    cur.execute(f"SELECT last_day FROM {WATERMARK_TABLE} WHERE feed = %s", (feed,))
+    row = cur.fetchone()
+    cur.close()
+    return row[0] if row else None
+
+
+def set_watermark(conn, day, feed=DELETED_FEED):
+    cur = conn.cursor()
+    cur.execute(f"""
+        INSERT INTO {WATERMARK_TABLE} (feed, last_day) VALUES (%s, %s)
+        ON CONFLICT (feed) DO UPDATE SET last_day = EXCLUDED.last_day, updated_at = now()
+    """, (feed, day))
+    cur.close()
+
+
+def apply_deletes(conn, records, tombstones=TOMBSTONES, table=RAW_TABLE):
+    """
+    Removes deleted transactions from fpds_raw and the change-feed state in bulk, by natural key, and refreshes the
+    contract roll-ups of their contracts so they stop counting.
+
+    Args:
+        conn: An open psycopg2 connection. The caller is responsible for committing.
+        records: Records parsed from the DELETED feed.
+        tombstones: Set fpds_raw.deleted_at instead of deleting the rows.
+        table: The raw table.
+
+    Returns:
+        The number of fpds_raw rows deleted or marked.
+    """
+    keys = {}
+    for record in records:
+        keys[natural_key(record)] = record
+    if not keys:
+        return 0
+
+    deleted_modified = {}
+    for key, record in keys.items():
+        try:
+            deleted_modified[key] = convert_timestamp(record['modified']) if record.get('modified') else None
+        except ValueError:
+            # The delete still applies, only its timestamp is lost
+            print(f"Deleted transaction {key} has an invalid modified time {record['modified']!r}.")
+            deleted_modified[key] = None
+
+    cur = conn.cursor()
+    execute_values(cur, f"""
+        INSERT INTO {DELETED_TABLE} (natural_key, agency_id, piid, mod_number, referenced_idv_piid, deleted_modified)
+        VALUES %s
+        ON CONFLICT (natural_key) DO UPDATE SET deleted_modified = EXCLUDED.deleted_modified, synced_at = now()
+    """, [(key,) + tuple(record.get(field) or '' for field in NATURAL_KEY) + (deleted_modified[key],)
+          for key, record in keys.items()], page_size=1000)
+
+    # One join against the batch's keys instead of a statement per transaction
+    match = natural_key_match('raw', 'deleted', ['agency_id', 'piid', 'mod_number', 'referenced_idv_piid'])
+    if tombstones:
+        # Readers of fpds_raw leave the marked rows out, see pg_schema.live_condition()
+        cur.execute(f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS {DELETED_COLUMN} TIMESTAMP")
+        cur.execute(f"""
+            UPDATE {table} raw SET {DELETED_COLUMN} = now() FROM {DELETED_TABLE} deleted
+            WHERE {match} AND deleted.natural_key = ANY(%s) AND raw.{DELETED_COLUMN} IS NULL
+        """, (list(keys),))
+    else:
+        cur.execute(f"""
+            DELETE FROM {table} raw USING {DELETED_TABLE} deleted
+            WHERE {match} AND deleted.natural_key = ANY(%s)
+        """, (list(keys),))
+    affected = cur.rowcount
+
+    # A deleted transaction that is published again is then seen as an insert by the change feed
+    cur.execute("SELECT to_regclass(%s)", (STATE_TABLE,))
+    if cur.fetchone()[0] is not None:
+        cur.execute(f"DELETE FROM {STATE_TABLE} WHERE natural_key = ANY(%s)", (list(keys),))
+
+    # Only when the roll-ups are kept, i.e. a load ran with rollup on
+    cur.execute("SELECT to_regclass(%s)", (CURRENT_TABLE,))
+    if cur.fetchone()[0] is not None and affected:
+        CONTRACT_ROLLUP.refresh(conn, [contract_key(record) for record in keys.values()], table)
+    cur.close()
+    return affected
+
+
+def sync_deleted(conn, since=None, until=None, tombstones=TOMBSTONES, workers=WORKERS, dead_letters=None):
+    """
+    Pulls the DELETED feed from the watermark on and applies the deletes, moving the watermark in the same
+    transaction.
+
+    The watermark day itself is pulled again, since deletions keep arriving during the day; applying a delete twice
+    has no effect.
+
+    Args:
+        conn: An open psycopg2 connection.
+        since: First day to pull when there is no watermark yet, or to override it.
+        until: Last day to pull. Defaults to today.
+        tombstones: Mark rows deleted instead of deleting them.
+        workers: Worker threads, or "auto".
+        dead_letters: Optional DeadLetterFile.
+
+    Returns:
+        The number of fpds_raw rows deleted or marked.
+
+    Raises:
+        ValueError: If there is no watermark and no since day.
+    """
+    create_raw_table(conn)
+    create_sync_tables(conn)
+    conn.commit()
+
+    start = since or get_watermark(conn)
+    if start is None:
+        raise ValueError("no deleted-records watermark yet, pass the first day to sync")
+    until = until or date.today()
+    print(f"Syncing deleted transactions modified {start:%Y-%m-%d}..{until:%Y-%m-%d}.")
+
+    # Only the natural key is needed to apply a delete
+    set_projection(NATURAL_KEY + ['modified'])
+    scheduler = JobScheduler(workers, dead_letters)
+    records = scheduler.run({DELETED_FEED: build_query_url(f"{start:%Y-%m-%d}", f"{until:%Y-%m-%d}",
+                                                           feed=DELETED_FEED)})
+    affected = apply_deletes(conn, records, tombstones)
+    if scheduler.failed_shards:
+        # Keep the watermark so the missed pages are pulled again next run
+        print("Some pages of the deleted feed failed; the watermark was not moved.")
+    else:
+        set_watermark(conn, until)
+    conn.commit()
+    print(f"{len(records)} deleted transactions, {affected} rows {'marked' if tombstones else 'deleted'}.")
+    return affected
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Apply transactions deleted from FPDS to fpds_raw.")
+    parser.add_argument('--since', help="first LAST_MOD_DATE day to pull, YYYY-MM-DD; defaults to the watermark")
+    parser.add_argument('--tombstone', action='store_true', default=TOMBSTONES,
+                        help="set fpds_raw.deleted_at instead of deleting rows")
+    args = parser.parse_args()
+
+    start_time = time.time()
+    since = datetime.strptime(args.since, '%Y-%m-%d').date() if args.since else None
+    conn = psycopg2.connect(dbname=DATABASE, user=USER, password=PASSWORD, host=HOST, port=PORT)
+    try:
+        sync_deleted(conn, since, tombstones=args.tombstone, dead_letters=DeadLetterFile())
+    finally:
+        conn.close()
+
+    duration = time.time() - start_time
+    print(f'Sync complete. Time taken: {duration}')
+
+
+if __name__ == "__main__":
+    main()
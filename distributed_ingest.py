@@ -0,0 +1,434 @@
+import argparse
+import json
+import os
+import socket
+import threading
+import time
+
+import psycopg2
+
+from dead_letters import DeadLetterFile
+from fpds_feed import PAGE_SIZE, RATE_LIMITER, fetch_page, page_start, page_url
+from fpds_filters import FilterSet
+from job_spec import expand_shards, load_job_spec, shard_label, shard_url
+from pg_loader import load_records
+from pg_schema import create_raw_table, insert_partitioned_rows
+from type_conversion import convert_batch, report_rejects
+from vendor_hierarchy import VENDOR_HIERARCHY
+
+# Database configuration - currently using pgsql Docker container. The queue lives in the same database as fpds_raw.
+DATABASE = "fpds"
+USER = "postgres"  # replace with your username/env variable
+PASSWORD = "default"  # replace with your password/env variable
+HOST = "0.0.0.0"
+PORT = "5432"
+
+QUEUE_TABLE = "ingest_tasks"
+
+# One row per job, holding the filter predicates workers evaluate on parsed records
+JOBS_TABLE = "ingest_jobs"
+
+# A claimed task goes back to the queue if its worker has not finished it within this many seconds
+LEASE_SECONDS = 300
+
+# Attempts (including ones lost to crashed workers) before a task is marked failed
+MAX_ATTEMPTS = 5
+
+# How long an idle worker waits before polling the queue again while other workers still hold tasks
+POLL_SECONDS = 5
+
+
+class LeaseLost(Exception):
+    """
+    Raised when a worker finishes a task whose expired lease another worker has taken over.
+    """
+
+
+def connect():
+    return psycopg2.connect(dbname=DATABASE, user=USER, password=PASSWORD, host=HOST, port=PORT)
+
+
+def create_queue_table(conn):
+    """
+    Creates the shared task queue if it does not already exist.
+
+    Each task is one feed page. 'shard' tasks are the first page of a query; the worker that runs one queues the
+    rest of that query's pages as 'page' tasks. (job, url) is unique, so queueing the same page twice is a no-op.
+    The jobs table keeps each job's filter predicates that the feed cannot evaluate.
+
+    Args:
+        conn: An open psycopg2 connection. The caller is responsible for committing.
+    """
+    cur = conn.cursor()
+    cur.execute(f"""
+        CREATE TABLE IF NOT EXISTS {QUEUE_TABLE} (
+            id BIGSERIAL PRIMARY KEY,
+            job TEXT NOT NULL,
+            kind TEXT NOT NULL,
+            shard TEXT NOT NULL,
+            url TEXT NOT NULL,
+            priority INTEGER NOT NULL DEFAULT 0,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            worker TEXT,
+            lease_until TIMESTAMPTZ,
+            records INTEGER,
+            error TEXT,
+            created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+            updated_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+            UNIQUE (job, url)
+        )
+    """)
+    cur.execute(f"CREATE INDEX IF NOT EXISTS {QUEUE_TABLE}_claim_idx ON {QUEUE_TABLE} (job, status, priority, id)")
+    cur.execute(f"""
+        CREATE TABLE IF NOT EXISTS {JOBS_TABLE} (
+            job TEXT PRIMARY KEY,
+            filters JSONB NOT NULL DEFAULT '[]',
+            created_at TIMESTAMPTZ NOT NULL DEFAULT now()
+        )
+    """)
+    cur.close()
+
+
+def enqueue_job(path, job=None):
+    """
+    Coordinator: expands a job spec into shards and queues the first page of each.
+
+    The spec's filters are split as in run_jobs.run_job(): the predicates the feed supports are added to each shard's
+    query, and the rest are stored with the job for the workers to evaluate on parsed records.
+
+    Args:
+        path: The job spec file, see job_spec.load_job_spec().
+        job: The job name tasks are queued under. Defaults to the spec file name without its extension.
+
+    Returns:
+        The job name.
+    """
+    job = job or os.path.splitext(os.path.basename(path))[0]
+    spec = load_job_spec(path)
+    record_filter = FilterSet(spec.get('filters', []))
+    shards = [shard._replace(criteria=record_filter.query_criteria(shard.criteria)) for shard in expand_shards(spec)]
+    print(record_filter.describe())
+    conn = connect()
+    try:
+        create_queue_table(conn)
+        create_raw_table(conn)
+        cur = conn.cursor()
+        cur.execute(f"""
+            INSERT INTO {JOBS_TABLE} (job, filters) VALUES (%s, %s)
+            ON CONFLICT (job) DO UPDATE SET filters = EXCLUDED.filters
+        """, (job, json.dumps([list(predicate) for predicate in record_filter.local])))
+        queued = 0
+        for shard in shards:
+            cur.execute(f"""
+                INSERT INTO {QUEUE_TABLE} (job, kind, shard, url) VALUES (%s, 'shard', %s, %s)
+                ON CONFLICT (job, url) DO NOTHING
+            """, (job, shard_label(shard), shard_url(shard)))
+            queued += cur.rowcount
+        conn.commit()
+        cur.close()
+    finally:
+        conn.close()
+    print(f"Job {job}: queued {queued} of {len(shards)} shards.")
+    return job
+
+
+def job_filter(conn, job):
+    """
+    Returns a FilterSet evaluating the predicates stored with a job by enqueue_job(), all of them locally.
+    """
+    cur = conn.cursor()
+    cur.execute(f"SELECT filters FROM {JOBS_TABLE} WHERE job = %s", (job,))
+    row = cur.fetchone()
+    conn.commit()
+    cur.close()
+    return FilterSet(row[0] if row else [], pushdown=False)
+
+
+def claim_task(conn, job, worker):
+    """
+    Claims the next task of a job, taking over tasks whose lease has expired.
+
+    SKIP LOCKED lets any number of workers claim concurrently without blocking on each other's rows.
+
+    Returns:
+        A tuple of (id, kind, shard, url), or None if nothing is claimable right now.
+    """
+    cur = conn.cursor()
+    # Tasks abandoned by crashed workers too many times are given up on rather than retried forever
+    cur.execute(f"""
+        UPDATE {QUEUE_TABLE} SET status = 'failed', error = coalesce(error, 'lease expired'), updated_at = now()
+        WHERE job = %s AND status = 'running' AND lease_until < now() AND attempts >= %s
+    """, (job, MAX_ATTEMPTS))
+    cur.execute(f"""
+        UPDATE {QUEUE_TABLE} SET status = 'running', worker = %s, attempts = attempts + 1,
+            lease_until = now() + make_interval(secs => %s), updated_at = now()
+        WHERE id = (
+            SELECT id FROM {QUEUE_TABLE}
+            WHERE job = %s AND (status = 'pending' OR (status = 'running' AND lease_until < now()))
+                AND attempts < %s
+            ORDER BY priority, id
+            LIMIT 1
+            FOR UPDATE SKIP LOCKED
+        )
+        RETURNING id, kind, shard, url
+    """, (worker, LEASE_SECONDS, job, MAX_ATTEMPTS))
+    task = cur.fetchone()
+    conn.commit()
+    cur.close()
+    return task
+
+
+def job_active(conn, job):
+    """
+    Returns True while the job has tasks that are pending or held by a worker.
+    """
+    cur = conn.cursor()
+    cur.execute(f"SELECT EXISTS (SELECT 1 FROM {QUEUE_TABLE} WHERE job = %s AND status IN ('pending', 'running'))",
+                (job,))
+    active = cur.fetchone()[0]
+    conn.commit()
+    cur.close()
+    return active
+
+
+def queue_pages(cur, job, shard, url, links):
+    """
+    Queues the remaining pages of a shard after its first page, using the 'last' link for the page count.
+    """
+    if links['last']:
+        page_count = page_start(links['last']) // PAGE_SIZE + 1
+        urls = [page_url(url, page * PAGE_SIZE) for page in range(1, page_count)]
+    else:
+        # Without a 'last' link the shard can only be followed one next link at a time
+        page_count = 0
+        urls = [links['next']] if links['next'] else []
+    for next_url in urls:
+        cur.execute(f"""
+            INSERT INTO {QUEUE_TABLE} (job, kind, shard, url, priority) VALUES (%s, 'page', %s, %s, %s)
+            ON CONFLICT (job, url) DO NOTHING
+        """, (job, shard, next_url, page_count))
+
+
+def finish_task(cur, task_id, worker, records):
+    """
+    Marks a task done, provided the worker still holds it.
+
+    Returns:
+        False if the lease expired and another worker has claimed the task since.
+    """
+    cur.execute(f"""
+        UPDATE {QUEUE_TABLE} SET status = 'done', records = %s, lease_until = NULL, error = NULL, updated_at = now()
+        WHERE id = %s AND worker = %s AND status = 'running'
+    """, (records, task_id, worker))
+    return cur.rowcount == 1
+
+
+def fail_task(conn, task_id, worker, error):
+    """
+    Returns a task to the queue after an error, or marks it failed once it has used MAX_ATTEMPTS. A task another
+    worker has taken over in the meantime is left alone.
+
+    Returns:
+        True if the task was marked failed.
+    """
+    cur = conn.cursor()
+    cur.execute(f"""
+        UPDATE {QUEUE_TABLE}
+        SET status = CASE WHEN attempts >= %s THEN 'failed' ELSE 'pending' END,
+            lease_until = NULL, error = %s, updated_at = now()
+        WHERE id = %s AND worker = %s AND status = 'running'
+        RETURNING status
+    """, (MAX_ATTEMPTS, str(error), task_id, worker))
+    row = cur.fetchone()
+    failed = row is not None and row[0] == 'failed'
+    conn.commit()
+    cur.close()
+    return failed
+
+
+def run_task(conn, job, task, worker, dead_letters, record_filter=None):
+    """
+    Fetches, parses and loads one page, then marks its task done. With record_filter, only the page's records
+    matching it are loaded.
+
+    The rows, the follow-up page tasks and the done mark commit in one transaction, so a worker crashing part way
+    leaves the task to be retried without having loaded anything. If the page's rows do not load as a batch, they are
+    loaded row by row with dead letters like any other load, still in that transaction. Nothing commits if another
+    worker has taken the task over after this worker's lease expired.
+
+    Returns:
+        The number of records on the page that passed the filter.
+
+    Raises:
+        LeaseLost: If the task is no longer held by this worker; the transaction is rolled back.
+    """
+    task_id, kind, shard, url = task
+    records, links = fetch_page(url)
+    if record_filter is not None:
+        records = record_filter.apply(records)
+
+    cur = conn.cursor()
+    rows, rejects = convert_batch(records)
+    report_rejects(rejects)
+    try:
+        insert_partitioned_rows(conn, rows)
+        if kind == 'shard' or not links['last']:
+            queue_pages(cur, job, shard, url, links)
+        held = finish_task(cur, task_id, worker, len(records))
+    except psycopg2.Error as e:
+        conn.rollback()
+        print(f"Page {url} failed as a batch, loading one row at a time: {e}")
+        load_records(conn, records, insert_partitioned_rows, dead_letters, commit=False)
+        if kind == 'shard' or not links['last']:
+            queue_pages(cur, job, shard, url, links)
+        held = finish_task(cur, task_id, worker, len(records))
+    if not held:
+        conn.rollback()
+        cur.close()
+        raise LeaseLost(f"{url} was taken over by another worker after its lease expired")
+    conn.commit()
+    cur.close()
+    return len(records)
+
+
+def work(job, threads=1, wait=False, dead_letters=None):
+    """
+    Worker: claims and runs tasks of a job until the queue is drained.
+
+    Any number of workers can run at once on any number of hosts; each thread holds its own connection.
+
+    Args:
+        job: The job name given to enqueue_job().
+        threads: Worker threads in this process.
+        wait: Keep polling for new tasks after the job is drained, e.g. while the coordinator is still queueing.
+        dead_letters: Optional DeadLetterFile receiving the pages and rows that failed for good.
+    """
+    worker_name = f"{socket.gethostname()}:{os.getpid()}"
+    dead_letters = dead_letters or DeadLetterFile()
+    totals = {'tasks': 0, 'records': 0}
+    totals_lock = threading.Lock()
+
+    def worker_loop(index):
+        conn = connect()
+        name = f"{worker_name}:{index}"
+        try:
+            # The job's residual filters, so a filtered job loads the same records as under run_jobs.py
+            record_filter = job_filter(conn, job)
+            while True:
+                task = claim_task(conn, job, name)
+                if task is None:
+                    if not wait and not job_active(conn, job):
+                        return
+                    time.sleep(POLL_SECONDS)
+                    continue
+                try:
+                    count = run_task(conn, job, task, name, dead_letters, record_filter)
+                except LeaseLost as exc:
+                    print(f"Skipping: {exc}")
+                    continue
+                except Exception as exc:
+                    conn.rollback()
+                    print(f"{task[3]} generated an exception: {exc}")
+                    if fail_task(conn, task[0], name, exc):
+                        dead_letters.record_page(task[3], exc)
+                    continue
+                with totals_lock:
+                    totals['tasks'] += 1
+                    totals['records'] += count
+        finally:
+            conn.close()
+
+    start_time = time.time()
+    workers = [threading.Thread(target=worker_loop, args=(index,)) for index in range(threads)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+
+    # Vendor hierarchy rows are upserts, so every worker can persist the part it has seen
+    conn = connect()
+    try:
+        VENDOR_HIERARCHY.persist(conn)
+        conn.commit()
+    finally:
+        conn.close()
+
+    duration = time.time() - start_time
+    print(f"Worker {worker_name} done: {totals['tasks']} pages, {totals['records']} records. Time taken: {duration}")
+
+
+def job_status(job):
+    """
+    Prints the number of tasks and records of a job by status.
+    """
+    conn = connect()
+    try:
+        cur = conn.cursor()
+        cur.execute(f"""
+            SELECT status, count(*), coalesce(sum(records), 0) FROM {QUEUE_TABLE}
+            WHERE job = %s GROUP BY status ORDER BY status
+        """, (job,))
+        rows = cur.fetchall()
+        cur.close()
+    finally:
+        conn.close()
+    if not rows:
+        print(f"Job {job} has no tasks.")
+    for status, count, records in rows:
+        print(f"{job} {status}: {count} pages, {records} records")
+
+
+def retry_failed(job):
+    """
+    Puts a job's failed tasks back in the queue with their attempts reset.
+    """
+    conn = connect()
+    try:
+        cur = conn.cursor()
+        cur.execute(f"""
+            UPDATE {QUEUE_TABLE} SET status = 'pending', attempts = 0, lease_until = NULL, updated_at = now()
+            WHERE job = %s AND status = 'failed'
+        """, (job,))
+        print(f"Job {job}: {cur.rowcount} failed tasks queued again.")
+        conn.commit()
+        cur.close()
+    finally:
+        conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Distributed ingest through a shared Postgres task queue.")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    enqueue = commands.add_parser('enqueue', help="queue the shards of a job spec file (coordinator)")
+    enqueue.add_argument('job_file', help="job spec file (.json, .toml or .yaml)")
+    enqueue.add_argument('--job', help="job name, defaults to the job file name")
+
+    worker = commands.add_parser('work', help="claim and run tasks until the job is drained")
+    worker.add_argument('job')
+    worker.add_argument('--threads', type=int, default=1, help="worker threads in this process")
+    worker.add_argument('--wait', action='store_true', help="keep polling after the queue is drained")
+    worker.add_argument('--requests-per-second', type=float, help="rate limit for this process")
+
+    status = commands.add_parser('status', help="show task counts by status")
+    status.add_argument('job')
+
+    retry = commands.add_parser('retry-failed', help="queue a job's failed tasks again")
+    retry.add_argument('job')
+
+    args = parser.parse_args()
+    if args.command == 'enqueue':
+        enqueue_job(args.job_file, args.job)
+    elif args.command == 'work':
+        if args.requests_per_second:
+            RATE_LIMITER.set_rate(args.requests_per_second)
+        work(args.job, args.threads, args.wait)
+    elif args.command == 'status':
+        job_status(args.job)
+    elif args.command == 'retry-failed':
+        retry_failed(args.job)
+
+
+if __name__ == "__main__":
+    main()
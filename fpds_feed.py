@@ -0,0 +1,367 @@
+import re
+import threading
+import time
+from urllib.parse import parse_qs, urlencode, urlparse, urlunparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from change_feed import NATURAL_KEY
+from fpds_fields import projection_fields
+from fpds_parsers import NS, get_backend
+from lookup_tables import intern_record
+from vendor_hierarchy import VENDOR_HIERARCHY
+
+# FPDS ATOM feed base URL
+ATOM_FEED_BASE_URL = "https://www.fpds.gov/ezsearch/FEEDS/ATOM"
+
+# award sample: https://www.fpds.gov/ezsearch/FEEDS/ATOM?FEEDNAME=PUBLIC&q=LAST_MOD_DATE:[2023/03/21,2023/03/21]
+# IDV sample: https://www.fpds.gov/ezsearch/FEEDS/ATOM?s=FPDS&FEEDNAME=PUBLIC&VERSION=1.5.3&q=PIID%3AW31P4Q08D0006
+
+# The feed returns 10 entries per page, addressed by the start= offset of the next/last links
+PAGE_SIZE = 10
+
+# Seconds to wait for a feed response
+REQUEST_TIMEOUT = 60
+
+# Parse pages incrementally as the response body arrives instead of decoding the whole page and building a DOM
+STREAM_PAGES = True
+
+# Bytes read from the response per chunk when streaming
+STREAM_CHUNK_SIZE = 64 * 1024
+
+# Maximum requests per second to the feed across all threads, None for no limit
+REQUESTS_PER_SECOND = None
+
+# HTTP connections kept open to the feed and shared by all threads
+HTTP_POOL_SIZE = 32
+
+# Feed queried by default; FPDS publishes deleted transactions separately in the DELETED feed
+FEED_NAME = "PUBLIC"
+
+# Query criteria accepted by build_query_url(), mapped to their ATOM feed search fields
+QUERY_FIELDS = {
+    'funding_agency_id': 'FUNDING_AGENCY_ID',
+    'funding_office_id': 'FUNDING_OFFICE_ID',
+    'contracting_agency_id': 'CONTRACTING_AGENCY_ID',
+    'contracting_office_id': 'CONTRACTING_OFFICE_ID',
+    'ultimate_uei': 'ULTIMATE_UEI',
+    'naics': 'PRINCIPAL_NAICS_CODE',
+    'psc': 'PRODUCT_OR_SERVICE_CODE',
+    'piid': 'PIID',
+    'ref_idv_piid': 'REF_IDV_PIID',
+    'signed_date': 'SIGNED_DATE',
+}
+
+# XML backend used to parse pages: lxml when it is installed, otherwise the stdlib ElementTree. See set_projection()
+PARSER = get_backend()
+
+
+def set_projection(fields=None):
+    """
+    Makes every page parse only the given fields, so narrow jobs skip the lookups and strings of fields they do not
+    use. Records then only have these keys, plus the natural key, which the scheduler needs to spot a transaction
+    repeated across pages.
+
+    Args:
+        fields: Field names from the field spec, or None for every field.
+
+    Returns:
+        The projected fields, in record order.
+
+    Raises:
+        ValueError: If a field is not in the field spec.
+    """
+    global PARSER
+    fields = projection_fields(fields and list(fields) + NATURAL_KEY)
+    PARSER = get_backend(PARSER.name, fields)
+    print(f"Parsing {len(fields)} fields with the {PARSER.name} backend.")
+    return fields
+
+
+class RateLimiter:
+    """
+    Token bucket limiting how often requests are sent, shared by every thread of the process.
+    """
+
+    def __init__(self, rate=None):
+        self.rate = rate
+        self._next = 0.0
+        self._lock = threading.Lock()
+
+    def set_rate(self, rate):
+        with self._lock:
+            self.rate = rate
+
+    def acquire(self):
+        """
+        Blocks until the next request may be sent.
+        """
+        if not self.rate:
+            return
+        with self._lock:
+            now = time.monotonic()
+            wait = self._next - now
+            self._next = max(now, self._next) + 1.0 / self.rate
+        if wait > 0:
+            time.sleep(wait)
+
+
+RATE_LIMITER = RateLimiter(REQUESTS_PER_SECOND)
+
+
+def create_session(pool_size=HTTP_POOL_SIZE):
+    """
+    Creates a requests session whose connection pool is large enough for every worker thread.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+# Shared HTTP session, so connections to the feed are reused across pages, queries and threads
+SESSION = create_session()
+
+
+def build_query_url(start_date, end_date, criteria=None, feed=FEED_NAME):
+    """
+    Builds the URL of the first page of a feed query.
+
+    Args:
+        start_date: First LAST_MOD_DATE day (inclusive), e.g. '2024-01-01', or None for no date range.
+        end_date: Last LAST_MOD_DATE day (inclusive).
+        criteria: Optional dictionary of QUERY_FIELDS keys to values, e.g. {'naics': '5413*'}. A (first, last) pair
+            becomes an inclusive range, e.g. {'signed_date': ('2024-01-01', '2024-03-31')}.
+        feed: The FEEDNAME, 'PUBLIC' or 'DELETED'.
+
+    Returns:
+        The query URL.
+    """
+    query = ''
+    if start_date is not None and end_date is not None:
+        query += f"+LAST_MOD_DATE:[{start_date},{end_date}]"
+    for key, value in (criteria or {}).items():
+        if isinstance(value, (tuple, list)):
+            query += f"+{QUERY_FIELDS[key]}:[{value[0]},{value[1]}]"
+        elif value is not None:
+            query += f"+{QUERY_FIELDS[key]}:\"{value}\""
+    return f"{ATOM_FEED_BASE_URL}?FEEDNAME={feed}&q={query}"
+
+
+def fetch_fpds_data(url):
+    """
+    Fetches a single page of the ATOM feed.
+
+    Args:
+        url: The page URL.
+
+    Returns:
+        The response body as text.
+
+    Raises:
+        requests.RequestException: If the request fails or returns an error status.
+    """
+    # test url https://www.fpds.gov/ezsearch/FEEDS/ATOM?FEEDNAME=PUBLIC&q=LAST_MOD_DATE:[2016-01-01,2023-12-31]+ULTIMATE_UEI:"W6ZWNL4GWP97"
+    print("Fetching URL:", url)
+
+    RATE_LIMITER.acquire()
+    response = SESSION.get(url, timeout=REQUEST_TIMEOUT)
+    response.raise_for_status()
+    return response.text
+
+
+def parse_entry(entry, parser=None):
+    """
+    Extracts a record from a single atom:entry element.
+
+    Args:
+        entry: The entry element, from the same backend as the parser.
+        parser: The ParserBackend to extract with. Defaults to PARSER.
+
+    Returns:
+        The record dictionary.
+    """
+    record = (parser or PARSER).parse_entry(entry)
+    print("Title: " + str(record.get('title')))
+    print("Modified: " + str(record.get('modified')))
+    print(f"PIID:{record.get('PIID')}  Ref IDV: {record.get('referencedIDVPIID')}")
+
+    # Share one string instance per distinct agency/NAICS/PSC/etc. value across all records
+    intern_record(record)
+    VENDOR_HIERARCHY.update(record)
+    print(record)
+    return record
+
+
+def get_link(root, rel, ns=NS):
+    link = root.find(f".//atom:link[@rel='{rel}']", ns)
+    return link.get('href') if link is not None and link.get('href') else None
+
+
+def parse_xml(xml_data, ns=NS):
+    """
+    Parses one page of the ATOM feed.
+
+    Args:
+        xml_data: The page XML.
+        ns: The namespace dictionary.
+
+    Returns:
+        A tuple of (records, links), where links maps 'next' and 'last' to their URLs (or None).
+    """
+    # Query structure available at https://www.fpds.gov/wiki/index.php/Atom_Feed_Usage
+    root = PARSER.fromstring(xml_data)
+    # test url: https://www.fpds.gov/ezsearch/FEEDS/ATOM?FEEDNAME=PUBLIC&q=LAST_MOD_DATE:[2023-11-01,2023-11-02]
+
+    records = [parse_entry(entry) for entry in root.findall('atom:entry', ns)]
+    links = {'next': get_link(root, 'next', ns), 'last': get_link(root, 'last', ns)}
+    return records, links
+
+
+def parse_stream(chunks, links=None, ns=NS):
+    """
+    Parses one page of the ATOM feed incrementally from an iterable of byte chunks.
+
+    Each atom:entry is parsed and yielded as soon as its closing tag arrives, then cleared and detached from the
+    tree, so memory stays at roughly one entry regardless of page size.
+
+    Args:
+        chunks: An iterable of bytes, e.g. response.iter_content().
+        links: Optional dictionary that receives the feed's 'next' and 'last' link URLs once they are seen.
+        ns: The namespace dictionary.
+
+    Yields:
+        One record per entry.
+    """
+    entry_tag = '{{{}}}entry'.format(ns['atom'])
+    link_tag = '{{{}}}link'.format(ns['atom'])
+    if links is None:
+        links = {}
+    links.setdefault('next', None)
+    links.setdefault('last', None)
+
+    parser = PARSER.pull_parser()
+    root = None
+    depth = 0
+    for chunk in chunks:
+        parser.feed(chunk)
+        for event, element in parser.read_events():
+            if event == 'start':
+                depth += 1
+                if root is None:
+                    root = element
+                continue
+            depth -= 1
+            # Only direct children of the feed; entries carry their own alternate links
+            if depth != 1:
+                continue
+            if element.tag == entry_tag:
+                yield parse_entry(element)
+                element.clear()
+                root.remove(element)
+            elif element.tag == link_tag and element.get('rel') in ('next', 'last'):
+                links[element.get('rel')] = element.get('href') or None
+    parser.close()
+
+
+def fetch_page(url, stream=STREAM_PAGES):
+    """
+    Fetches and parses a single page of the ATOM feed.
+
+    Args:
+        url: The page URL.
+        stream: Whether to parse the response body incrementally as it downloads.
+
+    Returns:
+        A tuple of (records, links), as returned by parse_xml().
+    """
+    if not stream:
+        return parse_xml(fetch_fpds_data(url))
+
+    print("Fetching URL:", url)
+    links = {}
+    RATE_LIMITER.acquire()
+    with SESSION.get(url, stream=True, timeout=REQUEST_TIMEOUT) as response:
+        response.raise_for_status()
+        records = list(parse_stream(response.iter_content(STREAM_CHUNK_SIZE), links))
+    return records, links
+
+
+def page_start(url):
+    """
+    Returns the start= offset of a feed URL, 0 for the first page.
+    """
+    values = parse_qs(urlparse(url).query).get('start')
+    return int(values[0]) if values else 0
+
+
+def page_url(url, start):
+    """
+    Returns the feed URL for the page at the given start= offset.
+    """
+    parts = urlparse(url)
+    query = parse_qs(parts.query, keep_blank_values=True)
+    query['start'] = [str(start)]
+    return urlunparse(parts._replace(query=urlencode(query, doseq=True, safe=':[],"*+')))
+
+
+_DATE_RANGE = re.compile(r"LAST_MOD_DATE:\[([^,\]]+),([^\]]+)\]")
+
+
+def pin_upper_bound(url, day):
+    """
+    Caps the LAST_MOD_DATE range of a feed URL at the given day, so a range ending today or later stops growing
+    while it is paged through. URLs without a date range are returned unchanged.
+
+    Args:
+        url: A feed URL.
+        day: The last LAST_MOD_DATE day to include, 'YYYY-MM-DD'.
+
+    Returns:
+        The capped URL, or None if the range starts after the day.
+    """
+    match = _DATE_RANGE.search(url)
+    if match is None or match.group(2).replace('/', '-') <= day:
+        return url
+    if match.group(1).replace('/', '-') > day:
+        return None
+    return f"{url[:match.start(2)]}{day}{url[match.end(2):]}"
+
+
+def fetch_all_pages(url, dead_letters=None):
+    """
+    Fetches and parses every page of a query, isolating failures to the page they happen on.
+
+    A page that fails to download or parse is written to the dead letters and skipped; since its next link is lost
+    with it, paging continues from the next start= offset as long as it is before the last page reported by the feed.
+
+    Args:
+        url: The URL of the first page.
+        dead_letters: Optional DeadLetterFile receiving the pages that failed.
+
+    Returns:
+        The records of every page that succeeded.
+    """
+    records = []
+    last_start = None
+    while url:
+        try:
+            page_records, links = fetch_page(url)
+        # SyntaxError covers malformed XML from both the ElementTree and lxml backends
+        except (requests.RequestException, SyntaxError, AttributeError, ValueError) as exc:
+            print(f"{url} generated an exception: {exc}")
+            if dead_letters is not None:
+                dead_letters.record_page(url, exc)
+            next_start = page_start(url) + PAGE_SIZE
+            url = page_url(url, next_start) if last_start is not None and next_start <= last_start else None
+            continue
+
+        records.extend(page_records)
+        if links['last'] is not None:
+            last_start = page_start(links['last'])
+        url = links['next']
+        if url:
+            print("### GOING TO NEXT PAGE ###")
+    return records
@@ -0,0 +1,191 @@
+# Field spec for parsed FPDS records, in record order. Each field is stored as one of:
+#   text      - kept as a string
+#   amount    - dollar amount, converted to Decimal (or integer cents) before loading
+#   timestamp - date/time, converted to datetime before loading
+FIELD_SPEC = [
+    ('title', 'text'),
+    ('modified', 'timestamp'),
+    ('PIID', 'text'),
+    ('modNumber', 'text'),
+    ('referencedIDVPIID', 'text'),
+    ('IDVModNumber', 'text'),
+    ('UEI', 'text'),
+    ('UEILegalBusinessName', 'text'),
+    ('immediateParentUEI', 'text'),
+    ('immediateParentUEIName', 'text'),
+    ('domesticParentUEI', 'text'),
+    ('domesticParentUEIName', 'text'),
+    ('ultimateParentUEI', 'text'),
+    ('ultimateParentUEIName', 'text'),
+    ('vendorName', 'text'),
+    ('vendorAlternateName', 'text'),
+    ('vendorLegalOrganizationName', 'text'),
+    ('vendorStreetAddress', 'text'),
+    ('vendorCity', 'text'),
+    ('vendorState', 'text'),
+    ('vendorZIPCode', 'text'),
+    ('vendorCountryCode', 'text'),
+    ('vendorPhoneNo', 'text'),
+    ('vendorFaxNo', 'text'),
+    ('vendorCongressionalDistrictCode', 'text'),
+    ('vendorEntityDataSource', 'text'),
+    ('obligatedAmount', 'amount'),
+    ('baseAndExercisedOptionsValue', 'amount'),
+    ('baseAndAllOptionsValue', 'amount'),
+    ('totalObligatedAmount', 'amount'),
+    ('totalBaseAndExercisedOptionsValue', 'amount'),
+    ('totalBaseAndAllOptionsValue', 'amount'),
+    ('signedDate', 'timestamp'),
+    ('effectiveDate', 'timestamp'),
+    ('currentCompletionDate', 'timestamp'),
+    ('ultimateCompletionDate', 'timestamp'),
+    ('fundingRequestingDepartmentID', 'text'),
+    ('fundingRequestingDepartmentName', 'text'),
+    ('fundingRequestingAgencyID', 'text'),
+    ('fundingRequestingAgencyName', 'text'),
+    ('fundingRequestingOfficeID', 'text'),
+    ('fundingRequestingOfficeName', 'text'),
+    ('contractingOfficeAgencyID', 'text'),
+    ('contractingOfficeID', 'text'),
+    ('principalNAICSCode', 'text'),
+    ('principalNAICSCodeDescription', 'text'),
+    ('productOrServiceCode', 'text'),
+    ('productOrServiceCodeDescription', 'text'),
+    ('reasonForModificationDescription', 'text'),
+    ('productOrServiceCodeType', 'text'),
+    ('descriptionOfContractRequirement', 'text'),
+    ('reasonForModification', 'text'),
+    ('createdBy', 'text'),
+    ('createdDate', 'timestamp'),
+    ('lastModifiedBy', 'text'),
+    ('lastModifiedDate', 'timestamp'),
+    ('approvedBy', 'text'),
+    ('approvedDate', 'timestamp'),
+    ('closedBy', 'text'),
+    ('closedDate', 'timestamp'),
+]
+
+
+# Where each field is found in an atom:entry. Locations are tuples of:
+#   ('atom', tag)                    - text of an atom: child of the entry, e.g. title
+#   ('text', element)                - text of the first ns1: element with that tag
+#   ('attribute', element, name)     - attribute of the first ns1: element with that tag
+#   ('nested', (parent, child), ...) - text of the first child under the first parent; alternatives are tried in order
+#                                      while the value is empty, e.g. awardContractID then IDVID for PIID
+FIELD_LOCATIONS = {
+    'title': ('atom', 'title'),
+    'modified': ('atom', 'modified'),
+    'PIID': ('nested', ('awardContractID', 'PIID'), ('IDVID', 'PIID')),
+    'modNumber': ('nested', ('awardContractID', 'modNumber'), ('IDVID', 'modNumber')),
+    'referencedIDVPIID': ('nested', ('referencedIDVID', 'PIID')),
+    'IDVModNumber': ('nested', ('referencedIDVID', 'modNumber')),
+    'UEI': ('text', 'UEI'),
+    'UEILegalBusinessName': ('text', 'UEILegalBusinessName'),
+    'immediateParentUEI': ('text', 'immediateParentUEI'),
+    'immediateParentUEIName': ('text', 'immediateParentUEIName'),
+    'domesticParentUEI': ('text', 'domesticParentUEI'),
+    'domesticParentUEIName': ('text', 'domesticParentUEIName'),
+    'ultimateParentUEI': ('text', 'ultimateParentUEI'),
+    'ultimateParentUEIName': ('text', 'ultimateParentUEIName'),
+    'vendorName': ('text', 'vendorName'),
+    'vendorAlternateName': ('text', 'vendorAlternateName'),
+    'vendorLegalOrganizationName': ('text', 'vendorLegalOrganizationName'),
+    'vendorStreetAddress': ('nested', ('vendorLocation', 'streetAddress')),
+    'vendorCity': ('nested', ('vendorLocation', 'city')),
+    'vendorState': ('nested', ('vendorLocation', 'state')),
+    'vendorZIPCode': ('nested', ('vendorLocation', 'ZIPCode')),
+    'vendorCountryCode': ('nested', ('vendorLocation', 'countryCode')),
+    'vendorPhoneNo': ('nested', ('vendorLocation', 'phoneNo')),
+    'vendorFaxNo': ('nested', ('vendorLocation', 'faxNo')),
+    'vendorCongressionalDistrictCode': ('nested', ('vendorLocation', 'congressionalDistrictCode')),
+    'vendorEntityDataSource': ('nested', ('vendorLocation', 'entityDataSource')),
+    'obligatedAmount': ('text', 'obligatedAmount'),
+    'baseAndExercisedOptionsValue': ('text', 'baseAndExercisedOptionsValue'),
+    'baseAndAllOptionsValue': ('text', 'baseAndAllOptionsValue'),
+    'totalObligatedAmount': ('text', 'totalObligatedAmount'),
+    'totalBaseAndExercisedOptionsValue': ('text', 'totalBaseAndExercisedOptionsValue'),
+    'totalBaseAndAllOptionsValue': ('text', 'totalBaseAndAllOptionsValue'),
+    'signedDate': ('text', 'signedDate'),
+    'effectiveDate': ('text', 'effectiveDate'),
+    'currentCompletionDate': ('text', 'currentCompletionDate'),
+    'ultimateCompletionDate': ('text', 'ultimateCompletionDate'),
+    'fundingRequestingDepartmentID': ('attribute', 'fundingRequestingAgencyID', 'departmentID'),
+    'fundingRequestingDepartmentName': ('attribute', 'fundingRequestingAgencyID', 'departmentName'),
+    'fundingRequestingAgencyID': ('text', 'fundingRequestingAgencyID'),
+    'fundingRequestingAgencyName': ('attribute', 'fundingRequestingAgencyID', 'name'),
+    'fundingRequestingOfficeID': ('text', 'fundingRequestingOfficeID'),
+    'fundingRequestingOfficeName': ('attribute', 'fundingRequestingOfficeID', 'name'),
+    'contractingOfficeAgencyID': ('text', 'contractingOfficeAgencyID'),
+    'contractingOfficeID': ('text', 'contractingOfficeID'),
+    'principalNAICSCode': ('text', 'principalNAICSCode'),
+    'principalNAICSCodeDescription': ('attribute', 'principalNAICSCode', 'description'),
+    'productOrServiceCode': ('text', 'productOrServiceCode'),
+    'productOrServiceCodeDescription': ('attribute', 'productOrServiceCode', 'description'),
+    'reasonForModificationDescription': ('attribute', 'reasonForModification', 'description'),
+    'productOrServiceCodeType': ('attribute', 'productOrServiceCode', 'productOrServiceType'),
+    'descriptionOfContractRequirement': ('text', 'descriptionOfContractRequirement'),
+    'reasonForModification': ('text', 'reasonForModification'),
+    'createdBy': ('text', 'createdBy'),
+    'createdDate': ('text', 'createdDate'),
+    'lastModifiedBy': ('text', 'lastModifiedBy'),
+    'lastModifiedDate': ('text', 'lastModifiedDate'),
+    'approvedBy': ('text', 'approvedBy'),
+    'approvedDate': ('text', 'approvedDate'),
+    'closedBy': ('text', 'closedBy'),
+    'closedDate': ('text', 'closedDate'),
+}
+
+FIELD_NAMES = [name for name, _ in FIELD_SPEC]
+
+FIELD_TYPES = dict(FIELD_SPEC)
+
+
+def fields_of_type(field_type, spec=FIELD_SPEC):
+    """
+    Returns the names of the fields in a spec with the given type, e.g. 'amount'.
+    """
+    return [name for name, kind in spec if kind == field_type]
+
+
+def projection_fields(fields=None):
+    """
+    Validates a column projection and puts it in record order.
+
+    Args:
+        fields: Field names, or None for every field.
+
+    Returns:
+        The list of fields.
+
+    Raises:
+        ValueError: If a field is not in the field spec.
+    """
+    if not fields:
+        return list(FIELD_NAMES)
+    unknown = [field for field in fields if field not in FIELD_TYPES]
+    if unknown:
+        raise ValueError(f"unknown fields {', '.join(unknown)}")
+    wanted = set(fields)
+    return [field for field in FIELD_NAMES if field in wanted]
+
+
+def insert_statement(table="fpds_raw", fields=FIELD_NAMES):
+    """
+    Builds a parameterized INSERT statement for the given fields.
+
+    Args:
+        table: The table to insert into.
+        fields: The column names, in the order the values will be passed.
+
+    Returns:
+        The INSERT statement with one %s placeholder per field.
+    """
+    placeholders = ", ".join(["%s"] * len(fields))
+    return f"INSERT INTO {table} ({', '.join(fields)}) VALUES ({placeholders})"
+
+
+def record_values(record, fields=FIELD_NAMES):
+    """
+    Returns the values of a record as a tuple in field order, for use with insert_statement().
+    """
+    return tuple(record.get(field) for field in fields)
@@ -0,0 +1,206 @@
+import re
+
+from fpds_fields import FIELD_TYPES
+from type_conversion import convert_amount, convert_column, convert_timestamp
+
+# Record fields the ATOM feed can filter on, mapped to the build_query_url() criteria key of their search field
+FEED_FILTER_FIELDS = {
+    'contractingOfficeAgencyID': 'contracting_agency_id',
+    'contractingOfficeID': 'contracting_office_id',
+    'fundingRequestingAgencyID': 'funding_agency_id',
+    'fundingRequestingOfficeID': 'funding_office_id',
+    'principalNAICSCode': 'naics',
+    'productOrServiceCode': 'psc',
+    'PIID': 'piid',
+    'referencedIDVPIID': 'ref_idv_piid',
+    'ultimateParentUEI': 'ultimate_uei',
+    'signedDate': 'signed_date',
+}
+
+# Operators that can be pushed into the feed query: exact/wildcard matches, prefixes and inclusive date ranges
+PUSHDOWN_OPERATORS = {'=', 'startswith', 'between'}
+
+OPERATORS = ['>=', '<=', '!=', '=', '>', '<', 'startswith', 'between', 'in']
+
+_EXPRESSION = re.compile(r"^\s*(\w+)\s*(>=|<=|!=|=|>|<|\s(?:startswith|between|in)\s)\s*(.+?)\s*$")
+
+
+def parse_filter(expression):
+    """
+    Parses one filter predicate.
+
+    Args:
+        expression: A string such as 'obligatedAmount >= 100000', 'productOrServiceCode startswith R4',
+            'signedDate between 2024-01-01,2024-03-31' or 'vendorState in VA,MD', or a [field, operator, value]
+            list as written in a job spec.
+
+    Returns:
+        A (field, operator, value) tuple; 'between' and 'in' values are tuples.
+
+    Raises:
+        ValueError: If the expression cannot be parsed or names an unknown field or operator.
+    """
+    if isinstance(expression, str):
+        match = _EXPRESSION.match(expression)
+        if match is None:
+            raise ValueError(f"cannot parse filter {expression!r}")
+        field, operator, value = match.group(1), match.group(2).strip(), match.group(3)
+        if operator in ('between', 'in'):
+            value = tuple(part.strip() for part in value.split(','))
+    else:
+        field, operator, value = expression
+        if operator in ('between', 'in'):
+            value = tuple(value)
+
+    if field not in FIELD_TYPES:
+        raise ValueError(f"unknown filter field {field!r}")
+    if operator not in OPERATORS:
+        raise ValueError(f"unknown filter operator {operator!r}")
+    if operator == 'between' and len(value) != 2:
+        raise ValueError(f"'between' needs two values, got {value!r}")
+    if operator == 'startswith' and FIELD_TYPES[field] != 'text':
+        raise ValueError(f"'startswith' only applies to text fields, not {field!r}")
+    return field, operator, value
+
+
+def _typed(field, value):
+    field_type = FIELD_TYPES[field]
+    if field_type == 'amount':
+        return convert_amount(str(value))
+    if field_type == 'timestamp':
+        return convert_timestamp(str(value))
+    return str(value)
+
+
+class FilterSet:
+    """
+    A conjunction of filter predicates, split into the part the feed evaluates and the part evaluated locally.
+
+    Predicates the ATOM search supports (see FEED_FILTER_FIELDS and PUSHDOWN_OPERATORS) become query criteria, so
+    the pages they exclude are never fetched. The rest are evaluated on parsed records, a column at a time over the
+    whole batch, before type conversion and loading.
+    """
+
+    def __init__(self, expressions=(), pushdown=True):
+        """
+        Args:
+            expressions: Filter expressions, see parse_filter().
+            pushdown: Push the predicates the feed supports into the query. With False every predicate is evaluated
+                locally, e.g. the residual predicates of a job whose queries were built elsewhere.
+
+        Raises:
+            ValueError: If an expression is invalid.
+        """
+        self.pushed = {}
+        self.local = []
+        self._pushed_predicates = {}
+        for predicate in (parse_filter(expression) for expression in expressions):
+            field, operator, value = predicate
+            key = FEED_FILTER_FIELDS.get(field)
+            pushable = pushdown and key is not None and operator in PUSHDOWN_OPERATORS and key not in self.pushed
+            if pushable and operator == 'between' and FIELD_TYPES[field] != 'timestamp':
+                pushable = False
+            if not pushable:
+                self.local.append(predicate)
+                continue
+            if operator == 'between':
+                start, end = (_typed(field, bound) for bound in value)
+                self.pushed[key] = (f"{start:%Y-%m-%d}", f"{end:%Y-%m-%d}")
+            elif operator == 'startswith':
+                self.pushed[key] = f"{value}*"
+            else:
+                self.pushed[key] = str(value)
+            self._pushed_predicates[key] = predicate
+        # Amounts and timestamps compare as converted values, text as strings
+        self._predicates = [typed_predicate(predicate) for predicate in self.local]
+
+    @property
+    def fields(self):
+        """
+        The fields the local predicates read, which have to be parsed.
+        """
+        return list(dict.fromkeys(field for field, _, _ in self.local))
+
+    def query_criteria(self, criteria=()):
+        """
+        Adds the pushed-down predicates to a shard's criteria.
+
+        Args:
+            criteria: The shard's criteria as (key, value) pairs. Keys it already sets keep their value; the
+                predicate on that field is then also checked locally.
+
+        Returns:
+            The merged criteria as a sorted tuple of (key, value) pairs.
+        """
+        merged = dict(criteria)
+        for key, value in self.pushed.items():
+            if key in merged and merged[key] != value:
+                predicate = self._pushed_predicates[key]
+                if predicate not in self.local:
+                    self.local.append(predicate)
+                    self._predicates.append(typed_predicate(predicate))
+                continue
+            merged[key] = value
+        return tuple(sorted(merged.items()))
+
+    def apply(self, records):
+        """
+        Returns the records matching every local predicate.
+
+        Each predicate is evaluated over a whole column of the batch, converting each distinct value once; empty or
+        unconvertible values never match.
+        """
+        if not self._predicates or not records:
+            return records
+        keep = [True] * len(records)
+        for field, operator, value in self._predicates:
+            column = [record.get(field) for record in records]
+            field_type = FIELD_TYPES[field]
+            if field_type == 'amount':
+                column, _ = convert_column(column, convert_amount)
+            elif field_type == 'timestamp':
+                column, _ = convert_column(column, convert_timestamp)
+            for index, item in enumerate(column):
+                if keep[index] and not matches(item, operator, value):
+                    keep[index] = False
+        return [record for record, kept in zip(records, keep) if kept]
+
+    def describe(self):
+        pushed = ", ".join(f"{key}={value}" for key, value in self.pushed.items()) or "none"
+        local = ", ".join(f"{field} {operator} {value}" for field, operator, value in self.local) or "none"
+        return f"Filters pushed to the feed: {pushed}. Filtered locally: {local}."
+
+
+def typed_predicate(predicate):
+    """
+    Converts a predicate's value(s) to the type of its field.
+    """
+    field, operator, value = predicate
+    if operator in ('between', 'in'):
+        return field, operator, tuple(_typed(field, item) for item in value)
+    return field, operator, _typed(field, value)
+
+
+def matches(item, operator, value):
+    """
+    Evaluates one predicate on one converted value.
+    """
+    if item is None or item == '':
+        return operator == '!='
+    if operator == '=':
+        return item == value
+    if operator == '!=':
+        return item != value
+    if operator == '>':
+        return item > value
+    if operator == '>=':
+        return item >= value
+    if operator == '<':
+        return item < value
+    if operator == '<=':
+        return item <= value
+    if operator == 'startswith':
+        return item.startswith(value)
+    if operator == 'between':
+        return value[0] <= item <= value[1]
+    return item in value
@@ -0,0 +1,290 @@
+import time
+import xml.etree.ElementTree as ET
+
+from fpds_fields import FIELD_LOCATIONS, FIELD_NAMES
+
+try:
+    from lxml import etree as lxml_etree
+except ImportError:  # lxml is optional, the stdlib backend is used without it
+    lxml_etree = None
+
+NS = {'atom': 'http://www.w3.org/2005/Atom', 'ns1': 'https://www.fpds.gov/FPDS'}
+
+
+def get_element_text(entry, element_name, ns, default=''):
+    """
+    Retrieves the text value of an XML element.
+
+    Args:
+        entry: The XML entry to search within.
+        element_name: The tag name of the element to find.
+        ns: The namespace dictionary.
+        default: The default value to return if the element is not found or has no text.
+
+    Returns:
+        The text of the found element, or the default value if not found.
+    """
+    # Correctly format the namespace and element name for the search
+    element = entry.find('.//{{{}}}{}'.format(ns['ns1'], element_name), ns)
+    return element.text if element is not None else default
+
+
+def get_element_attribute(entry, element_name, attribute_name, ns, default=''):
+    """
+    Retrieves the value of an attribute from an XML element.
+
+    Args:
+        entry: The XML entry to search within.
+        element_name: The tag name of the element to find.
+        attribute_name: The name of the attribute to retrieve.
+        ns: The namespace dictionary.
+        default: The default value to return if the element or attribute is not found.
+
+    Returns:
+        The value of the attribute, or the default value if the element or attribute is not found.
+    """
+    # Find the element using the provided namespace and element name
+    element = entry.find('.//{{{}}}{}'.format(ns['ns1'], element_name), ns)
+    # Return the attribute value if the element is found and the attribute exists, else return default
+    return element.get(attribute_name) if element is not None and element.get(attribute_name) is not None else default
+
+
+def get_nested_element(entry, parent_element_name, child_element_name, ns, default=''):
+    """
+    Retrieves the text of a nested XML element.
+
+    Args:
+        entry: The XML entry to search within.
+        parent_element_name: The tag name of the parent element.
+        child_element_name: The tag name of the child element to find within the parent.
+        ns: The namespace dictionary.
+        default: The default value to return if the element is not found or has no text.
+
+    Returns:
+        The text of the found child element, or the default value if not found.
+    """
+    # Find the parent element
+    parent_element = entry.find('.//{{{}}}{}'.format(ns['ns1'], parent_element_name), ns)
+
+    if parent_element is not None:
+        # Find the child element within the parent
+        child_element = parent_element.find('.//{{{}}}{}'.format(ns['ns1'], child_element_name), ns)
+        return child_element.text if child_element is not None else default
+    else:
+        return default
+
+
+def get_nested_attribute(entry, parent_element_name, child_element_name, attribute_name, ns, default=''):
+    """
+    Retrieves the value of an attribute from a nested XML element.
+
+    Args:
+        entry: The XML entry to search within.
+        parent_element_name: The tag name of the parent element.
+        child_element_name: The tag name of the child element to find within the parent.
+        attribute_name: The name of the attribute within the child element whose value is to be returned.
+        ns: The namespace dictionary.
+        default: The default value to return if the element or attribute is not found.
+
+    Returns:
+        The value of the specified attribute, or the default value if not found.
+    """
+    # Find the parent element
+    parent_element = entry.find('.//{{{}}}{}'.format(ns['ns1'], parent_element_name), ns)
+
+    if parent_element is not None:
+        # Find the child element within the parent
+        child_element = parent_element.find('.//{{{}}}{}'.format(ns['ns1'], child_element_name), ns)
+        if child_element is not None and attribute_name in child_element.attrib:
+            return child_element.attrib[attribute_name]
+    return default
+
+
+class ParserBackend:
+    """
+    Interface for the XML backends that turn an atom:entry into a raw record.
+
+    A backend provides fromstring() and pull_parser() with the ElementTree API, and parse_entry() extracting the
+    fields listed in fpds_fields.FIELD_LOCATIONS. Every backend must produce identical records; run
+    benchmark_parsers.py to check a backend against the others.
+    """
+
+    name = None
+
+    def __init__(self, fields=FIELD_NAMES, ns=NS):
+        self.fields = list(fields)
+        self.ns = ns
+
+    def fromstring(self, xml_data):
+        raise NotImplementedError
+
+    def pull_parser(self):
+        raise NotImplementedError
+
+    def parse_entry(self, entry):
+        raise NotImplementedError
+
+
+class ElementTreeBackend(ParserBackend):
+    """
+    Backend using the stdlib xml.etree.ElementTree and the get_element_* helpers.
+    """
+
+    name = 'etree'
+
+    def fromstring(self, xml_data):
+        return ET.fromstring(xml_data)
+
+    def pull_parser(self):
+        return ET.XMLPullParser(events=('start', 'end'))
+
+    def parse_entry(self, entry):
+        ns = self.ns
+        record = {}
+        for field in self.fields:
+            kind, *location = FIELD_LOCATIONS[field]
+            if kind == 'atom':
+                element = entry.find('atom:' + location[0], ns)
+                if element is None:
+                    raise ValueError(f"entry has no atom:{location[0]}")
+                value = element.text
+            elif kind == 'text':
+                value = get_element_text(entry, location[0], ns)
+            elif kind == 'attribute':
+                value = get_element_attribute(entry, location[0], location[1], ns)
+            else:
+                value = ''
+                for parent, child in location:
+                    value = get_nested_element(entry, parent, child, ns)
+                    if value != '':
+                        break
+            record[field] = value
+        return record
+
+
+class LxmlBackend(ParserBackend):
+    """
+    Backend using lxml, with one compiled XPath expression per field location.
+    """
+
+    name = 'lxml'
+
+    def __init__(self, fields=FIELD_NAMES, ns=NS):
+        if lxml_etree is None:
+            raise ImportError("the lxml parser backend requires lxml to be installed")
+        super().__init__(fields, ns)
+        # Each expression selects at most one node, matching the first-match semantics of ElementTree's find()
+        self.extractors = []
+        for field in self.fields:
+            kind, *location = FIELD_LOCATIONS[field]
+            if kind == 'atom':
+                paths = [f"atom:{location[0]}"]
+            elif kind == 'text':
+                paths = [f"descendant::ns1:{location[0]}[1]"]
+            elif kind == 'attribute':
+                paths = [f"descendant::ns1:{location[0]}[1]/@{location[1]}"]
+            else:
+                paths = [f"descendant::ns1:{parent}[1]/descendant::ns1:{child}[1]" for parent, child in location]
+            xpaths = [lxml_etree.XPath(path, namespaces=ns) for path in paths]
+            self.extractors.append((field, kind, xpaths))
+
+    def fromstring(self, xml_data):
+        if isinstance(xml_data, str):
+            xml_data = xml_data.encode('utf-8')
+        return lxml_etree.fromstring(xml_data)
+
+    def pull_parser(self):
+        return lxml_etree.XMLPullParser(events=('start', 'end'))
+
+    def parse_entry(self, entry):
+        record = {}
+        for field, kind, xpaths in self.extractors:
+            if kind == 'atom':
+                nodes = xpaths[0](entry)
+                if not nodes:
+                    raise ValueError(f"entry has no {xpaths[0].path}")
+                value = nodes[0].text
+            elif kind == 'attribute':
+                nodes = xpaths[0](entry)
+                value = str(nodes[0]) if nodes else ''
+            else:
+                value = ''
+                for xpath in xpaths:
+                    nodes = xpath(entry)
+                    value = nodes[0].text if nodes else ''
+                    if value != '':
+                        break
+            record[field] = value
+        return record
+
+
+BACKENDS = {
+    'lxml': LxmlBackend,
+    'etree': ElementTreeBackend,
+}
+
+
+def get_backend(name=None, fields=FIELD_NAMES):
+    """
+    Returns a parser backend instance.
+
+    Args:
+        name: 'lxml' or 'etree'. Defaults to lxml when it is installed, otherwise the stdlib backend.
+        fields: The fields the backend extracts.
+
+    Returns:
+        A ParserBackend.
+    """
+    if name is None:
+        name = 'lxml' if lxml_etree is not None else 'etree'
+    return BACKENDS[name](fields)
+
+
+def available_backends():
+    return [name for name in BACKENDS if name != 'lxml' or lxml_etree is not None]
+
+
+def compare_backends(xml_data, names=None):
+    """
+    Parses every entry of a feed page with each backend and reports where their records differ.
+
+    Args:
+        xml_data: The page XML.
+        names: The backends to compare. Defaults to every available backend.
+
+    Returns:
+        A list of (entry index, field, {backend name: value}) tuples, empty when all backends agree.
+    """
+    names = names or available_backends()
+    results = {}
+    for name in names:
+        backend = get_backend(name)
+        root = backend.fromstring(xml_data)
+        results[name] = [backend.parse_entry(entry) for entry in root.findall('atom:entry', backend.ns)]
+
+    mismatches = []
+    reference = results[names[0]]
+    for index, record in enumerate(reference):
+        for field in record:
+            values = {name: results[name][index][field] if index < len(results[name]) else None for name in names}
+            if len(set(values.values())) > 1:
+                mismatches.append((index, field, values))
+    for name in names[1:]:
+        if len(results[name]) != len(reference):
+            mismatches.append((None, 'entry count', {n: len(results[n]) for n in names}))
+    return mismatches
+
+
+def time_backend(name, xml_data, repeat=50):
+    """
+    Returns the average seconds per entry for parsing and extracting a page with a backend.
+    """
+    backend = get_backend(name)
+    entries = 0
+    start = time.perf_counter()
+    for _ in range(repeat):
+        root = backend.fromstring(xml_data)
+        for entry in root.findall('atom:entry', backend.ns):
+            backend.parse_entry(entry)
+            entries += 1
+    return (time.perf_counter() - start) / max(entries, 1)
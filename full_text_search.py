@@ -0,0 +1,80 @@
+import argparse
+import time
+
+import psycopg2
+
+from pg_schema import RAW_TABLE, SEARCH_COLUMN, SEARCH_CONFIG, live_condition
+
+# Database configuration - currently using pgsql Docker container
+DATABASE = "fpds"
+USER = "postgres"  # replace with your username/env variable
+PASSWORD = "default"  # replace with your password/env variable
+HOST = "0.0.0.0"
+PORT = "5432"
+
+# Hits returned per search by default
+SEARCH_LIMIT = 20
+
+# Fields returned with each hit
+RESULT_FIELDS = ['PIID', 'modNumber', 'referencedIDVPIID', 'vendorName', 'signedDate', 'obligatedAmount',
+                 'descriptionOfContractRequirement']
+
+
+def search(conn, text, limit=SEARCH_LIMIT, table=RAW_TABLE):
+    """
+    Finds the transactions whose description or vendor names match a search, best matches first.
+
+    The search uses the GIN index on fpds_raw.search_vector; only the returned hits are ranked and highlighted. Rows
+    marked deleted are left out.
+
+    Args:
+        conn: An open psycopg2 connection.
+        text: Web-search style query text, e.g. 'cloud migration -training' or '"help desk" OR helpdesk'.
+        limit: The maximum number of hits.
+        table: The raw table.
+
+    Returns:
+        A list of dictionaries with RESULT_FIELDS, rank and headline (the description with matches marked by
+        <b></b>).
+    """
+    cur = conn.cursor()
+    live = live_condition(cur, table)
+    cur.execute(f"""
+        SELECT {', '.join(RESULT_FIELDS)}, rank,
+            ts_headline(%(config)s::regconfig, coalesce(descriptionOfContractRequirement, ''), query)
+        FROM (
+            SELECT {', '.join(RESULT_FIELDS)}, query, ts_rank_cd({SEARCH_COLUMN}, query) AS rank
+            FROM {table}, websearch_to_tsquery(%(config)s::regconfig, %(text)s) AS query
+            WHERE {SEARCH_COLUMN} @@ query AND {live}
+            ORDER BY rank DESC
+            LIMIT %(limit)s
+        ) hits
+        ORDER BY rank DESC
+    """, {'config': SEARCH_CONFIG, 'text': text, 'limit': limit})
+    hits = [dict(zip(RESULT_FIELDS + ['rank', 'headline'], row)) for row in cur.fetchall()]
+    cur.close()
+    return hits
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Full-text search over contract descriptions and vendor names.")
+    parser.add_argument('text', help="search text, e.g. 'cloud migration -training'")
+    parser.add_argument('--limit', type=int, default=SEARCH_LIMIT)
+    args = parser.parse_args()
+
+    conn = psycopg2.connect(dbname=DATABASE, user=USER, password=PASSWORD, host=HOST, port=PORT)
+    try:
+        start_time = time.time()
+        hits = search(conn, args.text, args.limit)
+        duration = time.time() - start_time
+    finally:
+        conn.close()
+
+    for hit in hits:
+        print(f"{hit['rank']:.3f}  {hit['PIID']} {hit['modNumber'] or ''}  {hit['vendorName'] or ''}  "
+              f"{hit['headline']}")
+    print(f"{len(hits)} hits in {duration * 1000:.0f} ms.")
+
+
+if __name__ == "__main__":
+    main()
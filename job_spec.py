@@ -0,0 +1,180 @@
+import itertools
+import json
+import os
+from collections import namedtuple
+from datetime import date, datetime, timedelta
+
+try:
+    import tomllib
+except ImportError:  # Python < 3.11
+    tomllib = None
+
+try:
+    import yaml
+except ImportError:  # PyYAML is optional, only needed for .yaml job files
+    yaml = None
+
+from fpds_feed import QUERY_FIELDS, build_query_url
+
+# One unit of scheduled work: a single query over one LAST_MOD_DATE window. criteria is a sorted tuple of
+# (QUERY_FIELDS key, value) pairs so identical shards from different queries compare equal.
+Shard = namedtuple('Shard', ['start_date', 'end_date', 'criteria'])
+
+
+def shard_url(shard):
+    return build_query_url(shard.start_date.strftime('%Y-%m-%d'), shard.end_date.strftime('%Y-%m-%d'),
+                           dict(shard.criteria))
+
+
+def shard_label(shard):
+    criteria = ' '.join(f"{key}={value}" for key, value in shard.criteria)
+    return f"{shard.start_date:%Y-%m-%d}..{shard.end_date:%Y-%m-%d} {criteria}".strip()
+
+
+def load_job_spec(path, require_dates=True):
+    """
+    Loads a job spec file listing many queries to run together.
+
+    The file may be JSON, TOML or YAML (YAML needs PyYAML). Example (YAML):
+
+        defaults:
+          start_date: 2024-01-01
+          end_date: 2024-01-31
+          split_days: 7
+        workers: auto
+        max_workers: 40
+        requests_per_second: 10
+        output: {type: csv, path: fpds_data.csv}
+        fields: [PIID, UEI, obligatedAmount, signedDate]
+        filters:
+          - productOrServiceCode startswith R4
+          - obligatedAmount >= 100000
+        queries:
+          - name: army engineering
+            funding_agency_id: "2100"
+            naics: ["5413*", "5417*"]
+          - name: watchlist
+            ultimate_uei: [UEI1, UEI2, UEI3]
+
+    'filters' are predicates every record must match, see fpds_filters.FilterSet: the ones the feed supports are
+    added to each query, the rest are checked on parsed records. 'fields' is an optional column projection: only
+    these fields are parsed and written. Without it, only the fields the output needs are parsed.
+
+    Each query takes start_date, end_date, an optional split_days and any QUERY_FIELDS criteria, each a single
+    value or a list; lists expand to one shard per value.
+
+    Args:
+        path: The job spec file.
+        require_dates: Check that every query has a start_date and end_date. The daemon sets its own.
+
+    Returns:
+        The spec dictionary.
+
+    Raises:
+        ValueError: If the file type is unsupported or the spec is invalid.
+    """
+    extension = os.path.splitext(path)[1].lower()
+    if extension == '.json':
+        with open(path, encoding='utf-8') as file:
+            spec = json.load(file)
+    elif extension == '.toml':
+        if tomllib is None:
+            raise ValueError("TOML job files need Python 3.11+")
+        with open(path, 'rb') as file:
+            spec = tomllib.load(file)
+    elif extension in ('.yaml', '.yml'):
+        if yaml is None:
+            raise ValueError("YAML job files need PyYAML to be installed")
+        with open(path, encoding='utf-8') as file:
+            spec = yaml.safe_load(file)
+    else:
+        raise ValueError(f"unsupported job file type {extension!r}, use .json, .toml or .yaml")
+
+    if not isinstance(spec, dict) or not spec.get('queries'):
+        raise ValueError(f"{path} has no queries")
+    for index, query in enumerate(spec['queries'] if require_dates else []):
+        query = {**spec.get('defaults', {}), **query}
+        for key in ('start_date', 'end_date'):
+            if key not in query:
+                raise ValueError(f"query {query.get('name', index)} has no {key}")
+    return spec
+
+
+def parse_date(value):
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    return datetime.strptime(str(value), '%Y-%m-%d').date()
+
+
+def query_criteria(query):
+    """
+    Expands the list-valued criteria of a query into one criteria tuple per combination of values.
+    """
+    keys = sorted(key for key in query if key in QUERY_FIELDS)
+    values = [query[key] if isinstance(query[key], list) else [query[key]] for key in keys]
+    return [tuple(zip(keys, combination)) for combination in itertools.product(*values)]
+
+
+def merge_ranges(ranges):
+    """
+    Merges overlapping or adjacent inclusive (start, end) date ranges.
+    """
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1] + timedelta(days=1):
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def split_range(start, end, split_days):
+    """
+    Splits an inclusive date range into windows of at most split_days days.
+    """
+    if not split_days:
+        return [(start, end)]
+    windows = []
+    while start <= end:
+        window_end = min(start + timedelta(days=split_days - 1), end)
+        windows.append((start, window_end))
+        start = window_end + timedelta(days=1)
+    return windows
+
+
+def expand_shards(spec):
+    """
+    Expands every query of a job spec into shards, removing the overlap between queries.
+
+    Queries with the same criteria have their date ranges merged before splitting, so a day requested by several
+    queries is fetched once.
+
+    Args:
+        spec: The job spec from load_job_spec().
+
+    Returns:
+        The list of unique shards.
+    """
+    ranges = {}
+    split_days = {}
+    requested = 0
+    for query in spec['queries']:
+        query = {**spec.get('defaults', {}), **query}
+        start, end = parse_date(query['start_date']), parse_date(query['end_date'])
+        for criteria in query_criteria(query):
+            ranges.setdefault(criteria, []).append((start, end))
+            if query.get('split_days'):
+                split_days[criteria] = min(split_days.get(criteria, query['split_days']), query['split_days'])
+            requested += len(split_range(start, end, query.get('split_days')))
+
+    shards = []
+    for criteria, criteria_ranges in ranges.items():
+        for start, end in merge_ranges(criteria_ranges):
+            for window_start, window_end in split_range(start, end, split_days.get(criteria)):
+                shards.append(Shard(window_start, window_end, criteria))
+
+    removed = max(requested - len(shards), 0)
+    print(f"Expanded {len(spec['queries'])} queries into {len(shards)} shards ({removed} overlapping shards removed).")
+    return shards
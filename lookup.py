@@ -0,0 +1,141 @@
+import argparse
+import json
+import os
+import re
+import time
+from datetime import date
+
+from change_feed import natural_key
+from dead_letters import DeadLetterFile
+from fpds_feed import build_query_url
+from sinks import create_sink
+from work_scheduler import WORKERS, JobScheduler
+
+# Directory holding one JSON file per PIID with its full modification history and the day it was last checked
+CACHE_DIR = "piid_cache"
+
+
+def load_piids(path):
+    """
+    Reads a PIID file, one PIID per line, and drops blank lines, comments and repeats.
+
+    Returns:
+        The unique PIIDs in file order.
+    """
+    with open(path, encoding='utf-8') as file:
+        piids = [line.strip().upper() for line in file if line.strip() and not line.startswith('#')]
+    unique = list(dict.fromkeys(piids))
+    if len(unique) < len(piids):
+        print(f"Dropped {len(piids) - len(unique)} repeated PIIDs.")
+    return unique
+
+
+class PiidCache:
+    """
+    Per-PIID cache of modification histories.
+
+    A cached PIID is revalidated by querying only the modifications with a LAST_MOD_DATE on or after the day it
+    was last checked - usually a single empty page - and merging them into the cached history by natural key.
+    """
+
+    def __init__(self, directory=CACHE_DIR):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, piid):
+        return os.path.join(self.directory, re.sub(r'[^A-Za-z0-9_-]', '_', piid) + ".json")
+
+    def get(self, piid):
+        """
+        Returns the cache entry of a PIID as {'checked': 'YYYY-MM-DD', 'records': [...]}, or None.
+        """
+        try:
+            with open(self._path(piid), encoding='utf-8') as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return None
+
+    def put(self, piid, records, checked):
+        path = self._path(piid)
+        with open(path + ".tmp", mode='w', encoding='utf-8') as file:
+            json.dump({'piid': piid, 'checked': checked, 'records': records}, file)
+        os.replace(path + ".tmp", path)
+
+
+def lookup_piids(piids, sink, cache=None, workers=WORKERS, dead_letters=None, full_history=True):
+    """
+    Fetches the full modification history of every PIID and streams it to a sink, one PIID at a time.
+
+    Args:
+        piids: The PIIDs to resolve.
+        sink: The sink receiving the records.
+        cache: Optional PiidCache. Cached PIIDs only fetch what was modified since they were last checked.
+        workers: Worker threads, or "auto".
+        dead_letters: Optional DeadLetterFile.
+        full_history: Write a cached PIID's whole merged history, for outputs rewritten every run such as CSV. With
+            False only the records fetched this run are written, for database outputs that keep earlier runs' rows
+            (and should replace them by natural key, as {'type': 'postgres', 'replace': True} does).
+
+    Returns:
+        The number of records written.
+    """
+    today = date.today().isoformat()
+    cached = {}
+    urls = {}
+    for piid in piids:
+        entry = cache.get(piid) if cache is not None else None
+        if entry is None:
+            urls[piid] = build_query_url(None, None, {'piid': piid})
+        else:
+            cached[piid] = entry
+            urls[piid] = build_query_url(entry['checked'], today, {'piid': piid})
+    print(f"Looking up {len(piids)} PIIDs: {len(cached)} cached, {len(piids) - len(cached)} not cached.")
+
+    written = 0
+
+    def on_shard_done(piid, records):
+        nonlocal written
+        fetched = records
+        if piid in cached:
+            history = {natural_key(record): record for record in cached[piid]['records']}
+            history.update((natural_key(record), record) for record in records)
+            records = list(history.values())
+        # A PIID with failed pages is not cached, so it is fetched in full next time
+        if cache is not None and piid not in scheduler.failed_shards:
+            cache.put(piid, records, today)
+        if not full_history:
+            records = fetched
+        sink.write(records)
+        written += len(records)
+
+    scheduler = JobScheduler(workers, dead_letters, on_shard_done)
+    scheduler.run(urls)
+    return written
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fetch the full modification history of a list of PIIDs.")
+    parser.add_argument('--piids', required=True, help="file with one PIID per line")
+    parser.add_argument('--output', choices=['csv', 'postgres'], default='csv')
+    parser.add_argument('--path', default="fpds_data.csv", help="CSV output file")
+    parser.add_argument('--no-cache', action='store_true', help="fetch every PIID in full and leave the cache as is")
+    args = parser.parse_args()
+
+    start_time = time.time()
+    piids = load_piids(args.piids)
+    dead_letters = DeadLetterFile()
+    # The database keeps earlier runs' rows: write only what was fetched, replacing re-fetched transactions
+    output = {'type': 'csv', 'path': args.path} if args.output == 'csv' else {'type': 'postgres', 'replace': True}
+    sink = create_sink(output, dead_letters)
+    try:
+        written = lookup_piids(piids, sink, None if args.no_cache else PiidCache(), dead_letters=dead_letters,
+                               full_history=args.output == 'csv')
+    finally:
+        sink.close()
+
+    duration = time.time() - start_time
+    print(f'Job complete. Total records parsed and stored: {written}. Time taken: {duration}')
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,222 @@
+import threading
+
+# Low-cardinality columns that repeat across millions of records. Values for these fields are routed through a
+# shared lookup table so every repeat points at one canonical string instead of a new allocation per entry.
+DICTIONARY_FIELDS = [
+    'fundingRequestingDepartmentID',
+    'fundingRequestingDepartmentName',
+    'fundingRequestingAgencyID',
+    'fundingRequestingAgencyName',
+    'fundingRequestingOfficeName',
+    'contractingOfficeAgencyID',
+    'principalNAICSCode',
+    'principalNAICSCodeDescription',
+    'productOrServiceCode',
+    'productOrServiceCodeDescription',
+    'productOrServiceCodeType',
+    'reasonForModification',
+    'reasonForModificationDescription',
+    'vendorState',
+    'vendorCountryCode',
+    'vendorEntityDataSource',
+    'createdBy',
+    'lastModifiedBy',
+    'approvedBy',
+    'closedBy',
+]
+
+
+class LookupTable:
+    """
+    Dictionary encoding for a single column.
+
+    Each distinct value is assigned a small integer code the first time it is seen. The canonical string for a
+    value is kept so repeats can be interned, and the code/value pairs double as a dimension table in the database.
+    Code 0 is reserved for empty/missing values.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self._codes = {'': 0}
+        self._values = ['']
+        self._lock = threading.Lock()
+
+    def encode(self, value):
+        """
+        Returns the integer code for a value, adding it to the table if it has not been seen before.
+
+        Args:
+            value: The string value to encode. None is treated as an empty value.
+
+        Returns:
+            The integer code assigned to the value.
+        """
+        if value is None:
+            return 0
+        code = self._codes.get(value)
+        if code is None:
+            with self._lock:
+                # Re-check under the lock in case another thread added the value first
+                code = self._codes.get(value)
+                if code is None:
+                    code = len(self._values)
+                    self._values.append(value)
+                    self._codes[value] = code
+        return code
+
+    def intern(self, value):
+        """
+        Returns the canonical instance of a value so that repeats share a single string.
+
+        Args:
+            value: The string value to intern.
+
+        Returns:
+            The shared string instance for the value.
+        """
+        if value is None:
+            return None
+        return self._values[self.encode(value)]
+
+    def decode(self, code):
+        """
+        Returns the value for a previously assigned code.
+
+        Args:
+            code: The integer code to look up.
+
+        Returns:
+            The string value the code was assigned to.
+        """
+        return self._values[code]
+
+    def seed(self, rows):
+        """
+        Loads previously assigned (code, value) pairs, e.g. from the database, so codes stay stable across runs.
+
+        Stored pairs win: a value assigned a different code locally takes the stored one, and a local value whose
+        code is stored for another value is given a new code after the stored ones.
+
+        Args:
+            rows: An iterable of (code, value) pairs.
+
+        Returns:
+            The number of local values whose code changed.
+        """
+        with self._lock:
+            stored = {value: code for code, value in rows if code}
+            values = [''] + [None] * max(stored.values(), default=0)
+            for value, code in stored.items():
+                # Keep the instance already handed out by intern()
+                local = self._codes.get(value)
+                values[code] = self._values[local] if local is not None else value
+            remapped = 0
+            for code, value in enumerate(self._values):
+                if not code or value is None:
+                    continue
+                if value not in stored:
+                    values.append(value)
+                if stored.get(value, len(values) - 1) != code:
+                    remapped += 1
+            self._values = values
+            self._codes = {value: code for code, value in enumerate(values) if value is not None}
+        return remapped
+
+    def rows(self):
+        """
+        Returns the (code, value) pairs of the table, excluding the reserved empty value.
+        """
+        with self._lock:
+            return [(code, value) for code, value in enumerate(self._values) if code and value is not None]
+
+    def __len__(self):
+        return len(self._codes) - 1
+
+
+def create_lookup_tables(fields=None):
+    """
+    Creates an empty lookup table for each dictionary-encoded field.
+
+    Args:
+        fields: The fields to create tables for. Defaults to DICTIONARY_FIELDS.
+
+    Returns:
+        A dictionary mapping field name to its LookupTable.
+    """
+    return {field: LookupTable(field) for field in (fields or DICTIONARY_FIELDS)}
+
+
+# Shared lookup tables used by the parser. One set per process so every thread interns against the same values.
+LOOKUP_TABLES = create_lookup_tables()
+
+
+def intern_record(record, tables=LOOKUP_TABLES):
+    """
+    Replaces the low-cardinality values of a record with their shared canonical strings.
+
+    Args:
+        record: The parsed record dictionary. Modified in place.
+        tables: The lookup tables to intern against.
+
+    Returns:
+        The same record, for convenience.
+    """
+    for field, table in tables.items():
+        if field in record:
+            record[field] = table.intern(record[field])
+    return record
+
+
+def lookup_table_name(field):
+    return f"lookup_{field.lower()}"
+
+
+def load_lookup_tables(conn, tables=LOOKUP_TABLES):
+    """
+    Seeds the lookup tables from the lookup_<field> tables in Postgres, if they exist.
+
+    Args:
+        conn: An open psycopg2 connection.
+        tables: The lookup tables to seed.
+    """
+    cur = conn.cursor()
+    for field, table in tables.items():
+        table_name = lookup_table_name(field)
+        cur.execute("SELECT to_regclass(%s)", (table_name,))
+        if cur.fetchone()[0] is None:
+            continue
+        cur.execute(f"SELECT code, value FROM {table_name}")
+        table.seed(cur.fetchall())
+    cur.close()
+
+
+def write_lookup_tables(conn, tables=LOOKUP_TABLES):
+    """
+    Persists the lookup tables to Postgres as lookup_<field> (code, value) dimension tables.
+
+    Each table is locked, its stored codes are seeded first (so local values another run stored under other codes
+    adopt those, see LookupTable.seed()), and only the values not stored yet are inserted. The tables can be written
+    after every load.
+
+    Args:
+        conn: An open psycopg2 connection. The caller is responsible for committing.
+        tables: The lookup tables to write.
+    """
+    cur = conn.cursor()
+    for field, table in tables.items():
+        table_name = lookup_table_name(field)
+        cur.execute(f"CREATE TABLE IF NOT EXISTS {table_name} (code INTEGER PRIMARY KEY, value TEXT NOT NULL UNIQUE)")
+        # Writers of the same table take turns, so codes handed out between the read and the insert cannot clash
+        cur.execute(f"LOCK TABLE {table_name} IN SHARE ROW EXCLUSIVE MODE")
+        cur.execute(f"SELECT code, value FROM {table_name}")
+        stored = cur.fetchall()
+        remapped = table.seed(stored)
+        if remapped:
+            print(f"Lookup table {table_name}: {remapped} local codes remapped to the stored ones.")
+        stored_values = {value for _, value in stored}
+        rows = [(code, value) for code, value in table.rows() if value not in stored_values]
+        if rows:
+            cur.executemany(f"INSERT INTO {table_name} (code, value) VALUES (%s, %s) ON CONFLICT (value) DO NOTHING",
+                            rows)
+        print(f"Lookup table {table_name}: {len(stored) + len(rows)} values, {len(rows)} new.")
+    cur.close()
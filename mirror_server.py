@@ -0,0 +1,364 @@
+import argparse
+import json
+import re
+import threading
+import time
+import xml.etree.ElementTree as ET
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlencode, urlparse, urlunparse
+
+import psycopg2
+from psycopg2.pool import ThreadedConnectionPool
+
+from change_feed import NATURAL_KEY, natural_key
+from fpds_feed import PAGE_SIZE, QUERY_FIELDS, page_url
+from fpds_fields import FIELD_LOCATIONS, FIELD_NAMES, FIELD_TYPES
+from fpds_filters import FEED_FILTER_FIELDS
+from fpds_parsers import NS, lxml_etree
+from full_text_search import SEARCH_LIMIT, search
+from pg_schema import FEED_ORDER, RAW_TABLE, build_secondary_indexes, live_condition
+
+# Database configuration - currently using pgsql Docker container
+DATABASE = "fpds"
+USER = "postgres"  # replace with your username/env variable
+PASSWORD = "default"  # replace with your password/env variable
+HOST = "0.0.0.0"
+PORT = "5432"
+
+# Where the mirror listens. Point consumers at http://<host>:<port>/ezsearch/FEEDS/ATOM?FEEDNAME=PUBLIC&q=...
+SERVER_HOST = "127.0.0.1"
+SERVER_PORT = 8080
+
+# Database connections shared by the request threads
+SERVER_CONNECTIONS = 8
+
+# ATOM search fields the mirror answers, mapped to their fpds_raw column
+SEARCH_COLUMNS = {'LAST_MOD_DATE': 'modified'}
+SEARCH_COLUMNS.update((QUERY_FIELDS[key], field) for field, key in FEED_FILTER_FIELDS.items())
+
+# Pages are ordered by modification time, then by natural key so offsets are stable. Next links carry the sort key
+# of the last entry (after=), so following them pages by key, along the feed_order index, instead of by ever deeper
+# offsets
+SORT_COLUMNS = FEED_ORDER
+SORT_KEY = ", ".join(SORT_COLUMNS)
+
+# Seconds a query's match count is reused for its other pages
+TOTAL_CACHE_SECONDS = 60
+
+_TERM = re.compile(r'(\w+):(\[[^\]]*\]|"[^"]*"|[^\s+"]+)')
+
+# Pages are built with lxml when it is installed, which keeps the feed's ns1 prefix; ElementTree reserves ns<N>
+# prefixes and picks its own, which namespace-aware parsers read the same
+XML = lxml_etree if lxml_etree is not None else ET
+ET.register_namespace('', NS['atom'])
+
+
+def parse_query(q):
+    """
+    Translates an ATOM feed q= expression into a WHERE condition on fpds_raw.
+
+    Terms are FIELD:value, FIELD:"value" or FIELD:[first,last]; a * in a value is a wildcard. Ranges over date
+    fields include the whole last day, as the feed's do.
+
+    Args:
+        q: The q= parameter, e.g. 'LAST_MOD_DATE:[2024-01-01,2024-01-31] FUNDING_AGENCY_ID:"2100" PIID:W31P4Q*'.
+
+    Returns:
+        A tuple of (SQL condition, parameters).
+
+    Raises:
+        ValueError: If a term names a search field the mirror does not answer.
+    """
+    conditions = ['TRUE']
+    params = []
+    for search_field, value in _TERM.findall(q):
+        column = SEARCH_COLUMNS.get(search_field.upper())
+        if column is None:
+            raise ValueError(f"unsupported search field {search_field}")
+        if value.startswith('['):
+            first, _, last = value[1:-1].partition(',')
+            first, last = first.strip().strip('"'), last.strip().strip('"')
+            if FIELD_TYPES[column] == 'timestamp':
+                first = datetime.strptime(first.replace('/', '-'), '%Y-%m-%d')
+                last = datetime.strptime(last.replace('/', '-'), '%Y-%m-%d') + timedelta(days=1)
+                conditions.append(f"{column} >= %s AND {column} < %s")
+            else:
+                conditions.append(f"{column} BETWEEN %s AND %s")
+            params.extend([first, last])
+        else:
+            value = value.strip('"')
+            if '*' in value:
+                conditions.append(f"{column} LIKE %s")
+                params.append(value.replace('%', r'\%').replace('_', r'\_').replace('*', '%'))
+            else:
+                conditions.append(f"{column} = %s")
+                params.append(value)
+    return " AND ".join(conditions), params
+
+
+def sort_cursor(record):
+    """
+    Returns the after= value of a record: its modified time and natural key, e.g.
+    '2024-01-05T10:00:00.000000|9700|W91QUZ23C0001|P00001|'.
+    """
+    modified = record.get('modified')
+    return (f"{modified:%Y-%m-%dT%H:%M:%S.%f}" if modified else "infinity") + "|" + natural_key(record)
+
+
+def parse_cursor(after):
+    """
+    Splits an after= value into the parameters of a SORT_KEY comparison.
+
+    Raises:
+        ValueError: If the value is not a cursor made by sort_cursor().
+    """
+    values = after.split('|')
+    if len(values) != 1 + len(NATURAL_KEY):
+        raise ValueError(f"invalid after= cursor {after!r}")
+    return values
+
+
+def link_url(url, start, after=None):
+    """
+    Returns a page URL at the given start= offset, with an after= cursor or without one.
+    """
+    parts = urlparse(page_url(url, start))
+    query = parse_qs(parts.query, keep_blank_values=True)
+    query.pop('after', None)
+    if after is not None:
+        query['after'] = [after]
+    return urlunparse(parts._replace(query=urlencode(query, doseq=True, safe=':[],"*+')))
+
+
+def format_value(value):
+    if isinstance(value, datetime):
+        return value.strftime('%Y-%m-%d %H:%M:%S')
+    return str(value)
+
+
+def build_entry(feed, record):
+    """
+    Appends an atom:entry for a record to a feed element, placing each field where FIELD_LOCATIONS says the parsers
+    find it, so mirror pages parse to the same records as the feed's.
+    """
+    entry = XML.SubElement(feed, f"{{{NS['atom']}}}entry")
+    # The parsers require the atom elements, empty or not
+    for field, (kind, *location) in FIELD_LOCATIONS.items():
+        if kind == 'atom':
+            value = record.get(field)
+            XML.SubElement(entry, f"{{{NS['atom']}}}{location[0]}").text = \
+                format_value(value) if value is not None else ''
+    content = XML.SubElement(entry, f"{{{NS['atom']}}}content", {'type': 'application/xml'})
+    award = XML.SubElement(content, f"{{{NS['ns1']}}}award")
+
+    elements = {}
+
+    def element(tag, parent=award):
+        if (parent, tag) not in elements:
+            elements[(parent, tag)] = XML.SubElement(parent, f"{{{NS['ns1']}}}{tag}")
+        return elements[(parent, tag)]
+
+    for field, (kind, *location) in FIELD_LOCATIONS.items():
+        value = record.get(field)
+        if kind == 'atom' or value is None or value == '':
+            continue
+        if kind == 'text':
+            element(location[0]).text = format_value(value)
+        elif kind == 'attribute':
+            element(location[0]).set(location[1], format_value(value))
+        else:
+            parent, child = location[0]
+            element(child, element(parent)).text = format_value(value)
+    return entry
+
+
+def build_feed(records, links):
+    """
+    Serializes a page of records as an ATOM feed document with self, next and last links.
+    """
+    if lxml_etree is not None:
+        feed = lxml_etree.Element(f"{{{NS['atom']}}}feed", nsmap={None: NS['atom'], 'ns1': NS['ns1']})
+    else:
+        feed = ET.Element(f"{{{NS['atom']}}}feed")
+    XML.SubElement(feed, f"{{{NS['atom']}}}title").text = "FPDS mirror"
+    for rel, href in links.items():
+        if href:
+            XML.SubElement(feed, f"{{{NS['atom']}}}link", {'rel': rel, 'type': 'application/atom+xml', 'href': href})
+    XML.SubElement(feed, f"{{{NS['atom']}}}modified").text = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    for record in records:
+        build_entry(feed, record)
+    return XML.tostring(feed, encoding='utf-8', xml_declaration=True)
+
+
+class MirrorServer:
+    """
+    Answers ATOM feed queries from fpds_raw, ten entries per page with next and last links, as XML or JSON.
+    """
+
+    def __init__(self, connections=SERVER_CONNECTIONS, table=RAW_TABLE, **connect_args):
+        self.pool = ThreadedConnectionPool(1, connections, **connect_args)
+        self.table = table
+        # Lower case column names as returned by Postgres, mapped back to field names
+        self.columns = {field.lower(): field for field in FIELD_NAMES}
+        # q= -> (match count, time counted), so paging through a query counts its matches once
+        self.totals = {}
+        self._lock = threading.Lock()
+
+    def _total(self, cur, q, condition, params):
+        now = time.monotonic()
+        with self._lock:
+            cached = self.totals.get(q)
+        if cached is not None and now - cached[1] < TOTAL_CACHE_SECONDS:
+            return cached[0]
+        cur.execute(f"SELECT count(*) FROM {self.table} WHERE {condition}", params)
+        total = cur.fetchone()[0]
+        with self._lock:
+            self.totals = {key: value for key, value in self.totals.items() if now - value[1] < TOTAL_CACHE_SECONDS}
+            self.totals[q] = (total, now)
+        return total
+
+    def query_page(self, q, start, after=None):
+        """
+        Returns one page of a query as (records, total).
+
+        With an after= cursor the page is the PAGE_SIZE entries following it in sort order, found through the sort
+        key instead of an offset. Pages addressed by offset alone, as the 'last' link and schedulers fanning a query
+        out by start= are, are read in reverse order when they are in the second half of the query, so the offset
+        never exceeds half the match count.
+        """
+        condition, params = parse_query(q)
+        columns = ', '.join(FIELD_NAMES)
+        conn = self.pool.getconn()
+        try:
+            cur = conn.cursor()
+            # Transactions deleted from FPDS are not served, as the real feed no longer lists them
+            condition = f"{condition} AND {live_condition(cur, self.table)}"
+            total = self._total(cur, q, condition, params)
+            if after is not None:
+                placeholders = ", ".join(["%s::timestamp"] + ["%s"] * len(NATURAL_KEY))
+                cur.execute(f"SELECT {columns} FROM {self.table} WHERE {condition} AND ({SORT_KEY}) > ({placeholders}) "
+                            f"ORDER BY {SORT_KEY} LIMIT %s", params + parse_cursor(after) + [PAGE_SIZE])
+                reverse = False
+            elif start > total // 2:
+                descending = ", ".join(f"{column} DESC" for column in SORT_COLUMNS)
+                cur.execute(f"SELECT {columns} FROM {self.table} WHERE {condition} ORDER BY {descending} "
+                            f"LIMIT %s OFFSET %s",
+                            params + [max(min(PAGE_SIZE, total - start), 0), max(total - start - PAGE_SIZE, 0)])
+                reverse = True
+            else:
+                cur.execute(f"SELECT {columns} FROM {self.table} WHERE {condition} ORDER BY {SORT_KEY} "
+                            f"LIMIT %s OFFSET %s", params + [PAGE_SIZE, start])
+                reverse = False
+            names = [self.columns.get(column.name, column.name) for column in cur.description]
+            records = [dict(zip(names, row)) for row in cur.fetchall()]
+            if reverse:
+                records.reverse()
+            cur.close()
+            conn.rollback()
+        finally:
+            self.pool.putconn(conn)
+        return records, total
+
+    def search(self, text, limit=SEARCH_LIMIT):
+        """
+        Returns the ranked full-text hits of a search, see full_text_search.search().
+        """
+        conn = self.pool.getconn()
+        try:
+            hits = search(conn, text, limit, self.table)
+            conn.rollback()
+        finally:
+            self.pool.putconn(conn)
+        return hits
+
+    def respond(self, url):
+        """
+        Answers a request URL.
+
+        Returns:
+            A tuple of (status, content type, body).
+        """
+        parts = urlparse(url)
+        query = parse_qs(parts.query, keep_blank_values=True)
+        if parts.path.rstrip('/').endswith('/search'):
+            # /search?q=cloud+migration&limit=20 answers ranked full-text hits as JSON
+            try:
+                limit = int(query.get('limit', [str(SEARCH_LIMIT)])[0])
+            except ValueError as exc:
+                return 400, 'text/plain', f"{exc}\n".encode('utf-8')
+            hits = self.search(query.get('q', [''])[0], limit)
+            return 200, 'application/json', json.dumps({'hits': hits}, default=str).encode('utf-8')
+        if query.get('FEEDNAME', ['PUBLIC'])[0] != 'PUBLIC':
+            return 400, 'text/plain', b"the mirror only serves FEEDNAME=PUBLIC\n"
+        try:
+            start = int(query.get('start', ['0'])[0])
+            after = query.get('after', [None])[0]
+            records, total = self.query_page(query.get('q', [''])[0], start, after)
+        except ValueError as exc:
+            return 400, 'text/plain', f"{exc}\n".encode('utf-8')
+
+        last_start = max((total - 1) // PAGE_SIZE * PAGE_SIZE, 0)
+        links = {
+            'self': link_url(url, start, after),
+            'next': link_url(url, start + PAGE_SIZE, sort_cursor(records[-1]))
+            if records and start + PAGE_SIZE < total else None,
+            'last': link_url(url, last_start) if total else None,
+        }
+        if query.get('format', ['xml'])[0] == 'json':
+            body = json.dumps({'total': total, 'start': start, 'links': links, 'records': records}, default=str)
+            return 200, 'application/json', body.encode('utf-8')
+        return 200, 'application/atom+xml', build_feed(records, links)
+
+    def handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                url = f"http://{self.headers.get('Host', 'localhost')}{self.path}"
+                try:
+                    status, content_type, body = server.respond(url)
+                except psycopg2.Error as exc:
+                    print(f"{self.path} generated an exception: {exc}")
+                    status, content_type, body = 500, 'text/plain', b"database error\n"
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        return Handler
+
+    def close(self):
+        self.pool.closeall()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve ATOM feed queries from the local fpds_raw mirror.")
+    parser.add_argument('--host', default=SERVER_HOST)
+    parser.add_argument('--port', type=int, default=SERVER_PORT)
+    parser.add_argument('--skip-indexes', action='store_true', help="do not build missing fpds_raw indexes first")
+    args = parser.parse_args()
+
+    connect_args = {'dbname': DATABASE, 'user': USER, 'password': PASSWORD, 'host': HOST, 'port': PORT}
+    if not args.skip_indexes:
+        conn = psycopg2.connect(**connect_args)
+        try:
+            build_secondary_indexes(conn)
+        finally:
+            conn.close()
+
+    mirror = MirrorServer(**connect_args)
+    httpd = ThreadingHTTPServer((args.host, args.port), mirror.handler())
+    print(f"Serving http://{args.host}:{args.port}/ezsearch/FEEDS/ATOM?FEEDNAME=PUBLIC&q=...")
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        print("Stopping.")
+    finally:
+        httpd.server_close()
+        mirror.close()
+
+
+if __name__ == "__main__":
+    main()
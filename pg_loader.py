@@ -0,0 +1,208 @@
+import concurrent.futures
+import functools
+
+import psycopg2
+from psycopg2.pool import ThreadedConnectionPool
+
+from change_feed import natural_key_match
+from fpds_fields import FIELD_NAMES, insert_statement, record_values
+from type_conversion import convert_batch, report_rejects
+
+# Records converted and inserted per transaction
+BATCH_SIZE = 500
+
+# Connections used by ParallelLoader
+LOAD_CONNECTIONS = 4
+
+# Session settings for bulk backfills: skip waiting for the WAL flush on every commit. A crash can lose the last few
+# commits (never corrupt the table), which a backfill can simply re-run.
+BULK_SESSION_SETTINGS = {'synchronous_commit': 'off'}
+
+
+def insert_raw_rows(conn, rows, table="fpds_raw"):
+    """
+    Inserts converted rows into the denormalized fpds_raw table.
+    """
+    cur = conn.cursor()
+    cur.executemany(insert_statement(table), [record_values(row) for row in rows])
+    cur.close()
+
+
+def load_records(conn, records, insert_rows=insert_raw_rows, dead_letters=None, batch_size=BATCH_SIZE, commit=True):
+    """
+    Converts and loads records in batches, isolating failures to the rows that cause them.
+
+    Each batch is committed on its own. If a batch fails, it is rolled back and retried one row at a time inside
+    savepoints, so the good rows of the batch still commit and only the bad rows go to the dead letters.
+
+    Args:
+        conn: An open psycopg2 connection.
+        records: The parsed records to load.
+        insert_rows: Function (conn, rows) inserting a list of converted rows. Defaults to insert_raw_rows.
+        dead_letters: Optional DeadLetterFile receiving the rows that failed.
+        batch_size: The number of records per batch.
+        commit: Commit each batch. With False everything loads in the caller's transaction, failed batches are
+            rolled back to a savepoint, and the caller is responsible for committing.
+
+    Returns:
+        A tuple of (rows loaded, rows failed).
+    """
+    loaded = 0
+    failed = 0
+    for start in range(0, len(records), batch_size):
+        batch = records[start:start + batch_size]
+        rows, rejects = convert_batch(batch)
+        report_rejects(rejects)
+
+        cur = conn.cursor()
+        if not commit:
+            cur.execute("SAVEPOINT load_batch")
+        try:
+            insert_rows(conn, rows)
+            if commit:
+                conn.commit()
+            else:
+                cur.execute("RELEASE SAVEPOINT load_batch")
+            loaded += len(rows)
+            cur.close()
+            continue
+        except psycopg2.Error as e:
+            if commit:
+                conn.rollback()
+            else:
+                cur.execute("ROLLBACK TO SAVEPOINT load_batch")
+            print(f"Batch starting at record {start} failed, retrying one row at a time: {e}")
+
+        for record, row in zip(batch, rows):
+            cur.execute("SAVEPOINT load_row")
+            try:
+                insert_rows(conn, [row])
+                cur.execute("RELEASE SAVEPOINT load_row")
+                loaded += 1
+            except psycopg2.Error as e:
+                cur.execute("ROLLBACK TO SAVEPOINT load_row")
+                failed += 1
+                print(f"Row {record.get('PIID')} mod {record.get('modNumber')} failed: {e}")
+                if dead_letters is not None:
+                    dead_letters.record_row(record, e)
+        if commit:
+            conn.commit()
+        cur.close()
+
+    print(f"Loaded {loaded} rows, {failed} failed.")
+    return loaded, failed
+
+
+def apply_session_settings(conn, settings):
+    """
+    Applies session-level settings, e.g. {'synchronous_commit': 'off', 'work_mem': '256MB'}, to a connection.
+    """
+    cur = conn.cursor()
+    for name, value in settings.items():
+        cur.execute("SELECT set_config(%s, %s, false)", (name, str(value)))
+    conn.commit()
+    cur.close()
+
+
+class ParallelLoader:
+    """
+    Spreads load_records() batches over a pool of connections loading in parallel.
+
+    With staging_table set, rows go to an UNLOGGED copy of the target table (no WAL) and are moved into the target
+    in one INSERT ... SELECT by merge(). Only use it with the default raw inserts: the star schema loader shares
+    dimension caches between batches and should run on a single connection.
+    """
+
+    def __init__(self, connections=LOAD_CONNECTIONS, insert_rows=insert_raw_rows, dead_letters=None,
+                 staging_table=None, table="fpds_raw", session_settings=None, batch_size=BATCH_SIZE, replace=False,
+                 **connect_args):
+        """
+        Args:
+            connections: The number of connections, and so of batches loading at once.
+            insert_rows: Function (conn, rows) inserting converted rows. Defaults to insert_raw_rows.
+            dead_letters: Optional DeadLetterFile receiving the rows that failed.
+            staging_table: Optional name of an unlogged staging table to load into before merge().
+            table: The target table the staging table is modelled on and merged into.
+            session_settings: Optional settings applied to every connection, e.g. BULK_SESSION_SETTINGS.
+            batch_size: The number of records per batch.
+            replace: On merge(), delete the stored rows of the staged transactions first, as
+                pg_schema.replace_partitioned_rows() does for direct loads.
+            connect_args: psycopg2.connect() arguments, e.g. dbname, user, password, host and port.
+        """
+        self.pool = ThreadedConnectionPool(1, connections, **connect_args)
+        self.connections = connections
+        self.dead_letters = dead_letters
+        self.staging_table = staging_table
+        self.table = table
+        self.session_settings = session_settings or {}
+        self.batch_size = batch_size
+        self.insert_rows = insert_rows
+        self.replace = replace
+        self._prepared = set()
+
+        if staging_table:
+            self.insert_rows = functools.partial(insert_raw_rows, table=staging_table)
+            conn = self.pool.getconn()
+            try:
+                cur = conn.cursor()
+                cur.execute(f"CREATE UNLOGGED TABLE IF NOT EXISTS {staging_table} (LIKE {table} INCLUDING DEFAULTS)")
+                conn.commit()
+                cur.close()
+            finally:
+                self.pool.putconn(conn)
+
+    def _load_batch(self, batch):
+        conn = self.pool.getconn()
+        try:
+            if id(conn) not in self._prepared:
+                apply_session_settings(conn, self.session_settings)
+                self._prepared.add(id(conn))
+            return load_records(conn, batch, self.insert_rows, self.dead_letters, self.batch_size)
+        finally:
+            self.pool.putconn(conn)
+
+    def load(self, records):
+        """
+        Loads records, one batch per connection at a time.
+
+        Returns:
+            A tuple of (rows loaded, rows failed).
+        """
+        batches = [records[start:start + self.batch_size] for start in range(0, len(records), self.batch_size)]
+        loaded = 0
+        failed = 0
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.connections) as executor:
+            for batch_loaded, batch_failed in executor.map(self._load_batch, batches):
+                loaded += batch_loaded
+                failed += batch_failed
+        return loaded, failed
+
+    def merge(self):
+        """
+        Moves the staged rows into the target table and empties the staging table. Does nothing without staging.
+
+        Returns:
+            The number of rows merged.
+        """
+        if not self.staging_table:
+            return 0
+        conn = self.pool.getconn()
+        try:
+            cur = conn.cursor()
+            if self.replace:
+                cur.execute(f"DELETE FROM {self.table} raw USING {self.staging_table} staged "
+                            f"WHERE {natural_key_match('raw', 'staged')}")
+            # Named columns, since generated columns such as search_vector cannot be inserted into
+            columns = ", ".join(FIELD_NAMES)
+            cur.execute(f"INSERT INTO {self.table} ({columns}) SELECT {columns} FROM {self.staging_table}")
+            merged = cur.rowcount
+            cur.execute(f"TRUNCATE {self.staging_table}")
+            conn.commit()
+            cur.close()
+        finally:
+            self.pool.putconn(conn)
+        print(f"Merged {merged} staged rows into {self.table}.")
+        return merged
+
+    def close(self):
+        self.pool.closeall()
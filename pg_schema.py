@@ -0,0 +1,440 @@
+import argparse
+import threading
+from datetime import date, datetime
+
+import psycopg2
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE
+from psycopg2.extras import execute_values
+
+from change_feed import NATURAL_KEY, natural_key_match
+from fpds_fields import FIELD_NAMES, FIELD_SPEC
+from pg_loader import insert_raw_rows
+from type_conversion import AMOUNT_MODE, convert_timestamp
+
+# Database configuration - currently using pgsql Docker container
+DATABASE = "fpds"
+USER = "postgres"  # replace with your username/env variable
+PASSWORD = "default"  # replace with your password/env variable
+HOST = "0.0.0.0"
+PORT = "5432"
+
+RAW_TABLE = "fpds_raw"
+
+# fpds_raw is range partitioned on this timestamp field ('signedDate' or 'modified'), one partition per
+# PARTITION_INTERVAL ('month' or 'year'). Rows without a value go to the default partition.
+PARTITION_COLUMN = "signedDate"
+PARTITION_INTERVAL = "month"
+
+# Full-text search document kept in a generated tsvector column, as (field, weight); weight A ranks highest
+SEARCH_COLUMN = "search_vector"
+SEARCH_CONFIG = "english"
+SEARCH_FIELDS = [
+    ('descriptionOfContractRequirement', 'A'),
+    ('vendorName', 'B'),
+    ('UEILegalBusinessName', 'B'),
+    ('ultimateParentUEIName', 'C'),
+]
+
+# Set by deleted_sync.py on the rows of transactions deleted from FPDS, when it keeps them as tombstones
+DELETED_COLUMN = "deleted_at"
+
+# Order the mirror server pages queries in: modification time, then natural key. Missing values are coalesced so
+# every row compares in the keyset (after=) conditions; the feed_order index below matches these expressions
+FEED_ORDER = ["coalesce(modified, 'infinity')", "coalesce(contractingOfficeAgencyID, '')", "coalesce(PIID, '')",
+              "coalesce(modNumber, '')", "coalesce(referencedIDVPIID, '')"]
+
+# Secondary indexes on fpds_raw as (index suffix, columns) or (index suffix, columns, index method). They are
+# created on every partition.
+SECONDARY_INDEXES = [
+    ('natural_key', ['contractingOfficeAgencyID', 'PIID', 'modNumber', 'referencedIDVPIID']),
+    ('piid', ['PIID']),
+    ('uei', ['UEI']),
+    ('ultimate_parent', ['ultimateParentUEI']),
+    ('funding_agency', ['fundingRequestingAgencyID']),
+    ('naics', ['principalNAICSCode']),
+    ('modified', ['modified']),
+    # Prefix wildcard searches (PIID:W91*, PRINCIPAL_NAICS_CODE:5413*) whatever the database collation
+    ('piid_pattern', ['PIID text_pattern_ops']),
+    ('naics_pattern', ['principalNAICSCode text_pattern_ops']),
+    ('search', [SEARCH_COLUMN], 'gin'),
+    # Mirror server pages, so each page is an index range scan from its after= cursor
+    ('feed_order', [f"({expression})" for expression in FEED_ORDER]),
+]
+
+
+def column_type(field_type, amount_mode=AMOUNT_MODE):
+    """
+    Returns the Postgres type of a field spec type.
+    """
+    if field_type == 'amount':
+        return 'BIGINT' if amount_mode == "cents" else 'NUMERIC'
+    if field_type == 'timestamp':
+        return 'TIMESTAMP'
+    return 'TEXT'
+
+
+def search_vector_ddl(config=SEARCH_CONFIG, fields=SEARCH_FIELDS):
+    """
+    Returns the definition of the generated search_vector column. Postgres computes it as each batch is inserted,
+    so the full-text index is kept up to date by the load itself.
+    """
+    document = " || ".join(f"setweight(to_tsvector('{config}'::regconfig, coalesce({field}, '')), '{weight}')"
+                           for field, weight in fields)
+    return f"{SEARCH_COLUMN} tsvector GENERATED ALWAYS AS ({document}) STORED"
+
+
+def partition_bounds(value, interval=PARTITION_INTERVAL):
+    """
+    Returns the (start, end) dates of the partition holding a date or datetime.
+    """
+    if interval == "year":
+        return date(value.year, 1, 1), date(value.year + 1, 1, 1)
+    start = date(value.year, value.month, 1)
+    end = date(value.year + 1, 1, 1) if value.month == 12 else date(value.year, value.month + 1, 1)
+    return start, end
+
+
+def partition_name(start, table=RAW_TABLE, interval=PARTITION_INTERVAL):
+    if interval == "year":
+        return f"{table}_p{start:%Y}"
+    return f"{table}_p{start:%Y_%m}"
+
+
+def existing_columns(cur, table=RAW_TABLE):
+    cur.execute("SELECT column_name FROM information_schema.columns WHERE table_name = %s", (table,))
+    return {row[0] for row in cur.fetchall()}
+
+
+def live_condition(cur, table=RAW_TABLE, alias=None):
+    """
+    Returns a condition leaving out the rows deleted_sync.py marked deleted, or TRUE if the table has no deleted_at
+    column.
+
+    Args:
+        cur: A cursor, used to look the column up.
+        table: The raw table.
+        alias: The alias of the table in the query, if any.
+    """
+    if DELETED_COLUMN not in existing_columns(cur, table):
+        return "TRUE"
+    return f"{alias + '.' if alias else ''}{DELETED_COLUMN} IS NULL"
+
+
+def is_partitioned(cur, table=RAW_TABLE):
+    cur.execute("SELECT relkind FROM pg_class WHERE relname = %s", (table,))
+    row = cur.fetchone()
+    if row is None:
+        return None
+    return row[0] == 'p'
+
+
+def create_raw_table(conn, table=RAW_TABLE, partition_column=PARTITION_COLUMN):
+    """
+    Creates the partitioned fpds_raw table and its default partition, or adds any field spec columns an existing
+    table is missing.
+
+    Args:
+        conn: An open psycopg2 connection. The caller is responsible for committing.
+        table: The table name.
+        partition_column: The timestamp field the table is range partitioned on.
+    """
+    cur = conn.cursor()
+    partitioned = is_partitioned(cur, table)
+    if partitioned is None:
+        column_ddl = ", ".join([f"{name} {column_type(field_type)}" for name, field_type in FIELD_SPEC] +
+                               [search_vector_ddl()])
+        cur.execute(f"CREATE TABLE {table} ({column_ddl}) PARTITION BY RANGE ({partition_column})")
+        cur.execute(f"CREATE TABLE {table}_default PARTITION OF {table} DEFAULT")
+        print(f"Created {table}, partitioned by {partition_column}.")
+    else:
+        # Columns are stored lower case, as the unquoted names in insert_statement() are
+        columns = existing_columns(cur, table)
+        for name, field_type in FIELD_SPEC:
+            if name.lower() not in columns:
+                cur.execute(f"ALTER TABLE {table} ADD COLUMN {name} {column_type(field_type)}")
+                print(f"Added column {name} to {table}.")
+        if SEARCH_COLUMN not in columns:
+            print(f"{table} has no {SEARCH_COLUMN} column for full-text search, run 'python pg_schema.py migrate' "
+                  f"to add it.")
+        if not partitioned:
+            print(f"{table} is not partitioned, run 'python pg_schema.py migrate' to convert it.")
+    cur.close()
+
+
+def list_partitions(cur, table=RAW_TABLE):
+    cur.execute("""
+        SELECT child.relname FROM pg_inherits
+        JOIN pg_class parent ON parent.oid = pg_inherits.inhparent
+        JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+        WHERE parent.relname = %s
+    """, (table,))
+    return {row[0] for row in cur.fetchall()}
+
+
+class PartitionManager:
+    """
+    Creates the partitions a batch of rows needs before it is inserted, remembering the ones that already exist.
+
+    One manager is shared by the threads of a parallel load. It only remembers partitions seen committed: a partition
+    created in a transaction that is later rolled back must not be skipped by the next batch, or its rows would land
+    in the default partition.
+    """
+
+    def __init__(self, table=RAW_TABLE, column=PARTITION_COLUMN, interval=PARTITION_INTERVAL):
+        self.table = table
+        self.column = column
+        self.interval = interval
+        self.known = None
+        self._lock = threading.Lock()
+
+    def ensure(self, conn, values):
+        """
+        Creates any missing partitions for a set of partition column values.
+
+        Args:
+            conn: An open psycopg2 connection. Partitions are created in the caller's transaction.
+            values: datetime values, or raw strings that are converted first. Empty or invalid values are skipped.
+
+        Returns:
+            The names of the partitions created.
+        """
+        needed = {}
+        for value in values:
+            if isinstance(value, str):
+                try:
+                    value = convert_timestamp(value) if value else None
+                except ValueError:
+                    value = None
+            if isinstance(value, (date, datetime)):
+                start, end = partition_bounds(value, self.interval)
+                needed[partition_name(start, self.table, self.interval)] = (start, end)
+
+        # Before the connection's transaction has started, a listing only shows committed partitions
+        committed_view = conn.get_transaction_status() == TRANSACTION_STATUS_IDLE
+        cur = conn.cursor()
+        with self._lock:
+            known = self.known
+        if known is None:
+            known = list_partitions(cur, self.table)
+            if committed_view:
+                with self._lock:
+                    self.known = known
+        missing = {name: bounds for name, bounds in needed.items() if name not in known}
+        created = []
+        if missing:
+            # Serialize partition creation between loaders running in parallel
+            cur.execute("SELECT pg_advisory_xact_lock(hashtext(%s))", (self.table,))
+            existing = list_partitions(cur, self.table)
+            for name, (start, end) in sorted(missing.items()):
+                if name in existing:
+                    continue
+                cur.execute(f"CREATE TABLE {name} PARTITION OF {self.table} FOR VALUES FROM (%s) TO (%s)",
+                            (start, end))
+                created.append(name)
+                print(f"Created partition {name}.")
+            if committed_view:
+                # The partitions just created are remembered once a later listing shows them committed
+                with self._lock:
+                    self.known = existing
+        cur.close()
+        return created
+
+    def reset(self):
+        # Partitions created in a transaction that was rolled back no longer exist
+        with self._lock:
+            self.known = None
+
+
+PARTITIONS = PartitionManager()
+
+
+def insert_partitioned_rows(conn, rows, table=RAW_TABLE):
+    """
+    Inserts converted rows into fpds_raw, creating the partitions they need first.
+
+    Usable as the insert_rows function of pg_loader.load_records().
+    """
+    try:
+        PARTITIONS.ensure(conn, [row.get(PARTITION_COLUMN) for row in rows])
+        insert_raw_rows(conn, rows, table)
+    except psycopg2.Error:
+        PARTITIONS.reset()
+        raise
+
+
+def replace_partitioned_rows(conn, rows, table=RAW_TABLE):
+    """
+    Inserts converted rows into fpds_raw in place of the stored versions of the same transactions, so a changed
+    transaction keeps one row.
+
+    A unique index on a partitioned table has to include the partition column, which can change between versions, so
+    the stored rows are deleted by natural key rather than upserted. Usable as the insert_rows function of
+    pg_loader.load_records().
+    """
+    keys = sorted({tuple(row.get(field) or '' for field in NATURAL_KEY) for row in rows})
+    cur = conn.cursor()
+    execute_values(cur, f"""
+        DELETE FROM {table} raw USING (VALUES %s) AS incoming (agency_id, piid, mod_number, referenced_idv_piid)
+        WHERE {natural_key_match('raw', 'incoming', ['agency_id', 'piid', 'mod_number', 'referenced_idv_piid'])}
+    """, keys, page_size=1000)
+    cur.close()
+    insert_partitioned_rows(conn, rows, table)
+
+
+def drop_secondary_indexes(conn, table=RAW_TABLE):
+    """
+    Drops the secondary indexes (and with them every partition's copy) before a bulk backfill.
+
+    Args:
+        conn: An open psycopg2 connection. The caller is responsible for committing.
+    """
+    cur = conn.cursor()
+    for suffix, *_ in SECONDARY_INDEXES:
+        cur.execute(f"DROP INDEX IF EXISTS {table}_{suffix}_idx")
+    cur.close()
+    print(f"Dropped secondary indexes on {table}.")
+
+
+def build_secondary_indexes(conn, table=RAW_TABLE, concurrently=True):
+    """
+    Creates any missing secondary indexes.
+
+    Postgres cannot build an index concurrently on a partitioned table, so with concurrently set the index is
+    created on the parent only (invalid), built concurrently on each partition without blocking inserts, and each
+    partition's index is attached, which makes the parent index valid. Indexes that are already valid are left
+    alone, and partitions that already have a child index attached are skipped.
+
+    Args:
+        conn: An open psycopg2 connection. It is switched to autocommit while concurrent builds run.
+        table: The partitioned table.
+        concurrently: Build without locking out writes.
+    """
+    cur = conn.cursor()
+    partitions = sorted(list_partitions(cur, table))
+    table_columns = existing_columns(cur, table)
+    conn.commit()
+
+    autocommit = conn.autocommit
+    conn.autocommit = True
+    try:
+        for suffix, columns, *method in SECONDARY_INDEXES:
+            index = f"{table}_{suffix}_idx"
+            if SEARCH_COLUMN in columns and SEARCH_COLUMN not in table_columns:
+                # Added by 'python pg_schema.py migrate'
+                print(f"Skipping index {index}: {table} has no {SEARCH_COLUMN} column yet.")
+                continue
+            column_list = f"USING {method[0]} ({', '.join(columns)})" if method else f"({', '.join(columns)})"
+            if not concurrently:
+                cur.execute(f"CREATE INDEX IF NOT EXISTS {index} ON {table} {column_list}")
+                continue
+            cur.execute("SELECT indisvalid FROM pg_index WHERE indexrelid = to_regclass(%s)", (index,))
+            row = cur.fetchone()
+            if row is not None and row[0]:
+                # Every partition has its copy; partitions created since got one automatically
+                continue
+            cur.execute(f"CREATE INDEX IF NOT EXISTS {index} ON ONLY {table} {column_list}")
+            built = 0
+            for partition in partitions:
+                # Partitions created after the parent index already have a child index attached to it
+                cur.execute("""
+                    SELECT 1 FROM pg_inherits
+                    JOIN pg_index ON pg_index.indexrelid = pg_inherits.inhrelid
+                    WHERE pg_inherits.inhparent = to_regclass(%s) AND pg_index.indrelid = to_regclass(%s)
+                """, (index, partition))
+                if cur.fetchone() is not None:
+                    continue
+                partition_index = f"{partition}_{suffix}_idx"
+                cur.execute(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {partition_index} ON {partition} {column_list}")
+                cur.execute(f"ALTER INDEX {index} ATTACH PARTITION {partition_index}")
+                built += 1
+            print(f"Built index {index} on {built} of {len(partitions)} partitions.")
+    finally:
+        conn.autocommit = autocommit
+        cur.close()
+
+
+def add_search_column(conn, table=RAW_TABLE):
+    """
+    Adds the generated search_vector column to an fpds_raw created before full-text search.
+
+    Computing the column for the existing rows rewrites the whole table under an ACCESS EXCLUSIVE lock, which blocks
+    loads and queries until it finishes, so it only runs on an explicit migrate.
+
+    Args:
+        conn: An open psycopg2 connection. Commits on success.
+    """
+    cur = conn.cursor()
+    if SEARCH_COLUMN in existing_columns(cur, table):
+        cur.close()
+        return
+    print(f"Adding {SEARCH_COLUMN} to {table}; this rewrites the table.")
+    cur.execute(f"ALTER TABLE {table} ADD COLUMN {search_vector_ddl()}")
+    conn.commit()
+    cur.close()
+    print(f"Added column {SEARCH_COLUMN} to {table}.")
+
+
+def migrate_to_partitioned(conn, table=RAW_TABLE):
+    """
+    Converts an existing unpartitioned fpds_raw into the partitioned layout.
+
+    The old table is renamed to <table>_unpartitioned and kept, so it can be checked and dropped by hand.
+
+    Args:
+        conn: An open psycopg2 connection. The migration commits on success.
+    """
+    cur = conn.cursor()
+    if is_partitioned(cur, table) is not False:
+        print(f"{table} is already partitioned or does not exist.")
+        cur.close()
+        return
+
+    legacy = f"{table}_unpartitioned"
+    legacy_columns = existing_columns(cur, table)
+    cur.execute(f"ALTER TABLE {table} RENAME TO {legacy}")
+    create_raw_table(conn, table)
+
+    cur.execute(f"SELECT DISTINCT date_trunc('month', {PARTITION_COLUMN}) FROM {legacy} "
+                f"WHERE {PARTITION_COLUMN} IS NOT NULL")
+    manager = PartitionManager(table)
+    manager.ensure(conn, [row[0] for row in cur.fetchall()])
+
+    columns = ", ".join(name for name in FIELD_NAMES if name.lower() in legacy_columns)
+    cur.execute(f"INSERT INTO {table} ({columns}) SELECT {columns} FROM {legacy}")
+    moved = cur.rowcount
+    conn.commit()
+    cur.close()
+    print(f"Moved {moved} rows from {legacy} into partitioned {table}. Drop {legacy} once checked.")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Manage the partitioned fpds_raw schema.")
+    parser.add_argument('command', choices=['create', 'migrate', 'partitions', 'drop-indexes', 'build-indexes'])
+    parser.add_argument('dates', nargs='*', help="for 'partitions': dates (YYYY-MM-DD) to create partitions for")
+    parser.add_argument('--blocking', action='store_true', help="build indexes without CONCURRENTLY")
+    args = parser.parse_args()
+
+    conn = psycopg2.connect(dbname=DATABASE, user=USER, password=PASSWORD, host=HOST, port=PORT)
+    try:
+        if args.command == 'create':
+            create_raw_table(conn)
+            conn.commit()
+            build_secondary_indexes(conn)
+        elif args.command == 'migrate':
+            migrate_to_partitioned(conn)
+            add_search_column(conn)
+            build_secondary_indexes(conn)
+        elif args.command == 'partitions':
+            PARTITIONS.ensure(conn, args.dates)
+            conn.commit()
+        elif args.command == 'drop-indexes':
+            drop_secondary_indexes(conn)
+            conn.commit()
+        elif args.command == 'build-indexes':
+            build_secondary_indexes(conn, concurrently=not args.blocking)
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
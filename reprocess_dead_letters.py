@@ -0,0 +1,83 @@
+import argparse
+import os
+
+import psycopg2
+
+from dead_letters import DEAD_LETTER_FILE, DeadLetterFile, read_dead_letters
+from fpds_feed import fetch_page
+from pg_loader import load_records
+from pg_schema import create_raw_table, insert_partitioned_rows
+
+# Database configuration - currently using pgsql Docker container
+DATABASE = "fpds"
+USER = "postgres"  # replace with your username/env variable
+PASSWORD = "default"  # replace with your password/env variable
+HOST = "0.0.0.0"
+PORT = "5432"
+
+
+def reprocess(path=DEAD_LETTER_FILE):
+    """
+    Retries every entry of a dead-letter file and rewrites the file with the entries that still fail.
+
+    Failed pages are fetched and parsed again (that page only - the pages after it were already fetched by the
+    original run), and their records are loaded along with the failed rows.
+
+    Args:
+        path: The dead-letter file to reprocess.
+    """
+    entries = read_dead_letters(path)
+    if not entries:
+        print(f"No dead letters in {path}.")
+        return
+
+    # Write the remaining failures to a new file so the original is only replaced once the run is done
+    retry_path = path + ".retry"
+    if os.path.exists(retry_path):
+        os.remove(retry_path)
+    still_failing = DeadLetterFile(retry_path)
+
+    records = [entry['record'] for entry in entries if entry['kind'] == 'row']
+    pages = [entry['url'] for entry in entries if entry['kind'] == 'page']
+    print(f"Reprocessing {len(pages)} pages and {len(records)} rows from {path}.")
+
+    for url in pages:
+        try:
+            page_records, _ = fetch_page(url)
+            records.extend(page_records)
+        except Exception as exc:
+            print(f"{url} generated an exception: {exc}")
+            still_failing.record_page(url, exc)
+
+    if records:
+        conn = None
+        try:
+            conn = psycopg2.connect(dbname=DATABASE, user=USER, password=PASSWORD, host=HOST, port=PORT)
+            create_raw_table(conn)
+            conn.commit()
+            # Rows go to their month partitions, not fpds_raw_default, see pg_schema.insert_partitioned_rows()
+            load_records(conn, records, insert_rows=insert_partitioned_rows, dead_letters=still_failing)
+        except psycopg2.Error as e:
+            print(f"Database error: {e}")
+            # Nothing was retried, keep the original file as it is
+            return
+        finally:
+            if conn is not None:
+                conn.close()
+
+    if still_failing.count:
+        os.replace(retry_path, path)
+    else:
+        os.remove(path)
+    print(f"Reprocessing complete. {still_failing.count} entries still failing.")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Retry the pages and rows recorded in a dead-letter file.")
+    parser.add_argument('path', nargs='?', default=DEAD_LETTER_FILE, help="dead-letter file to reprocess")
+    args = parser.parse_args()
+    reprocess(args.path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+import argparse
+import time
+
+from dead_letters import DeadLetterFile
+from fpds_feed import RATE_LIMITER, set_projection
+from fpds_filters import FilterSet
+from job_spec import expand_shards, load_job_spec, shard_label, shard_url
+from sinks import create_sink
+from work_scheduler import MAX_WORKERS, WORKERS, JobScheduler
+
+
+def run_job(path, fields=None, filters=None):
+    """
+    Runs every query of a job spec file through one scheduler, rate limiter and sink.
+
+    Args:
+        path: The job spec file, see job_spec.load_job_spec().
+        fields: Optional column projection overriding the spec's 'fields'.
+        filters: Optional filter expressions added to the spec's 'filters', see fpds_filters.parse_filter().
+    """
+    start_time = time.time()
+
+    spec = load_job_spec(path)
+    if spec.get('requests_per_second'):
+        RATE_LIMITER.set_rate(spec['requests_per_second'])
+
+    # Predicates the feed supports narrow every shard's query; the rest filter records before they reach the sink
+    record_filter = FilterSet(list(spec.get('filters', [])) + list(filters or []))
+    shards = [shard._replace(criteria=record_filter.query_criteria(shard.criteria)) for shard in expand_shards(spec)]
+    print(record_filter.describe())
+
+    dead_letters = DeadLetterFile(spec.get('dead_letters', "dead_letters.jsonl"))
+    fields = fields or spec.get('fields')
+    sink = create_sink(spec.get('output'), dead_letters, fields)
+    # Parse only what the job asked for and what the sink uses, plus what the local filters read. A projection adds to
+    # the sink's fields rather than replacing them, or database and change-feed sinks would store partial rows
+    set_projection(list(dict.fromkeys(list(fields or []) + list(sink.fields) + record_filter.fields)))
+
+    total = 0
+
+    def on_shard_done(shard, records):
+        nonlocal total
+        parsed = len(records)
+        records = record_filter.apply(records)
+        print(f"Shard {shard_label(shard)} complete: {parsed} records, {len(records)} after filters.")
+        sink.write(records)
+        total += len(records)
+
+    try:
+        scheduler = JobScheduler(spec.get('workers', WORKERS), dead_letters, on_shard_done,
+                                 spec.get('max_workers', MAX_WORKERS))
+        scheduler.run({shard: shard_url(shard) for shard in shards})
+    finally:
+        sink.close()
+
+    duration = time.time() - start_time
+    print(f'Job complete. Total records parsed and stored: {total}. Time taken: {duration}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run every query listed in a job spec file.")
+    parser.add_argument('job_file', help="job spec file (.json, .toml or .yaml)")
+    parser.add_argument('--fields', help="comma-separated fields to parse and output, e.g. PIID,UEI,obligatedAmount")
+    parser.add_argument('--filter', action='append', dest='filters',
+                        help="filter expression, e.g. 'obligatedAmount >= 100000'; may be repeated")
+    args = parser.parse_args()
+    run_job(args.job_file, args.fields.split(',') if args.fields else None, args.filters)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,333 @@
+import csv
+import functools
+
+import psycopg2
+
+from change_feed import ChangeTracker
+from contract_rollup import CONTRACT_ROLLUP
+from fpds_fields import FIELD_NAMES, FIELD_TYPES, projection_fields
+from lookup_tables import write_lookup_tables
+from pg_loader import BULK_SESSION_SETTINGS, ParallelLoader, load_records
+from pg_schema import (PARTITION_COLUMN, PARTITIONS, build_secondary_indexes, create_raw_table, drop_secondary_indexes,
+                       insert_partitioned_rows, replace_partitioned_rows)
+from type_conversion import convert_amount, convert_timestamp
+from vendor_hierarchy import VENDOR_HIERARCHY
+
+# Database configuration - currently using pgsql Docker container
+DATABASE = "fpds"
+USER = "postgres"  # replace with your username/env variable
+PASSWORD = "default"  # replace with your password/env variable
+HOST = "0.0.0.0"
+PORT = "5432"
+
+
+class CsvSink:
+    """
+    Streams records to a CSV file as they arrive, writing the header once.
+    """
+
+    def __init__(self, filename="fpds_data.csv", fields=FIELD_NAMES):
+        self.filename = filename
+        self.fields = list(fields)
+        self.file = open(filename, mode='w', newline='', encoding='utf-8')
+        self.writer = csv.DictWriter(self.file, fieldnames=fields, extrasaction='ignore')
+        self.writer.writeheader()
+        self.count = 0
+
+    def write(self, records):
+        self.writer.writerows(records)
+        self.count += len(records)
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+        print(f"Data exported to {self.filename} successfully. {self.count} records.")
+
+
+class PostgresSink:
+    """
+    Loads records into fpds_raw over one connection kept open for the whole job, or over a pool of connections
+    loading batches in parallel when connections > 1.
+    """
+
+    def __init__(self, dead_letters=None, dbname=DATABASE, user=USER, password=PASSWORD, host=HOST, port=PORT,
+                 connections=1, bulk=False, rollup=False, replace=False):
+        """
+        Args:
+            dead_letters: Optional DeadLetterFile receiving the rows that failed.
+            dbname, user, password, host, port: Where to connect.
+            connections: Connections loading batches in parallel.
+            bulk: Drop the secondary indexes and load through an unlogged staging table with BULK_SESSION_SETTINGS;
+                on close the staging table is merged into fpds_raw and the indexes are rebuilt concurrently.
+            rollup: Keep contract_current and idv_rollup up to date, see contract_rollup.ContractRollup.
+            replace: Replace the stored rows of the same transactions instead of adding rows, for changed records,
+                see pg_schema.replace_partitioned_rows().
+        """
+        self.conn = psycopg2.connect(dbname=dbname, user=user, password=password, host=host, port=port)
+        # fpds_raw has a column for every field
+        self.fields = FIELD_NAMES
+        self.bulk = bulk
+        self.rollup = rollup
+        insert_rows = replace_partitioned_rows if replace else insert_partitioned_rows
+        self.insert_rows = CONTRACT_ROLLUP.insert_with_rollup(insert_rows) if rollup else insert_rows
+        create_raw_table(self.conn)
+        if bulk:
+            drop_secondary_indexes(self.conn)
+        self.conn.commit()
+
+        self.loader = None
+        if connections > 1 or bulk:
+            self.loader = ParallelLoader(connections, insert_rows=self.insert_rows, dead_letters=dead_letters,
+                                         staging_table="fpds_raw_staging" if bulk else None,
+                                         session_settings=BULK_SESSION_SETTINGS if bulk else None, replace=replace,
+                                         dbname=dbname, user=user, password=password, host=host, port=port)
+        self.dead_letters = dead_letters
+        self.count = 0
+
+    def write(self, records):
+        if self.bulk:
+            # Staged rows only reach fpds_raw on merge, so their partitions have to exist up front
+            PARTITIONS.ensure(self.conn, [record.get(PARTITION_COLUMN) for record in records])
+            self.conn.commit()
+        if self.loader is not None:
+            loaded, _ = self.loader.load(records)
+        else:
+            loaded, _ = load_records(self.conn, records, self.insert_rows, self.dead_letters)
+        self.count += loaded
+
+    def flush(self):
+        """
+        Persists the lookup tables and vendor hierarchy built up so far, for sinks kept open across runs.
+        """
+        write_lookup_tables(self.conn)
+        VENDOR_HIERARCHY.persist(self.conn)
+        self.conn.commit()
+
+    def close(self):
+        try:
+            if self.loader is not None:
+                self.loader.merge()
+            if self.bulk:
+                build_secondary_indexes(self.conn)
+                if self.rollup:
+                    # Staged rows skip the per-batch rollup, so roll up the whole table once
+                    CONTRACT_ROLLUP.rebuild(self.conn)
+            # Persist the shared lookup tables and vendor hierarchy built up while parsing
+            write_lookup_tables(self.conn)
+            VENDOR_HIERARCHY.persist(self.conn)
+            self.conn.commit()
+        finally:
+            if self.loader is not None:
+                self.loader.close()
+            self.conn.close()
+        print(f"Loaded {self.count} records into Postgres.")
+
+
+class ChangeFeedSink:
+    """
+    Passes only new and changed records on to another sink and writes each batch's change set, see
+    change_feed.ChangeTracker.
+    """
+
+    def __init__(self, sink, delta_path=None, write_table=True, dbname=DATABASE, user=USER, password=PASSWORD,
+                 host=HOST, port=PORT):
+        self.sink = sink
+        # The content hash covers every field, so a narrower projection would report every record as changed
+        self.fields = FIELD_NAMES
+        self.conn = psycopg2.connect(dbname=dbname, user=user, password=password, host=host, port=port)
+        self.tracker = ChangeTracker(delta_path, write_table)
+
+    def write(self, records):
+        changes = self.tracker.classify(self.conn, records)
+        self.sink.write([change['record'] for change in changes])
+        # State is stored after the inner sink has the records, so a failed write shows up as a change next run
+        self.tracker.record(self.conn, changes)
+        self.conn.commit()
+
+    def flush(self):
+        self.sink.flush()
+
+    def close(self):
+        try:
+            self.sink.close()
+        finally:
+            self.conn.close()
+        self.tracker.report()
+
+
+# Default summary: obligated dollars by funding agency x NAICS x signed month
+AGGREGATE_GROUP_BY = ['fundingRequestingAgencyID', 'principalNAICSCode', 'signedDate:month']
+AGGREGATE_SUM = ['obligatedAmount']
+AGGREGATE_MIN = ['signedDate']
+AGGREGATE_MAX = ['signedDate']
+
+# Timestamp buckets for group-by fields written as 'field:bucket'
+DATE_BUCKETS = {'day': '%Y-%m-%d', 'month': '%Y-%m', 'year': '%Y'}
+
+
+@functools.lru_cache(maxsize=4096)
+def _timestamp(value):
+    return convert_timestamp(value)
+
+
+@functools.lru_cache(maxsize=4096)
+def _amount(value):
+    return convert_amount(value)
+
+
+class AggregateSink:
+    """
+    Summarizes the record stream into a group-by table in memory instead of storing the records.
+
+    Each group keeps one row of accumulators (count, sums, minimums, maximums), so memory grows with the number of
+    groups, not records. The summary is written as CSV on close.
+    """
+
+    def __init__(self, path="fpds_summary.csv", group_by=None, sums=None, minimums=None, maximums=None):
+        """
+        Args:
+            path: The CSV file the summary is written to.
+            group_by: Fields to group by. Timestamp fields can be bucketed as 'field:day', 'field:month' or
+                'field:year'.
+            sums: Amount fields to total.
+            minimums: Fields to take the minimum of; timestamps and amounts compare by value.
+            maximums: Fields to take the maximum of.
+
+        Raises:
+            ValueError: If a field is not in the field spec, or cannot be summed or bucketed.
+        """
+        self.path = path
+        self.group_by = [tuple(field.split(':', 1)) if ':' in field else (field, None)
+                         for field in (group_by or AGGREGATE_GROUP_BY)]
+        self.sums = list(AGGREGATE_SUM if sums is None else sums)
+        self.minimums = list(AGGREGATE_MIN if minimums is None else minimums)
+        self.maximums = list(AGGREGATE_MAX if maximums is None else maximums)
+
+        for field, bucket in self.group_by:
+            if field not in FIELD_TYPES:
+                raise ValueError(f"unknown group-by field {field!r}")
+            if bucket is not None and (bucket not in DATE_BUCKETS or FIELD_TYPES[field] != 'timestamp'):
+                raise ValueError(f"cannot bucket {field!r} by {bucket!r}")
+        for field in self.sums:
+            if FIELD_TYPES.get(field) != 'amount':
+                raise ValueError(f"cannot sum {field!r}, only amount fields")
+        for field in self.minimums + self.maximums:
+            if field not in FIELD_TYPES:
+                raise ValueError(f"unknown field {field!r}")
+
+        # Only the fields the summary uses need to be parsed
+        self.fields = list(dict.fromkeys([field for field, _ in self.group_by] + self.sums + self.minimums +
+                                         self.maximums))
+        self.groups = {}
+        self.count = 0
+        self.rejected = 0
+
+    def _value(self, record, field):
+        value = record.get(field)
+        if not value:
+            return None
+        field_type = FIELD_TYPES[field]
+        if field_type == 'timestamp':
+            return _timestamp(value)
+        if field_type == 'amount':
+            return _amount(value)
+        return value
+
+    def write(self, records):
+        for record in records:
+            try:
+                key = []
+                for field, bucket in self.group_by:
+                    value = self._value(record, field)
+                    key.append(value.strftime(DATE_BUCKETS[bucket]) if bucket and value is not None else value)
+                sums = [self._value(record, field) for field in self.sums]
+                minimums = [self._value(record, field) for field in self.minimums]
+                maximums = [self._value(record, field) for field in self.maximums]
+            except ValueError:
+                # Values that do not convert are left out of the summary, as convert_batch() would reject them
+                self.rejected += 1
+                continue
+
+            group = self.groups.get(tuple(key))
+            if group is None:
+                group = self.groups[tuple(key)] = {'count': 0, 'sums': [0] * len(self.sums),
+                                                   'minimums': [None] * len(self.minimums),
+                                                   'maximums': [None] * len(self.maximums)}
+            group['count'] += 1
+            for index, value in enumerate(sums):
+                if value is not None:
+                    group['sums'][index] += value
+            for index, value in enumerate(minimums):
+                if value is not None and (group['minimums'][index] is None or value < group['minimums'][index]):
+                    group['minimums'][index] = value
+            for index, value in enumerate(maximums):
+                if value is not None and (group['maximums'][index] is None or value > group['maximums'][index]):
+                    group['maximums'][index] = value
+            self.count += 1
+
+    def rows(self):
+        """
+        Returns the summary as a header and a list of rows, sorted by group.
+        """
+        header = ([f"{field}_{bucket}" if bucket else field for field, bucket in self.group_by] + ['count'] +
+                  [f"sum_{field}" for field in self.sums] + [f"min_{field}" for field in self.minimums] +
+                  [f"max_{field}" for field in self.maximums])
+        # Missing values sort last; the others compare by value, as every group-by column holds a single type
+        groups = sorted(self.groups.items(), key=lambda item: [(value is None, value if value is not None else '')
+                                                               for value in item[0]])
+        rows = [list(key) + [group['count']] + group['sums'] + group['minimums'] + group['maximums']
+                for key, group in groups]
+        return header, rows
+
+    def flush(self):
+        self.close()
+
+    def close(self):
+        header, rows = self.rows()
+        with open(self.path, mode='w', newline='', encoding='utf-8') as file:
+            writer = csv.writer(file)
+            writer.writerow(header)
+            writer.writerows(rows)
+        rejected = f", {self.rejected} records with invalid values skipped" if self.rejected else ""
+        print(f"Summary of {self.count} records in {len(rows)} groups exported to {self.path}{rejected}.")
+
+
+def create_sink(output=None, dead_letters=None, fields=None):
+    """
+    Creates a sink from the 'output' section of a job spec.
+
+    Args:
+        output: A dictionary with 'type' ('csv' or 'postgres') and the sink's options, e.g. {'type': 'csv',
+            'path': 'fpds_data.csv'} or {'type': 'postgres', 'host': 'db', 'dbname': 'fpds', 'connections': 8,
+            'bulk': True}. Defaults to CSV. A 'changes' entry, e.g. {'path': 'changes.jsonl'}, passes only new and
+            changed records on and writes the change set (to record_changes and the optional JSONL path).
+            {'type': 'aggregate', 'path': 'summary.csv', 'group_by': [...], 'sum': [...], 'min': [...], 'max': [...]}
+            summarizes in memory instead, see AggregateSink.
+        dead_letters: Optional DeadLetterFile for rows that fail to load.
+        fields: Optional column projection, used as the CSV columns.
+
+    Returns:
+        A sink with write(records), flush(), close() and fields, the fields it needs parsed.
+    """
+    output = dict(output or {'type': 'csv'})
+    sink_type = output.pop('type', 'csv')
+    changes = output.pop('changes', None)
+    if sink_type == 'csv':
+        sink = CsvSink(output.get('path', "fpds_data.csv"), projection_fields(output.get('fields', fields)))
+    elif sink_type == 'postgres':
+        if changes:
+            # Changed transactions replace their stored rows
+            output.setdefault('replace', True)
+        sink = PostgresSink(dead_letters=dead_letters, **output)
+    elif sink_type == 'aggregate':
+        sink = AggregateSink(output.get('path', "fpds_summary.csv"), output.get('group_by'), output.get('sum'),
+                             output.get('min'), output.get('max'))
+    else:
+        raise ValueError(f"unknown output type {sink_type!r}")
+
+    if changes:
+        connect_args = {key: output[key] for key in ('dbname', 'user', 'password', 'host', 'port') if key in output}
+        sink = ChangeFeedSink(sink, changes.get('path'), changes.get('table', True), **connect_args)
+    return sink
@@ -0,0 +1,290 @@
+from psycopg2.extras import execute_values
+
+# Dimension tables for the normalized loader. Each dimension maps a natural key taken from the record to a surrogate
+# key on the fact table. 'columns' pairs a dimension column with the record field it is filled from; the first
+# 'natural_key' columns identify a row, the rest are attributes that are refreshed with the latest values seen.
+DIMENSIONS = {
+    'agency': {
+        'table': 'dim_agency',
+        'key': 'agency_key',
+        'natural_key': ['department_id', 'agency_id'],
+        'columns': [
+            ('department_id', 'fundingRequestingDepartmentID'),
+            ('agency_id', 'fundingRequestingAgencyID'),
+            ('department_name', 'fundingRequestingDepartmentName'),
+            ('agency_name', 'fundingRequestingAgencyName'),
+        ],
+    },
+    'funding_office': {
+        'table': 'dim_office',
+        'key': 'office_key',
+        'natural_key': ['agency_id', 'office_id'],
+        'columns': [
+            ('agency_id', 'fundingRequestingAgencyID'),
+            ('office_id', 'fundingRequestingOfficeID'),
+            ('office_name', 'fundingRequestingOfficeName'),
+        ],
+    },
+    # Contracting offices share dim_office with funding offices; the feed carries no name for them
+    'contracting_office': {
+        'table': 'dim_office',
+        'key': 'office_key',
+        'natural_key': ['agency_id', 'office_id'],
+        'columns': [
+            ('agency_id', 'contractingOfficeAgencyID'),
+            ('office_id', 'contractingOfficeID'),
+        ],
+    },
+    'naics': {
+        'table': 'dim_naics',
+        'key': 'naics_key',
+        'natural_key': ['naics_code'],
+        'columns': [
+            ('naics_code', 'principalNAICSCode'),
+            ('naics_description', 'principalNAICSCodeDescription'),
+        ],
+    },
+    'psc': {
+        'table': 'dim_psc',
+        'key': 'psc_key',
+        'natural_key': ['psc_code'],
+        'columns': [
+            ('psc_code', 'productOrServiceCode'),
+            ('psc_description', 'productOrServiceCodeDescription'),
+            ('psc_type', 'productOrServiceCodeType'),
+        ],
+    },
+    'vendor': {
+        'table': 'dim_vendor',
+        'key': 'vendor_key',
+        'natural_key': ['uei'],
+        'columns': [
+            ('uei', 'UEI'),
+            ('uei_legal_business_name', 'UEILegalBusinessName'),
+            ('vendor_name', 'vendorName'),
+            ('vendor_alternate_name', 'vendorAlternateName'),
+            ('vendor_legal_organization_name', 'vendorLegalOrganizationName'),
+            ('immediate_parent_uei', 'immediateParentUEI'),
+            ('immediate_parent_uei_name', 'immediateParentUEIName'),
+            ('domestic_parent_uei', 'domesticParentUEI'),
+            ('domestic_parent_uei_name', 'domesticParentUEIName'),
+            ('ultimate_parent_uei', 'ultimateParentUEI'),
+            ('ultimate_parent_uei_name', 'ultimateParentUEIName'),
+            ('street_address', 'vendorStreetAddress'),
+            ('city', 'vendorCity'),
+            ('state', 'vendorState'),
+            ('zip_code', 'vendorZIPCode'),
+            ('country_code', 'vendorCountryCode'),
+            ('phone_no', 'vendorPhoneNo'),
+            ('fax_no', 'vendorFaxNo'),
+            ('congressional_district_code', 'vendorCongressionalDistrictCode'),
+            ('entity_data_source', 'vendorEntityDataSource'),
+        ],
+    },
+}
+
+# Fact table surrogate key columns, one per dimension role
+FACT_KEYS = [
+    ('funding_agency_key', 'agency'),
+    ('funding_office_key', 'funding_office'),
+    ('contracting_office_key', 'contracting_office'),
+    ('naics_key', 'naics'),
+    ('psc_key', 'psc'),
+    ('vendor_key', 'vendor'),
+]
+
+# Record fields stored directly on the fact table, with their Postgres types
+FACT_FIELDS = [
+    ('title', 'TEXT'),
+    ('modified', 'TIMESTAMP'),
+    ('PIID', 'TEXT'),
+    ('modNumber', 'TEXT'),
+    ('referencedIDVPIID', 'TEXT'),
+    ('IDVModNumber', 'TEXT'),
+    ('obligatedAmount', 'NUMERIC'),
+    ('baseAndExercisedOptionsValue', 'NUMERIC'),
+    ('baseAndAllOptionsValue', 'NUMERIC'),
+    ('totalObligatedAmount', 'NUMERIC'),
+    ('totalBaseAndExercisedOptionsValue', 'NUMERIC'),
+    ('totalBaseAndAllOptionsValue', 'NUMERIC'),
+    ('signedDate', 'TIMESTAMP'),
+    ('effectiveDate', 'TIMESTAMP'),
+    ('currentCompletionDate', 'TIMESTAMP'),
+    ('ultimateCompletionDate', 'TIMESTAMP'),
+    ('descriptionOfContractRequirement', 'TEXT'),
+    ('reasonForModification', 'TEXT'),
+    ('reasonForModificationDescription', 'TEXT'),
+    ('createdBy', 'TEXT'),
+    ('createdDate', 'TIMESTAMP'),
+    ('lastModifiedBy', 'TEXT'),
+    ('lastModifiedDate', 'TIMESTAMP'),
+    ('approvedBy', 'TEXT'),
+    ('approvedDate', 'TIMESTAMP'),
+    ('closedBy', 'TEXT'),
+    ('closedDate', 'TIMESTAMP'),
+]
+
+FACT_TABLE = 'fpds_fact'
+
+
+def create_star_schema(conn):
+    """
+    Creates the dimension and fact tables if they do not already exist.
+
+    Args:
+        conn: An open psycopg2 connection. The caller is responsible for committing.
+    """
+    cur = conn.cursor()
+    created = set()
+    for dimension in DIMENSIONS.values():
+        if dimension['table'] in created:
+            continue
+        # Merge the columns of every role that shares this table
+        columns = []
+        for other in DIMENSIONS.values():
+            if other['table'] == dimension['table']:
+                columns.extend(column for column, _ in other['columns'] if column not in columns)
+        column_ddl = ", ".join(f"{column} TEXT NOT NULL DEFAULT ''" for column in columns)
+        cur.execute(f"""
+            CREATE TABLE IF NOT EXISTS {dimension['table']} (
+                {dimension['key']} SERIAL PRIMARY KEY,
+                {column_ddl},
+                UNIQUE ({', '.join(dimension['natural_key'])})
+            )
+        """)
+        created.add(dimension['table'])
+
+    key_ddl = ", ".join(f"{column} INTEGER REFERENCES {DIMENSIONS[role]['table']}" for column, role in FACT_KEYS)
+    field_ddl = ", ".join(f"{field} {sql_type}" for field, sql_type in FACT_FIELDS)
+    cur.execute(f"CREATE TABLE IF NOT EXISTS {FACT_TABLE} (id BIGSERIAL PRIMARY KEY, {key_ddl}, {field_ddl})")
+    for column, _ in FACT_KEYS:
+        cur.execute(f"CREATE INDEX IF NOT EXISTS {FACT_TABLE}_{column}_idx ON {FACT_TABLE} ({column})")
+    cur.close()
+
+
+def natural_key(record, dimension):
+    """
+    Returns the natural key tuple of a record for a dimension, or None if every part of the key is empty.
+    """
+    fields = dict(dimension['columns'])
+    key = tuple(record.get(fields[column]) or '' for column in dimension['natural_key'])
+    return key if any(key) else None
+
+
+class DimensionCache:
+    """
+    In-memory natural key -> surrogate key map for one dimension role.
+
+    The cache is warmed from the table on first use so that bulk loads only go to the database for values that have
+    never been seen before. Misses are resolved a batch at a time with a single upsert.
+    """
+
+    def __init__(self, role):
+        self.role = role
+        self.dimension = DIMENSIONS[role]
+        self.keys = {}
+        self.warm = False
+
+    def load(self, cur):
+        natural_columns = ", ".join(self.dimension['natural_key'])
+        cur.execute(f"SELECT {natural_columns}, {self.dimension['key']} FROM {self.dimension['table']}")
+        for row in cur.fetchall():
+            self.keys[tuple(row[:-1])] = row[-1]
+        self.warm = True
+
+    def resolve(self, cur, records):
+        """
+        Makes sure every natural key in a batch of records has a surrogate key, inserting new dimension rows as needed.
+
+        Args:
+            cur: An open cursor.
+            records: The batch of records being loaded.
+
+        Returns:
+            The natural keys added to the cache, so they can be forgotten if the transaction is rolled back.
+        """
+        if not self.warm:
+            self.load(cur)
+
+        columns = [column for column, _ in self.dimension['columns']]
+        missing = {}
+        for record in records:
+            key = natural_key(record, self.dimension)
+            if key is not None and key not in self.keys and key not in missing:
+                missing[key] = tuple(record.get(field) or '' for _, field in self.dimension['columns'])
+        if not missing:
+            return []
+
+        natural_columns = self.dimension['natural_key']
+        attributes = [column for column in columns if column not in natural_columns]
+        # Keep the latest non-empty attribute values; DO UPDATE (rather than DO NOTHING) also makes RETURNING
+        # produce the key of rows that already existed
+        if attributes:
+            updates = ", ".join(f"{column} = COALESCE(NULLIF(EXCLUDED.{column}, ''), {self.dimension['table']}.{column})"
+                                for column in attributes)
+        else:
+            updates = f"{natural_columns[0]} = EXCLUDED.{natural_columns[0]}"
+        query = f"""
+            INSERT INTO {self.dimension['table']} ({', '.join(columns)}) VALUES %s
+            ON CONFLICT ({', '.join(natural_columns)}) DO UPDATE SET {updates}
+            RETURNING {', '.join(natural_columns)}, {self.dimension['key']}
+        """
+        added = []
+        for row in execute_values(cur, query, list(missing.values()), fetch=True):
+            self.keys[tuple(row[:-1])] = row[-1]
+            added.append(tuple(row[:-1]))
+        return added
+
+    def forget(self, keys):
+        for key in keys:
+            self.keys.pop(key, None)
+
+    def key_for(self, record):
+        key = natural_key(record, self.dimension)
+        return self.keys.get(key) if key is not None else None
+
+
+class StarSchemaLoader:
+    """
+    Loads records into the dimension tables and the fpds_fact table.
+
+    Keep one loader for the whole run so the dimension caches stay warm between batches.
+    """
+
+    def __init__(self):
+        self.caches = {role: DimensionCache(role) for role in DIMENSIONS}
+
+    def load(self, conn, records):
+        """
+        Inserts a batch of records converted by type_conversion.convert_batch().
+
+        Usable as the insert_rows function of pg_loader.load_records().
+
+        Args:
+            conn: An open psycopg2 connection. The caller is responsible for committing.
+            records: The records to load.
+
+        Returns:
+            The number of fact rows inserted.
+        """
+        cur = conn.cursor()
+        added = {}
+        try:
+            for role, cache in self.caches.items():
+                added[role] = cache.resolve(cur, records)
+
+            rows = []
+            for record in records:
+                keys = [self.caches[role].key_for(record) for _, role in FACT_KEYS]
+                rows.append(tuple(keys) + tuple(record.get(field) for field, _ in FACT_FIELDS))
+
+            columns = [column for column, _ in FACT_KEYS] + [field for field, _ in FACT_FIELDS]
+            execute_values(cur, f"INSERT INTO {FACT_TABLE} ({', '.join(columns)}) VALUES %s", rows, page_size=500)
+        except Exception:
+            # Dimension rows inserted by this batch go away if the caller rolls back, so drop their cached keys
+            for role, keys in added.items():
+                self.caches[role].forget(keys)
+            raise
+        finally:
+            cur.close()
+        return len(rows)
@@ -0,0 +1,139 @@
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+
+from fpds_fields import FIELD_SPEC
+
+# How amount fields are converted: "decimal" keeps exact dollars and cents as Decimal, "cents" stores a scaled integer
+AMOUNT_MODE = "decimal"
+
+# Formats tried after the ISO fast path, in order
+FALLBACK_DATE_FORMATS = ['%Y/%m/%d', '%m/%d/%Y', '%m/%d/%Y %H:%M:%S', '%Y-%m-%d %H:%M:%S.%f']
+
+
+def convert_amount(value, mode=AMOUNT_MODE):
+    """
+    Converts an FPDS amount string without going through float.
+
+    Args:
+        value: The amount string, e.g. '12345.67'.
+        mode: "decimal" to return a Decimal, "cents" to return an integer number of cents.
+
+    Returns:
+        The converted amount.
+
+    Raises:
+        ValueError: If the value is not a valid amount.
+    """
+    try:
+        amount = Decimal(value.strip().replace(',', ''))
+    except InvalidOperation:
+        raise ValueError(f"invalid amount {value!r}")
+    if not amount.is_finite():
+        raise ValueError(f"invalid amount {value!r}")
+    if mode == "cents":
+        return int((amount * 100).to_integral_value())
+    return amount
+
+
+def convert_timestamp(value):
+    """
+    Converts an FPDS date or timestamp string to a datetime.
+
+    FPDS uses ISO 8601 ('2023-11-01 10:22:33', '2023-11-01T00:00:00', '2023-11-01'), which is handled by the fast
+    fromisoformat() path. Anything else falls back to FALLBACK_DATE_FORMATS.
+
+    Raises:
+        ValueError: If the value matches none of the known formats.
+    """
+    value = value.strip()
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        pass
+    for date_format in FALLBACK_DATE_FORMATS:
+        try:
+            return datetime.strptime(value, date_format)
+        except ValueError:
+            continue
+    raise ValueError(f"invalid timestamp {value!r}")
+
+
+def convert_column(values, converter):
+    """
+    Converts one column of a batch, caching results so repeated values (dates, round amounts) are converted once.
+
+    Args:
+        values: The raw column values.
+        converter: The function converting a single non-empty value.
+
+    Returns:
+        A tuple of (converted values, list of (row index, raw value, error message)).
+    """
+    cache = {}
+    converted = []
+    rejects = []
+    for index, value in enumerate(values):
+        if value is None or value == '':
+            converted.append(None)
+            continue
+        result = cache.get(value)
+        if result is None:
+            try:
+                result = converter(value)
+            except (ValueError, AttributeError) as e:
+                rejects.append((index, value, str(e)))
+                converted.append(None)
+                continue
+            cache[value] = result
+        converted.append(result)
+    return converted, rejects
+
+
+def convert_batch(records, spec=FIELD_SPEC, amount_mode=AMOUNT_MODE):
+    """
+    Converts a batch of parsed records to typed values, one column at a time.
+
+    Amounts become Decimal (or integer cents), timestamps become datetime, and empty values of any type become None.
+    Values that cannot be converted are set to None and reported instead of failing the batch.
+
+    Args:
+        records: The parsed records. They are not modified.
+        spec: The field spec describing each field's type.
+        amount_mode: "decimal" or "cents", see convert_amount().
+
+    Returns:
+        A tuple of (converted records, rejects), where each reject is a dictionary with the row index, field, raw
+        value and error.
+    """
+    converters = {
+        'amount': lambda value: convert_amount(value, amount_mode),
+        'timestamp': convert_timestamp,
+    }
+
+    rows = [dict(record) for record in records]
+    rejects = []
+    for field, field_type in spec:
+        column = [record.get(field) for record in records]
+        converter = converters.get(field_type)
+        if converter is None:
+            converted = [value if value != '' else None for value in column]
+        else:
+            converted, field_rejects = convert_column(column, converter)
+            for index, value, error in field_rejects:
+                rejects.append({'index': index, 'field': field, 'value': value, 'error': error})
+        for row, value in zip(rows, converted):
+            row[field] = value
+    return rows, rejects
+
+
+def report_rejects(rejects, limit=20):
+    """
+    Prints a summary of the values rejected by convert_batch().
+    """
+    if not rejects:
+        return
+    print(f"Type conversion rejected {len(rejects)} values:")
+    for reject in rejects[:limit]:
+        print(f"  row {reject['index']} {reject['field']}: {reject['error']}")
+    if len(rejects) > limit:
+        print(f"  ... and {len(rejects) - limit} more")
@@ -0,0 +1,182 @@
+import csv
+import threading
+from collections import deque
+
+from psycopg2.extras import execute_values
+
+PARENT_FIELDS = ['immediateParentUEI', 'domesticParentUEI', 'ultimateParentUEI']
+
+
+class VendorHierarchy:
+    """
+    Incrementally maintained index of the vendor corporate hierarchy.
+
+    Keeps UEI -> (immediate, domestic, ultimate) parent UEIs and the reverse parent -> child UEIs map, so a corporate
+    family can be expanded without self-joins over fpds_raw. Records are fed in as they are parsed; only vendors whose
+    parents changed are written back on persist().
+    """
+
+    def __init__(self):
+        self.parents = {}
+        self.names = {}
+        self.children = {}
+        self.dirty = set()
+        self._lock = threading.Lock()
+
+    def update(self, record):
+        """
+        Updates the index from a parsed record.
+
+        Args:
+            record: The parsed record dictionary.
+        """
+        uei = record.get('UEI')
+        # A record parsed without the parent fields says nothing about the parents, rather than that there are none
+        if not uei or any(field not in record for field in PARENT_FIELDS):
+            return
+        parents = tuple(record.get(field) or '' for field in PARENT_FIELDS)
+        with self._lock:
+            # Capture parent names too so the persisted table can label roll-ups
+            for field in PARENT_FIELDS:
+                parent = record.get(field)
+                if parent and record.get(field + 'Name'):
+                    self.names[parent] = record[field + 'Name']
+            if record.get('UEILegalBusinessName'):
+                self.names[uei] = record['UEILegalBusinessName']
+
+            old = self.parents.get(uei)
+            if old == parents:
+                return
+            if old is not None:
+                for parent in old:
+                    if parent in self.children:
+                        self.children[parent].discard(uei)
+            for parent in parents:
+                if parent and parent != uei:
+                    self.children.setdefault(parent, set()).add(uei)
+            self.parents[uei] = parents
+            self.dirty.add(uei)
+
+    def update_many(self, records):
+        for record in records:
+            self.update(record)
+
+    def parents_of(self, uei):
+        """
+        Returns the (immediate, domestic, ultimate) parent UEIs of a vendor, or None if the vendor is unknown.
+        """
+        return self.parents.get(uei)
+
+    def descendants(self, parent_uei):
+        """
+        Returns every UEI below a parent in the hierarchy, following children transitively.
+
+        Args:
+            parent_uei: The parent UEI, typically an ultimate parent.
+
+        Returns:
+            A set of descendant UEIs, not including the parent itself.
+        """
+        found = set()
+        with self._lock:
+            queue = deque([parent_uei])
+            while queue:
+                for child in self.children.get(queue.popleft(), ()):
+                    if child not in found and child != parent_uei:
+                        found.add(child)
+                        queue.append(child)
+        return found
+
+    def expand(self, ultimate_ueis):
+        """
+        Expands one or more ultimate parent UEIs into the full set of UEIs in their corporate families.
+
+        Args:
+            ultimate_ueis: A UEI or list of UEIs.
+
+        Returns:
+            A sorted list of the parent UEIs and all of their descendants.
+        """
+        if isinstance(ultimate_ueis, str):
+            ultimate_ueis = [ultimate_ueis]
+        family = set(ultimate_ueis)
+        for uei in ultimate_ueis:
+            family |= self.descendants(uei)
+        return sorted(family)
+
+    def __len__(self):
+        return len(self.parents)
+
+    def load(self, conn):
+        """
+        Loads a previously persisted hierarchy from the vendor_hierarchy table, if it exists.
+
+        Args:
+            conn: An open psycopg2 connection.
+        """
+        cur = conn.cursor()
+        cur.execute("SELECT to_regclass('vendor_hierarchy')")
+        if cur.fetchone()[0] is not None:
+            cur.execute("SELECT uei, name, immediate_parent_uei, domestic_parent_uei, ultimate_parent_uei "
+                        "FROM vendor_hierarchy")
+            for uei, name, immediate, domestic, ultimate in cur.fetchall():
+                self.update({'UEI': uei, 'UEILegalBusinessName': name, 'immediateParentUEI': immediate,
+                             'domesticParentUEI': domestic, 'ultimateParentUEI': ultimate})
+            # Rows loaded from the table are already persisted
+            self.dirty.clear()
+        cur.close()
+
+    def persist(self, conn):
+        """
+        Upserts the vendors whose parents changed since the last persist into the vendor_hierarchy table.
+
+        Args:
+            conn: An open psycopg2 connection. The caller is responsible for committing.
+
+        Returns:
+            The number of vendors written.
+        """
+        cur = conn.cursor()
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS vendor_hierarchy (
+                uei TEXT PRIMARY KEY,
+                name TEXT,
+                immediate_parent_uei TEXT,
+                domestic_parent_uei TEXT,
+                ultimate_parent_uei TEXT,
+                updated_at TIMESTAMP NOT NULL DEFAULT now()
+            )
+        """)
+        cur.execute("CREATE INDEX IF NOT EXISTS vendor_hierarchy_ultimate_idx ON vendor_hierarchy (ultimate_parent_uei)")
+        cur.execute("CREATE INDEX IF NOT EXISTS vendor_hierarchy_immediate_idx ON vendor_hierarchy (immediate_parent_uei)")
+
+        with self._lock:
+            rows = [(uei, self.names.get(uei, '')) + self.parents[uei] for uei in self.dirty]
+            self.dirty = set()
+        if rows:
+            execute_values(cur, """
+                INSERT INTO vendor_hierarchy (uei, name, immediate_parent_uei, domestic_parent_uei, ultimate_parent_uei)
+                VALUES %s
+                ON CONFLICT (uei) DO UPDATE SET
+                    name = EXCLUDED.name,
+                    immediate_parent_uei = EXCLUDED.immediate_parent_uei,
+                    domestic_parent_uei = EXCLUDED.domestic_parent_uei,
+                    ultimate_parent_uei = EXCLUDED.ultimate_parent_uei,
+                    updated_at = now()
+            """, rows, page_size=1000)
+        cur.close()
+        print(f"Vendor hierarchy: {len(rows)} vendors updated, {len(self.parents)} indexed.")
+        return len(rows)
+
+    def output_csv(self, filename="vendor_hierarchy.csv"):
+        with self._lock:
+            rows = [(uei, self.names.get(uei, '')) + parents for uei, parents in sorted(self.parents.items())]
+        with open(filename, mode='w', newline='', encoding='utf-8') as file:
+            writer = csv.writer(file)
+            writer.writerow(['UEI', 'name', 'immediateParentUEI', 'domesticParentUEI', 'ultimateParentUEI'])
+            writer.writerows(rows)
+        print(f"Vendor hierarchy exported to {filename} successfully.")
+
+
+# Shared index fed by the parser
+VENDOR_HIERARCHY = VendorHierarchy()
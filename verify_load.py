@@ -0,0 +1,252 @@
+import argparse
+import concurrent.futures
+import csv
+from datetime import timedelta
+
+import psycopg2
+import requests
+
+from change_feed import NATURAL_KEY, natural_key
+from dead_letters import DeadLetterFile
+from fpds_feed import PAGE_SIZE, build_query_url, fetch_all_pages, fetch_page, page_start, set_projection
+from fpds_filters import FEED_FILTER_FIELDS, FilterSet
+from job_spec import expand_shards, load_job_spec, shard_label
+from pg_schema import RAW_TABLE, live_condition
+from sinks import create_sink
+from work_scheduler import WORKERS, JobScheduler
+
+# Database configuration - currently using pgsql Docker container
+DATABASE = "fpds"
+USER = "postgres"  # replace with your username/env variable
+PASSWORD = "default"  # replace with your password/env variable
+HOST = "0.0.0.0"
+PORT = "5432"
+
+# Threads probing the feed for the expected counts of each shard and day
+VERIFY_WORKERS = 16
+
+# Gap report written by a verification pass, one row per shard and day that is short or could not be checked
+GAP_REPORT = "gap_report.csv"
+
+# fpds_raw column of each query criteria key
+CRITERIA_COLUMNS = {key: field for field, key in FEED_FILTER_FIELDS.items()}
+
+
+def shard_days(shard):
+    """
+    Returns every LAST_MOD_DATE day of a shard.
+    """
+    return [shard.start_date + timedelta(days=offset) for offset in range((shard.end_date - shard.start_date).days + 1)]
+
+
+def expected_counts(url):
+    """
+    Asks the feed how many pages and records a query has, from its first page and, if it has more than one, its
+    last page.
+
+    Returns:
+        A tuple of (pages, records).
+    """
+    records, links = fetch_page(url)
+    if links['last']:
+        last_start = page_start(links['last'])
+        if last_start == 0:
+            return 1, len(records)
+        last_records, _ = fetch_page(links['last'])
+        return last_start // PAGE_SIZE + 1, last_start + len(last_records)
+    if links['next']:
+        # No 'last' link to count with: page through
+        records = fetch_all_pages(url)
+        return -(-len(records) // PAGE_SIZE), len(records)
+    return 1, len(records)
+
+
+def criteria_condition(criteria):
+    """
+    Translates a shard's query criteria into a WHERE condition on fpds_raw.
+
+    Returns:
+        A tuple of (SQL condition, parameters).
+    """
+    conditions = ['TRUE']
+    params = []
+    for key, value in criteria:
+        column = CRITERIA_COLUMNS[key]
+        if isinstance(value, (tuple, list)):
+            conditions.append(f"{column} BETWEEN %s AND %s")
+            params.extend(value)
+        elif '*' in str(value):
+            conditions.append(f"{column} LIKE %s")
+            params.append(str(value).replace('*', '%'))
+        else:
+            conditions.append(f"{column} = %s")
+            params.append(str(value))
+    return " AND ".join(conditions), params
+
+
+def stored_counts(conn, shard, table=RAW_TABLE):
+    """
+    Counts the rows of a shard stored in fpds_raw, per day of their feed modified time, leaving out rows marked
+    deleted.
+
+    Returns:
+        A dictionary mapping each day to its row count.
+    """
+    condition, params = criteria_condition(shard.criteria)
+    cur = conn.cursor()
+    cur.execute(f"""
+        SELECT modified::date, count(*) FROM {table}
+        WHERE modified >= %s AND modified < %s AND {condition} AND {live_condition(cur, table)}
+        GROUP BY 1
+    """, [shard.start_date, shard.end_date + timedelta(days=1)] + params)
+    counts = dict(cur.fetchall())
+    cur.close()
+    return counts
+
+
+def stored_keys(conn, shard, day, table=RAW_TABLE):
+    """
+    Returns the natural keys of the rows of a shard stored for one day.
+    """
+    condition, params = criteria_condition(shard.criteria)
+    cur = conn.cursor()
+    cur.execute(f"""
+        SELECT {', '.join(NATURAL_KEY)} FROM {table}
+        WHERE modified >= %s AND modified < %s AND {condition} AND {live_condition(cur, table)}
+    """, [day, day + timedelta(days=1)] + params)
+    keys = {natural_key(dict(zip(NATURAL_KEY, row))) for row in cur.fetchall()}
+    cur.close()
+    return keys
+
+
+def find_gaps(conn, shards, workers=VERIFY_WORKERS):
+    """
+    Compares the expected page and record counts of every shard and day with the rows stored in fpds_raw.
+
+    Args:
+        conn: An open psycopg2 connection.
+        shards: The job's shards, see job_spec.expand_shards().
+        workers: Threads probing the feed.
+
+    Returns:
+        The list of gaps, each a dictionary with shard, day, expected_pages, expected_records, stored_records and
+        error. Days the feed could not be probed for have an error and no expected counts.
+    """
+    stored = {shard: stored_counts(conn, shard) for shard in shards}
+    probes = {(shard, day): build_query_url(f"{day:%Y-%m-%d}", f"{day:%Y-%m-%d}", dict(shard.criteria))
+              for shard in shards for day in shard_days(shard)}
+    print(f"Verifying {len(shards)} shards over {len(probes)} shard days.")
+
+    gaps = []
+    checked_records = 0
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        future_to_probe = {executor.submit(expected_counts, url): probe for probe, url in probes.items()}
+        for future in concurrent.futures.as_completed(future_to_probe):
+            shard, day = future_to_probe[future]
+            stored_records = stored[shard].get(day, 0)
+            gap = {'shard': shard, 'day': day, 'expected_pages': None, 'expected_records': None,
+                   'stored_records': stored_records, 'error': None}
+            try:
+                gap['expected_pages'], gap['expected_records'] = future.result()
+            # SyntaxError covers malformed XML from both the ElementTree and lxml backends
+            except (requests.RequestException, SyntaxError, AttributeError, ValueError) as exc:
+                gap['error'] = str(exc)
+                gaps.append(gap)
+                continue
+            checked_records += gap['expected_records']
+            if stored_records < gap['expected_records']:
+                gaps.append(gap)
+
+    gaps.sort(key=lambda gap: (shard_label(gap['shard']), gap['day']))
+    missing = sum(gap['expected_records'] - gap['stored_records'] for gap in gaps if gap['error'] is None)
+    unchecked = sum(1 for gap in gaps if gap['error'] is not None)
+    print(f"Expected {checked_records} records; {missing} missing over {len(gaps) - unchecked} shard days, "
+          f"{unchecked} shard days could not be checked.")
+    return gaps
+
+
+def write_gap_report(gaps, path=GAP_REPORT):
+    with open(path, mode='w', newline='', encoding='utf-8') as file:
+        writer = csv.writer(file)
+        writer.writerow(['shard', 'day', 'expected_pages', 'expected_records', 'stored_records', 'missing_records',
+                         'error'])
+        for gap in gaps:
+            missing = gap['expected_records'] - gap['stored_records'] if gap['error'] is None else ''
+            writer.writerow([shard_label(gap['shard']), f"{gap['day']:%Y-%m-%d}", gap['expected_pages'],
+                             gap['expected_records'], gap['stored_records'], missing, gap['error'] or ''])
+    print(f"Gap report written to {path}.")
+
+
+def repair_gaps(conn, gaps, sink, workers=WORKERS, dead_letters=None, record_filter=None):
+    """
+    Re-fetches only the shard days in the gap report and writes the records that are not stored yet and pass the
+    job's filters.
+
+    Args:
+        conn: An open psycopg2 connection to the database holding fpds_raw.
+        gaps: The gaps from find_gaps().
+        sink: The job's Postgres sink.
+        workers: Worker threads, or "auto".
+        dead_letters: Optional DeadLetterFile.
+        record_filter: The job's FilterSet, whose local predicates the re-fetched records must pass, as in the job.
+
+    Returns:
+        The number of records written.
+    """
+    days = {(gap['shard'], gap['day']): build_query_url(f"{gap['day']:%Y-%m-%d}", f"{gap['day']:%Y-%m-%d}",
+                                                       dict(gap['shard'].criteria)) for gap in gaps}
+    written = 0
+
+    def on_shard_done(shard_day, records):
+        nonlocal written
+        if record_filter is not None:
+            records = record_filter.apply(records)
+        # Rows of the day that did load are skipped, so a repair never duplicates them
+        present = stored_keys(conn, *shard_day)
+        records = [record for record in records if natural_key(record) not in present]
+        sink.write(records)
+        written += len(records)
+
+    JobScheduler(workers, dead_letters, on_shard_done).run(days)
+    print(f"Repaired {len(days)} shard days with {written} missing records.")
+    return written
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check that a job's data is completely loaded and repair gaps.")
+    parser.add_argument('job_file', help="job spec file (.json, .toml or .yaml) with a postgres output")
+    parser.add_argument('--report', default=GAP_REPORT, help="gap report CSV")
+    parser.add_argument('--repair', action='store_true', help="re-fetch the shard days in the gap report")
+    args = parser.parse_args()
+
+    spec = load_job_spec(args.job_file)
+    output = dict(spec.get('output') or {})
+    if output.get('type') != 'postgres':
+        raise ValueError("verify_load.py checks jobs with a postgres output")
+    record_filter = FilterSet(spec.get('filters', []))
+    if record_filter.local:
+        print("Warning: the job filters records locally, so stored counts can be below the feed's counts.")
+    shards = [shard._replace(criteria=record_filter.query_criteria(shard.criteria)) for shard in expand_shards(spec)]
+
+    conn = psycopg2.connect(dbname=output.get('dbname', DATABASE), user=output.get('user', USER),
+                            password=output.get('password', PASSWORD), host=output.get('host', HOST),
+                            port=output.get('port', PORT))
+    try:
+        gaps = find_gaps(conn, shards)
+        write_gap_report(gaps, args.report)
+        if args.repair and gaps:
+            dead_letters = DeadLetterFile(spec.get('dead_letters', "dead_letters.jsonl"))
+            sink = create_sink(output, dead_letters, spec.get('fields'))
+            # The job's projection, see run_jobs.run_job()
+            set_projection(list(dict.fromkeys(list(spec.get('fields') or []) + list(sink.fields) +
+                                              record_filter.fields)))
+            try:
+                repair_gaps(conn, gaps, sink, spec.get('workers', WORKERS), dead_letters, record_filter)
+            finally:
+                sink.close()
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
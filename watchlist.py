@@ -0,0 +1,154 @@
+import argparse
+import random
+import time
+
+from dead_letters import DeadLetterFile
+from fpds_feed import PAGE_SIZE, build_query_url, fetch_page, page_start
+from job_spec import parse_date, split_range
+from sinks import create_sink
+from work_scheduler import WORKERS, JobScheduler
+
+# Watchlist key types: the query criteria key used for per-key queries and the record field checked in bulk pulls
+WATCHLIST_KEYS = {
+    'ultimate_uei': 'ultimateParentUEI',
+    'piid': 'PIID',
+    'naics': 'principalNAICSCode',
+    'funding_agency_id': 'fundingRequestingAgencyID',
+}
+
+# Keys probed to estimate the pages of a per-key query
+SAMPLE_SIZE = 20
+
+# Days per shard of a bulk pull; the scheduler holds a shard's pages until it completes, so this bounds memory
+BULK_SPLIT_DAYS = 1
+
+
+def load_watchlist(path):
+    """
+    Reads a watchlist file, one key per line. Blank lines and lines starting with # are skipped.
+
+    Returns:
+        The set of keys.
+    """
+    with open(path, encoding='utf-8') as file:
+        return {line.strip() for line in file if line.strip() and not line.startswith('#')}
+
+
+def probe_pages(url):
+    """
+    Fetches the first page of a query and returns how many pages the whole query has, from its 'last' link.
+    """
+    records, links = fetch_page(url)
+    if links['last']:
+        return page_start(links['last']) // PAGE_SIZE + 1
+    return 2 if links['next'] else 1
+
+
+def plan_watchlist(key_type, keys, start_date, end_date, criteria=None, sample_size=SAMPLE_SIZE):
+    """
+    Chooses between one query per key and one bulk query filtered locally, by their estimated page counts.
+
+    The bulk query is probed once. A sample of keys is probed to estimate the mean pages per key; every key costs at
+    least one request, even when it has no results.
+
+    Args:
+        key_type: A WATCHLIST_KEYS key, e.g. 'ultimate_uei'.
+        keys: The set of watchlist keys.
+        start_date: First LAST_MOD_DATE day, e.g. '2024-01-01'.
+        end_date: Last LAST_MOD_DATE day.
+        criteria: Optional other query criteria applied in both strategies.
+        sample_size: The number of keys probed.
+
+    Returns:
+        A tuple of ('per_key' or 'bulk', estimated per-key pages, estimated bulk pages).
+    """
+    criteria = dict(criteria or {})
+    bulk_pages = probe_pages(build_query_url(start_date, end_date, criteria))
+
+    sample = random.Random(0).sample(sorted(keys), min(sample_size, len(keys)))
+    sample_pages = [probe_pages(build_query_url(start_date, end_date, {**criteria, key_type: key})) for key in sample]
+    per_key_pages = round(sum(sample_pages) / len(sample_pages) * len(keys)) if sample_pages else 0
+
+    strategy = 'per_key' if per_key_pages < bulk_pages else 'bulk'
+    print(f"Watchlist plan: {len(keys)} {key_type} keys, about {per_key_pages} pages as per-key queries "
+          f"(mean {sum(sample_pages) / max(len(sample_pages), 1):.1f} pages over {len(sample)} sampled keys) vs "
+          f"{bulk_pages} pages as one bulk query filtered locally. Using {strategy}.")
+    return strategy, per_key_pages, bulk_pages
+
+
+def run_watchlist(key_type, keys, start_date, end_date, sink, criteria=None, strategy=None, workers=WORKERS,
+                  dead_letters=None, split_days=BULK_SPLIT_DAYS):
+    """
+    Fetches every record matching a watchlist into a sink, using the cheaper strategy.
+
+    A bulk pull runs as one shard per split_days days, each filtered and written as soon as it completes.
+
+    Args:
+        key_type: A WATCHLIST_KEYS key.
+        keys: The set of watchlist keys.
+        start_date: First LAST_MOD_DATE day.
+        end_date: Last LAST_MOD_DATE day.
+        sink: The sink receiving the records.
+        criteria: Optional other query criteria.
+        strategy: 'per_key' or 'bulk' to skip planning.
+        workers: Worker threads, or "auto".
+        dead_letters: Optional DeadLetterFile.
+        split_days: Days per shard of a bulk pull.
+
+    Returns:
+        The number of records written.
+    """
+    criteria = dict(criteria or {})
+    if strategy is None:
+        strategy, _, _ = plan_watchlist(key_type, keys, start_date, end_date, criteria)
+
+    field = WATCHLIST_KEYS[key_type]
+    written = 0
+
+    def on_shard_done(shard, records):
+        nonlocal written
+        if strategy == 'bulk':
+            # Set membership keeps the local filter O(1) per record however long the watchlist is
+            records = [record for record in records if record.get(field) in keys]
+        sink.write(records)
+        written += len(records)
+
+    scheduler = JobScheduler(workers, dead_letters, on_shard_done)
+    if strategy == 'per_key':
+        scheduler.run({key: build_query_url(start_date, end_date, {**criteria, key_type: key}) for key in keys})
+    else:
+        windows = split_range(parse_date(start_date), parse_date(end_date), split_days)
+        scheduler.run({f"bulk {window_start:%Y-%m-%d}": build_query_url(f"{window_start:%Y-%m-%d}",
+                                                                       f"{window_end:%Y-%m-%d}", criteria)
+                       for window_start, window_end in windows})
+    return written
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fetch every record matching a large watchlist of keys.")
+    parser.add_argument('key_type', choices=sorted(WATCHLIST_KEYS))
+    parser.add_argument('watchlist', help="file with one key per line")
+    parser.add_argument('--start', required=True, help="first LAST_MOD_DATE day, YYYY-MM-DD")
+    parser.add_argument('--end', required=True, help="last LAST_MOD_DATE day, YYYY-MM-DD")
+    parser.add_argument('--strategy', choices=['per_key', 'bulk'], help="skip planning and use this strategy")
+    parser.add_argument('--output', choices=['csv', 'postgres'], default='csv')
+    parser.add_argument('--path', default="fpds_data.csv", help="CSV output file")
+    args = parser.parse_args()
+
+    start_time = time.time()
+    keys = load_watchlist(args.watchlist)
+    dead_letters = DeadLetterFile()
+    output = {'type': 'csv', 'path': args.path} if args.output == 'csv' else {'type': 'postgres'}
+    sink = create_sink(output, dead_letters)
+    try:
+        written = run_watchlist(args.key_type, keys, args.start, args.end, sink, strategy=args.strategy,
+                                dead_letters=dead_letters)
+    finally:
+        sink.close()
+
+    duration = time.time() - start_time
+    print(f'Job complete. Total records parsed and stored: {written}. Time taken: {duration}')
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,306 @@
+import itertools
+import queue
+import threading
+import time
+from datetime import date, timedelta
+
+from change_feed import natural_key
+from fpds_feed import PAGE_SIZE, fetch_page, page_start, page_url, pin_upper_bound
+
+# Worker threads fetching pages: a number for a fixed pool, or "auto" to tune it from observed throughput
+WORKERS = "auto"
+
+# Bounds and starting point for the auto-tuned pool
+MIN_WORKERS = 2
+MAX_WORKERS = 64
+INITIAL_WORKERS = 10
+
+# Pages completed between auto-tuning decisions
+TUNING_WINDOW = 20
+
+# Rounds of re-fetching the pages of a finished shard that disagree with the page count of its first page
+SNAPSHOT_RETRIES = 2
+
+
+class AdaptiveConcurrency:
+    """
+    Hill-climbing controller for the number of active workers.
+
+    Every TUNING_WINDOW pages it compares throughput with the previous window: while throughput improves it keeps
+    moving the worker count in the same direction, and when it gets worse it turns around. Failed pages or page
+    latency well above the best seen (the feed is throttling or saturated) halve the worker count.
+    """
+
+    def __init__(self, initial=INITIAL_WORKERS, minimum=MIN_WORKERS, maximum=MAX_WORKERS, window=TUNING_WINDOW,
+                 fixed=False):
+        self.limit = initial
+        self.minimum = minimum
+        self.maximum = maximum
+        self.window = window
+        self.fixed = fixed
+        self.direction = 1
+        self.best_latency = None
+        self.last_throughput = None
+        self._window_start = time.monotonic()
+        self._latencies = []
+        self._errors = 0
+        self._lock = threading.Lock()
+        self.changed = threading.Condition(self._lock)
+
+    def record(self, seconds, ok=True):
+        """
+        Records one finished page and adjusts the limit at the end of each window.
+
+        Args:
+            seconds: How long the page took to fetch and parse.
+            ok: Whether the page succeeded.
+        """
+        if self.fixed:
+            return
+        with self._lock:
+            self._latencies.append(seconds)
+            if not ok:
+                self._errors += 1
+            if len(self._latencies) < self.window:
+                return
+
+            now = time.monotonic()
+            throughput = len(self._latencies) / max(now - self._window_start, 1e-6)
+            latency = sum(self._latencies) / len(self._latencies)
+            if self.best_latency is None or latency < self.best_latency:
+                self.best_latency = latency
+
+            old_limit = self.limit
+            if self._errors or latency > 3 * self.best_latency:
+                self.limit = max(self.minimum, self.limit // 2)
+                self.direction = 1
+            else:
+                if self.last_throughput is not None and throughput < self.last_throughput * 0.95:
+                    self.direction = -self.direction
+                step = max(1, self.limit // 4)
+                self.limit = min(self.maximum, max(self.minimum, self.limit + self.direction * step))
+            if self.limit != old_limit:
+                print(f"Workers {old_limit} -> {self.limit} ({throughput:.1f} pages/s, {latency:.2f}s/page, "
+                      f"{self._errors} errors)")
+                self.changed.notify_all()
+
+            self.last_throughput = throughput
+            self._window_start = now
+            self._latencies = []
+            self._errors = 0
+
+    def wait_for_turn(self, index, stop=None):
+        """
+        Blocks worker number index while it is above the current limit, or until the optional stop event is set.
+        """
+        with self._lock:
+            while index >= self.limit and not (stop is not None and stop.is_set()):
+                self.changed.wait(timeout=1.0)
+
+
+def pages_to_refetch(pages, page_count):
+    """
+    Returns the pages of a finished shard that disagree with the page count reported by its first page.
+
+    Every page before the last one should be full. Short or failed pages, and pages repeating a record already seen on
+    another page of the shard - what offset paging looks like when the result set shifts underneath it - are
+    returned for re-fetching.
+
+    Args:
+        pages: The shard's pages, mapping page number to its records (None for a failed page).
+        page_count: The page count from the first page's 'last' link, or None when the shard was paged by next
+            links, in which case only a failed first page is returned.
+    """
+    if page_count is None:
+        return [0] if pages.get(0, []) is None else []
+    refetch = set()
+    seen = {}
+    for page in range(page_count):
+        records = pages.get(page)
+        if records is None or not records or (page < page_count - 1 and len(records) != PAGE_SIZE):
+            refetch.add(page)
+        for record in records or []:
+            # By transaction, since a narrow projection can make distinct transactions look alike
+            key = natural_key(record)
+            if seen.setdefault(key, page) != page:
+                refetch.update((seen[key], page))
+    return sorted(refetch)
+
+
+class JobScheduler:
+    """
+    Runs many shards through one shared pool of workers whose unit of work is a single feed page.
+
+    The first page of every shard is fetched first; its 'last' link gives the shard's page count, and every
+    remaining page is put on one shared priority queue, smallest shards first. Idle workers take whichever page is
+    next, so a long shard is spread over the whole pool instead of paging serially on one thread while the rest sit
+    idle. The pool size is fixed or auto-tuned, see AdaptiveConcurrency.
+
+    Offset paging is only stable while the result set does not change, so every query's LAST_MOD_DATE range is
+    capped at yesterday, the last day no more records can be modified on, and each finished shard is checked against
+    the page count of its first page; pages that disagree are re-fetched, see pages_to_refetch(). Shards starting
+    today are skipped. With include_today, ranges are capped at today instead: records modified while a shard is
+    paged through then shift its offsets, and once SNAPSHOT_RETRIES rounds are used up the shard can miss or repeat
+    records, so this is only for callers that query today again later, as the polling daemon does.
+    """
+
+    def __init__(self, workers=WORKERS, dead_letters=None, on_shard_done=None, max_workers=MAX_WORKERS,
+                 include_today=False):
+        """
+        Args:
+            workers: The number of worker threads, or "auto" to tune it between MIN_WORKERS and max_workers.
+            dead_letters: Optional DeadLetterFile receiving the pages that failed.
+            on_shard_done: Optional function (shard, records) called from the scheduling thread as each shard
+                finishes, e.g. to write it to a sink.
+            max_workers: Upper bound for the auto-tuned pool.
+            include_today: Fetch records modified today too, whose pages can still change while they are fetched.
+        """
+        if workers == "auto":
+            self.concurrency = AdaptiveConcurrency(min(INITIAL_WORKERS, max_workers), min(MIN_WORKERS, max_workers),
+                                                   max_workers)
+            self.pool_size = max_workers
+        else:
+            self.concurrency = AdaptiveConcurrency(int(workers), int(workers), int(workers), fixed=True)
+            self.pool_size = int(workers)
+        self.dead_letters = dead_letters
+        self.on_shard_done = on_shard_done
+        self.include_today = include_today
+        # Shards still missing pages in the last run, known by the time on_shard_done is called
+        self.failed_shards = set()
+
+    def _fetch(self, url):
+        start = time.monotonic()
+        try:
+            records, links = fetch_page(url)
+        except Exception as exc:
+            print(f"{url} generated an exception: {exc}")
+            if self.dead_letters is not None:
+                self.dead_letters.record_page(url, exc)
+            self.concurrency.record(time.monotonic() - start, ok=False)
+            return None, {'next': None, 'last': None}
+        self.concurrency.record(time.monotonic() - start)
+        return records, links
+
+    def _worker(self, index, tasks, results, stop):
+        while True:
+            self.concurrency.wait_for_turn(index, stop)
+            _, _, shard, page, url = tasks.get()
+            if url is None:
+                return
+            records, links = self._fetch(url)
+            results.put((shard, page, url, records, links))
+
+    def run(self, shards):
+        """
+        Runs every shard.
+
+        Args:
+            shards: A dictionary mapping each shard (any hashable label, e.g. a job_spec.Shard or a UEI) to the URL
+                of its first page.
+
+        Returns:
+            The records of every shard, or an empty list when on_shard_done is set and takes care of them.
+        """
+        tasks = queue.PriorityQueue()
+        results = queue.Queue()
+        sequence = itertools.count()
+        pending = {}
+        pages = {}
+        first_urls = {}
+        page_counts = {}
+        rounds = {}
+        collected = []
+        total_records = 0
+        total_pages = 0
+        self.failed_shards = set()
+
+        def submit(priority, shard, page, url):
+            pending[shard] += 1
+            tasks.put((priority, next(sequence), shard, page, url))
+
+        # First pages go ahead of everything else so shard sizes are known early
+        last_day = date.today() if self.include_today else date.today() - timedelta(days=1)
+        snapshot = last_day.isoformat()
+        for shard, url in shards.items():
+            first_url = pin_upper_bound(url, snapshot)
+            if first_url is None:
+                print(f"Shard {shard} starts after {snapshot}, the last day fetched; skipping it.")
+                continue
+            first_urls[shard] = first_url
+            pending[shard] = 0
+            pages[shard] = {}
+            rounds[shard] = 0
+            submit(0, shard, 0, first_urls[shard])
+
+        stop = threading.Event()
+        threads = [threading.Thread(target=self._worker, args=(index, tasks, results, stop), daemon=True)
+                   for index in range(self.pool_size)]
+        for thread in threads:
+            thread.start()
+
+        try:
+            remaining = len(first_urls)
+            while remaining:
+                shard, page, url, records, links = results.get()
+                pending[shard] -= 1
+                total_pages += 1
+                pages[shard][page] = records
+
+                if page == 0 and records is not None and shard not in page_counts:
+                    page_counts[shard] = None
+                    if links['last']:
+                        # Every page is addressable by its start= offset, so queue them all at once
+                        page_count = page_start(links['last']) // PAGE_SIZE + 1
+                        page_counts[shard] = page_count
+                        for next_page in range(1, page_count):
+                            submit(page_count, shard, next_page, page_url(url, next_page * PAGE_SIZE))
+                    elif links['next']:
+                        submit(1, shard, 1, links['next'])
+                elif page > 0 and links['next'] and not links['last'] and page + 1 not in pages[shard]:
+                    # No 'last' link to size the shard with: follow the next links one page at a time
+                    submit(page + 1, shard, page + 1, links['next'])
+
+                if pending[shard] == 0 and rounds[shard] < SNAPSHOT_RETRIES:
+                    page_count = page_counts.get(shard)
+                    refetch = pages_to_refetch(pages[shard], page_count)
+                    if refetch:
+                        rounds[shard] += 1
+                        received = sum(len(page_records or []) for page_records in pages[shard].values())
+                        if page_count:
+                            expected = (page_count - 1) * PAGE_SIZE + len(pages[shard].get(page_count - 1) or [])
+                            print(f"Shard {shard}: expected {expected} records on {page_count} pages, received "
+                                  f"{received}; re-fetching pages {refetch}.")
+                        for refetch_page in refetch:
+                            submit(0, shard, refetch_page, page_url(first_urls[shard], refetch_page * PAGE_SIZE)
+                                   if refetch_page else first_urls[shard])
+
+                if pending[shard] == 0:
+                    shard_pages = pages.pop(shard)
+                    if any(page_records is None for page_records in shard_pages.values()):
+                        self.failed_shards.add(shard)
+                    # Reassemble the shard in page order, whatever order its pages finished in
+                    shard_records = [record for _, page_records in sorted(shard_pages.items())
+                                     for record in page_records or []]
+                    total_records += len(shard_records)
+                    remaining -= 1
+                    if self.on_shard_done is not None:
+                        self.on_shard_done(shard, shard_records)
+                    else:
+                        collected.extend(shard_records)
+        finally:
+            # Pages still queued when on_shard_done raised are dropped, so every worker reaches its stop task
+            while True:
+                try:
+                    tasks.get_nowait()
+                except queue.Empty:
+                    break
+            for _ in threads:
+                tasks.put((float('inf'), next(sequence), None, None, None))
+            # Wake any worker parked above the limit so it can see the stop task; the tuned limit itself is kept, so
+            # a scheduler reused across runs starts each one where the last left off
+            stop.set()
+            with self.concurrency.changed:
+                self.concurrency.changed.notify_all()
+
+        print(f"Ran {len(first_urls)} shards, {total_pages} pages, {total_records} records.")
+        return collected